@@ -0,0 +1,74 @@
+import os
+import json
+import tempfile
+from datetime import datetime, timezone
+from cache import set_default_permissions
+
+# Version of the artifact format: artifacts of another version are rejected
+ARTIFACT_VERSION = 1
+
+
+def _is_msgpack(path):
+    return path.lower().endswith((".msgpack", ".mpk"))
+
+
+def save_artifact(path, kind, data):
+    """
+    Saves the output of a pipeline stage, to be loaded by a later stage with `load_artifact`.
+
+    Artifacts are JSON, or MessagePack when the path ends in `.msgpack` (requires the msgpack package),
+    and are written atomically, so an interrupted stage never leaves a partial artifact behind.
+
+    Args:
+        path (str): The path of the artifact.
+        kind (str): The kind of the artifact, e.g. 'schema' or 'relationships'.
+        data (dict): The content of the artifact, JSON-serializable.
+    """
+    artifact = {
+        "version": ARTIFACT_VERSION,
+        "kind": kind,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "data": data,
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    if _is_msgpack(path):
+        import msgpack
+
+        payload = msgpack.packb(artifact, use_bin_type=True)
+    else:
+        payload = json.dumps(artifact).encode("utf-8")
+    with tempfile.NamedTemporaryFile("wb", dir=directory, suffix=".tmp", delete=False) as temp_file:
+        temp_file.write(payload)
+    set_default_permissions(temp_file.name)
+    os.replace(temp_file.name, path)
+
+
+def load_artifact(path, kind):
+    """
+    Loads an artifact saved by `save_artifact`.
+
+    Args:
+        path (str): The path of the artifact.
+        kind (str): The expected kind of the artifact.
+
+    Returns:
+        dict: The content of the artifact.
+
+    Raises:
+        ValueError: If the artifact is of another kind or of another version of the format.
+    """
+    if _is_msgpack(path):
+        import msgpack
+
+        with open(path, "rb") as artifact_file:
+            artifact = msgpack.unpackb(artifact_file.read(), raw=False)
+    else:
+        with open(path, encoding="utf-8") as artifact_file:
+            artifact = json.load(artifact_file)
+    if artifact.get("kind") != kind:
+        raise ValueError(f"{path} is a {artifact.get('kind')} artifact, expected a {kind} artifact")
+    if artifact.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"{path} has version {artifact.get('version')} of the artifact format, "
+                         f"expected version {ARTIFACT_VERSION}: run the stage producing it again")
+    return artifact["data"]
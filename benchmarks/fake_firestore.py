@@ -0,0 +1,235 @@
+import time
+import bisect
+import operator
+
+# Comparison operators of the field filters supported by the fake queries
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    ">": operator.gt,
+}
+
+
+class FakeFirestore:
+    """
+    In-memory stand-in for a Firestore client, implementing the calls made by `get_schema`.
+
+    Collections and subcollections are listed with `collections()`, and collections are queried with
+    `limit`, `order_by`, `start_at`/`start_after`/`end_at`/`end_before` cursors, `where` field filters, `stream()` and `count()`.
+    Every API call sleeps for `latency` seconds plus `document_latency` seconds per document returned,
+    outside of any lock, so that concurrent sampling behaves like concurrent network calls.
+
+    Args:
+        documents (dict): The data of each collection path (`users`, `users/u1/orders`), as a dictionary of
+                          document IDs to document data.
+        latency (float): The time taken by each API call, in seconds.
+        document_latency (float): The additional time taken per document returned, in seconds.
+    """
+
+    def __init__(self, documents, latency=0.0, document_latency=0.0):
+        self.latency = latency
+        self.document_latency = document_latency
+        self.calls = 0
+        self.documents_read = 0
+        self._collections = {}
+        self._subcollections = {}
+        for path, collection_documents in documents.items():
+            self._collections[path] = (sorted(collection_documents), collection_documents)
+            if "/" in path:
+                parent, name = path.rsplit("/", 1)
+                self._subcollections.setdefault(parent, []).append(name)
+
+    def _call(self, documents=0):
+        self.calls += 1
+        self.documents_read += documents
+        delay = self.latency + self.document_latency * documents
+        if delay:
+            time.sleep(delay)
+
+    def collections(self):
+        """
+        Lists the top-level collections.
+        """
+        self._call()
+        return [CollectionReference(self, path) for path in self._collections if "/" not in path]
+
+    def collection(self, path):
+        return CollectionReference(self, path)
+
+
+class DocumentReference:
+    """
+    Reference to a document of a FakeFirestore.
+    """
+
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collections(self):
+        """
+        Lists the subcollections of the document.
+        """
+        self._client._call()
+        return [CollectionReference(self._client, f"{self.path}/{name}")
+                for name in self._client._subcollections.get(self.path, [])]
+
+
+class DocumentSnapshot:
+    """
+    Document returned by the queries of a FakeFirestore.
+    """
+
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class Query:
+    """
+    Query of a collection of a FakeFirestore. Queries are immutable: each method returns a new query.
+    """
+
+    def __init__(self, collection, order=None, descending=False, start=None, start_inclusive=True, end=None,
+                 end_inclusive=True, limit=None, filters=()):
+        self._collection = collection
+        self._order = order
+        self._descending = descending
+        self._start = start
+        self._start_inclusive = start_inclusive
+        self._end = end
+        self._end_inclusive = end_inclusive
+        self._limit = limit
+        self._filters = filters
+
+    def _copy(self, **changes):
+        options = {
+            "order": self._order, "descending": self._descending, "start": self._start,
+            "start_inclusive": self._start_inclusive, "end": self._end, "end_inclusive": self._end_inclusive,
+            "limit": self._limit, "filters": self._filters,
+        }
+        options.update(changes)
+        return Query(self._collection, **options)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(order=field, descending=direction == "DESCENDING")
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, OPERATORS[op_string], value),))
+
+    def start_at(self, values):
+        return self._copy(start=_cursor_id(values), start_inclusive=True)
+
+    def start_after(self, values):
+        return self._copy(start=_cursor_id(values), start_inclusive=False)
+
+    def end_at(self, values):
+        return self._copy(end=_cursor_id(values), end_inclusive=True)
+
+    def end_before(self, values):
+        return self._copy(end=_cursor_id(values), end_inclusive=False)
+
+    def count(self, alias=None):
+        return AggregationQuery(self, alias)
+
+    def _results(self):
+        ids, data = self._collection._client._collections.get(self._collection.path, ((), {}))
+        if self._order in (None, "__name__"):
+            start, end = 0, len(ids)
+            if self._start is not None:
+                search = bisect.bisect_left if self._start_inclusive else bisect.bisect_right
+                start = search(ids, self._start)
+            if self._end is not None:
+                search = bisect.bisect_right if self._end_inclusive else bisect.bisect_left
+                end = search(ids, self._end)
+            selected = ids[start:end]
+            if self._descending:
+                selected = selected[::-1]
+        else:
+            selected = [doc_id for doc_id in ids if self._order in data[doc_id]]
+            selected.sort(key=lambda doc_id: data[doc_id][self._order], reverse=self._descending)
+        for field_path, compare, value in self._filters:
+            selected = [doc_id for doc_id in selected
+                        if field_path in data[doc_id] and _compare(compare, data[doc_id][field_path], value)]
+        if self._limit is not None:
+            selected = selected[:self._limit]
+        return selected, data
+
+    def stream(self):
+        """
+        Runs the query, returning an iterator of DocumentSnapshot.
+        """
+        selected, data = self._results()
+        self._collection._client._call(len(selected))
+        path = self._collection.path
+        client = self._collection._client
+        return iter([DocumentSnapshot(DocumentReference(client, f"{path}/{doc_id}"), data[doc_id])
+                     for doc_id in selected])
+
+    def get(self):
+        return list(self.stream())
+
+
+class CollectionReference(Query):
+    """
+    Reference to a collection of a FakeFirestore, queried as a whole.
+    """
+
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+        super().__init__(self)
+
+    def document(self, document_id):
+        return DocumentReference(self._client, f"{self.path}/{document_id}")
+
+
+class AggregationQuery:
+    """
+    count() aggregation of a query of a FakeFirestore.
+    """
+
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self):
+        selected, _ = self._query._copy(limit=None)._results()
+        self._query._collection._client._call()
+        return [[AggregationResult(self._alias, len(selected))]]
+
+
+def _cursor_id(values):
+    """
+    Returns the document ID of a `{"__name__": ...}` cursor, given as a document reference or an ID.
+    """
+    value = values["__name__"]
+    return value.id if isinstance(value, DocumentReference) else value
+
+
+def _compare(compare, left, right):
+    try:
+        return compare(left, right)
+    except TypeError:
+        # Firestore never matches values of different types
+        return False
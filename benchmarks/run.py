@@ -0,0 +1,211 @@
+"""
+Benchmarks the stages of the schema pipeline on synthetic databases, offline.
+
+Usage (from the root of the repository):
+    python -m benchmarks.run --sizes 10,100,1000,10000 --latency 0.02 --llm-latency 0.5 --concurrency 8
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+import utils
+import instrumentation
+from config import GRAPHVIZ_DOT, SCHEMA_MAX_WORKERS
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.stub_llm import AsyncStubOpenAI, StubOpenAI
+from benchmarks.synthetic import generate_database
+
+STAGES = ("extract", "relationships", "plantuml", "dot")
+
+# Timer of the operations of each stage, whose latency percentiles are reported
+OPERATION_TIMERS = {
+    "extract": "collection_seconds",
+    "relationships": "llm_request_seconds",
+    "dot": "render_seconds",
+}
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of a list of values, or None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def _stage_function(stage, database, relationships, options):
+    """
+    Returns a function running a stage once on a synthetic database.
+    """
+    if stage == "extract":
+        def run():
+            db = FakeFirestore(database["documents"], options.latency, options.document_latency)
+            utils.get_schema(db, max_workers=options.workers, max_depth=options.depth, profiles={})
+        return run
+
+    schema, profiles = database["schema"], database["profiles"]
+    if stage == "relationships":
+        def run():
+            if options.concurrency > 1:
+                async_client = AsyncStubOpenAI(relationships, options.llm_latency, options.token_latency)
+                asyncio.run(utils.identify_relationships_llm_async(
+                    schema, batch_size=options.batch_size, concurrency=options.concurrency,
+                    requests_per_minute=0, tokens_per_minute=0, async_client=async_client, cache=False,
+                ))
+            else:
+                utils.client = StubOpenAI(relationships, options.llm_latency, options.token_latency)
+                utils.identify_relationships_llm(schema, batch_size=options.batch_size, concurrency=1, cache=False)
+        return run
+    if stage == "plantuml":
+        return lambda: utils.generate_plantuml_text(schema, relationships, profiles=profiles)
+
+    output_file = os.path.join(database["directory"], "graph.png")
+    return lambda: utils.create_schema_graph_llm(schema, relationships, cache=False, output_file=output_file,
+                                                 profiles=profiles)
+
+
+def measure(stage, function, collections, repeat):
+    """
+    Runs a stage `repeat` times, then once more under tracemalloc to measure its peak memory.
+
+    The output of the stage is discarded. Timings are taken without tracemalloc, which slows down
+    allocations, and the latencies of the operations of the stage come from instrumentation hooks.
+
+    Returns:
+        dict: The number of runs, the median and maximum duration, the throughput in collections per
+              second, the number and latency percentiles of the operations, and the peak memory in bytes
+              allocated by Python during a run.
+    """
+    timer_name = OPERATION_TIMERS.get(stage)
+    latencies = []
+
+    def hook(kind, name, value, labels):
+        if kind == "timing" and name == timer_name:
+            latencies.append(value)
+
+    durations = []
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        instrumentation.add_hook(hook)
+        try:
+            for _ in range(repeat):
+                instrumentation.reset()
+                start = time.perf_counter()
+                function()
+                durations.append(time.perf_counter() - start)
+        finally:
+            instrumentation.remove_hook(hook)
+
+        tracemalloc.start()
+        try:
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    median = percentile(durations, 0.5)
+    return {
+        "stage": stage,
+        "collections": collections,
+        "runs": repeat,
+        "median_seconds": median,
+        "max_seconds": max(durations),
+        "collections_per_second": collections / median if median else None,
+        "operations": len(latencies) // repeat,
+        "p50_seconds": percentile(latencies, 0.5),
+        "p95_seconds": percentile(latencies, 0.95),
+        "p99_seconds": percentile(latencies, 0.99),
+        "peak_bytes": peak,
+    }
+
+
+def _format_milliseconds(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+
+def print_header():
+    print(f"{'collections':>11} {'stage':<13} {'median s':>9} {'coll/s':>10} {'ops':>6} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak MiB':>9}")
+
+
+def print_result(result):
+    """
+    Prints the result of the benchmark of a stage as a row of the table started by `print_header`.
+    """
+    throughput = result["collections_per_second"]
+    print(
+        f"{result['collections']:>11} {result['stage']:<13} {result['median_seconds']:>9.3f} "
+        f"{'-' if throughput is None else f'{throughput:.1f}':>10} {result['operations']:>6} "
+        f"{_format_milliseconds(result['p50_seconds']):>8} {_format_milliseconds(result['p95_seconds']):>8} "
+        f"{_format_milliseconds(result['p99_seconds']):>8} {result['peak_bytes'] / 2 ** 20:>9.1f}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the schema pipeline on synthetic databases.")
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated numbers of collections.")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated stages among {', '.join(STAGES)}.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs of each stage.")
+    parser.add_argument("--documents", type=int, default=20, help="Documents per collection.")
+    parser.add_argument("--fields", type=int, default=8, help="Plain fields per collection.")
+    parser.add_argument("--heterogeneity", type=float, default=0.2, help="From 0 (uniform documents) to 1.")
+    parser.add_argument("--fk-density", type=float, default=1.0, help="Average foreign keys per collection.")
+    parser.add_argument("--subcollections", type=float, default=0.0, help="Fraction of collections with subcollections.")
+    parser.add_argument("--depth", type=int, default=1, help="Depth of subcollections crawled by get_schema.")
+    parser.add_argument("--workers", type=int, default=SCHEMA_MAX_WORKERS, help="Threads of get_schema.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per Firestore API call.")
+    parser.add_argument("--document-latency", type=float, default=0.0, help="Seconds per Firestore document read.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds per LLM request.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per LLM completion token.")
+    parser.add_argument("--batch-size", type=int, default=0, help="Collections per LLM request (0 for one).")
+    parser.add_argument("--concurrency", type=int, default=1, help="LLM requests in flight.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic databases.")
+    parser.add_argument("--output", help="Writes the results as JSON to this file.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    stages = [stage for stage in options.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        sys.exit(f"Unknown stages: {', '.join(sorted(unknown))}")
+    if "dot" in stages and shutil.which(GRAPHVIZ_DOT) is None:
+        print(f"Graphviz ({GRAPHVIZ_DOT}) not found, skipping the dot stage")
+        stages.remove("dot")
+
+    results = []
+    print_header()
+    for size in (int(size) for size in options.sizes.split(",")):
+        documents, relationships = generate_database(
+            size, options.documents, options.fields, options.heterogeneity, options.fk_density,
+            options.subcollections, options.seed,
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            # The later stages run on the schema extracted from the synthetic database
+            profiles = {}
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                db = FakeFirestore(documents)
+                schema = utils.get_schema(db, max_workers=options.workers, max_depth=options.depth, profiles=profiles)
+            database = {"documents": documents, "schema": schema, "profiles": profiles, "directory": directory}
+            for stage in stages:
+                function = _stage_function(stage, database, relationships, options)
+                results.append(measure(stage, function, size, options.repeat))
+                print_result(results[-1])
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as output:
+            json.dump({"options": vars(options), "results": results}, output, indent=2)
+        print(f"Results saved as {options.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import re
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+from prompt_context import estimate_tokens
+
+# Patterns of the collections asked about by the relationship prompts of utils.py
+COLLECTION_PATTERN = re.compile(r"fields of the collection '(.+?)'\.")
+BATCH_PATTERN = re.compile(r"^- (.+)$", re.MULTILINE)
+RELATIONSHIPS_PATTERN = re.compile(r"RELATIONSHIPS:(.*)DICT OUTPUT:", re.DOTALL)
+
+
+class StubCompletions:
+    """
+    Answers the relationship prompts of `identify_relationships_llm` from known relationships.
+
+    The answers have the shape the real model is asked for: a list of relationships for the prompt about
+    one collection, a fenced dict for the formatting prompt, and JSON for the structured-output prompt
+    about a batch of collections. Each response reports a token usage estimated from its text.
+
+    Args:
+        relationships (dict): The relationships of each collection, e.g. from `synthetic.generate_database`.
+        latency (float): The time taken by each request, in seconds.
+        token_latency (float): The additional time taken per completion token, in seconds.
+    """
+
+    def __init__(self, relationships, latency=0.0, token_latency=0.0):
+        self.relationships = relationships
+        self.latency = latency
+        self.token_latency = token_latency
+        self.requests = 0
+
+    def _answer(self, request):
+        prompt = request["messages"][0]["content"]
+        if request.get("response_format"):
+            collections = BATCH_PATTERN.findall(prompt)
+            content = json.dumps({"relationships": [
+                {"collection": collection, "field": field, "related_collection": related_collection}
+                for collection in collections
+                for field, related_collection in self.relationships.get(collection, [])
+            ]})
+        elif "DICT OUTPUT:" in prompt:
+            found = RELATIONSHIPS_PATTERN.search(prompt).group(1)
+            pairs = dict(line.split(" -> ", 1) for line in found.strip().splitlines() if " -> " in line)
+            content = f"```python\n{json.dumps(pairs)}\n```"
+        else:
+            collection = COLLECTION_PATTERN.search(prompt).group(1)
+            found = self.relationships.get(collection)
+            content = "\n".join(f"{field} -> {related}" for field, related in found) if found else "None"
+
+        self.requests += 1
+        usage = SimpleNamespace(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(content))
+        message = SimpleNamespace(content=content)
+        response = SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+        return response, self.latency + self.token_latency * usage.completion_tokens
+
+    def create(self, **request):
+        response, delay = self._answer(request)
+        if delay:
+            time.sleep(delay)
+        return response
+
+
+class AsyncStubCompletions(StubCompletions):
+    """
+    Asynchronous version of StubCompletions, for `identify_relationships_llm_async`.
+    """
+
+    async def create(self, **request):
+        response, delay = self._answer(request)
+        await asyncio.sleep(delay)
+        return response
+
+
+class StubOpenAI:
+    """
+    Stand-in for the synchronous OpenAI client used by utils.py (`utils.client`).
+    """
+
+    def __init__(self, relationships, latency=0.0, token_latency=0.0):
+        self.chat = SimpleNamespace(completions=StubCompletions(relationships, latency, token_latency))
+
+
+class AsyncStubOpenAI:
+    """
+    Stand-in for the AsyncOpenAI client, passed as the `async_client` of `identify_relationships_llm_async`.
+    """
+
+    def __init__(self, relationships, latency=0.0, token_latency=0.0):
+        self.chat = SimpleNamespace(completions=AsyncStubCompletions(relationships, latency, token_latency))
@@ -0,0 +1,95 @@
+import random
+import string
+from datetime import datetime, timedelta, timezone
+
+# Characters of Firestore auto-generated document IDs
+AUTO_ID_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+# Value generators of the plain fields, one of which is picked for each field
+VALUE_TYPES = {
+    "string": lambda rng: "".join(rng.choices(string.ascii_lowercase, k=8)),
+    "int": lambda rng: rng.randint(0, 10000),
+    "float": lambda rng: rng.random() * 100,
+    "bool": lambda rng: rng.random() < 0.5,
+    "timestamp": lambda rng: datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randint(0, 10 ** 7)),
+    "map": lambda rng: {"kind": rng.choice(["a", "b", "c"]), "score": rng.randint(0, 10)},
+    "array": lambda rng: [rng.randint(0, 9) for _ in range(rng.randint(0, 3))],
+}
+
+
+def collection_name(index):
+    """
+    Returns the name of the synthetic collection at an index, e.g. `entity00042s`, referenced as `entity00042Id`.
+    """
+    return f"entity{index:05d}s"
+
+
+def generate_database(collections, documents=20, fields=8, heterogeneity=0.2, fk_density=1.0, subcollections=0.0,
+                      seed=0):
+    """
+    Generates a synthetic Firestore database, with a known set of foreign key relationships.
+
+    Every collection has `fields` plain fields of random types, and foreign key fields named after the
+    collection they reference (`entity00042Id`), holding IDs of documents of that collection.
+
+    Args:
+        collections (int): The number of top-level collections, e.g. from 10 to 10000.
+        documents (int): The number of documents of each collection.
+        fields (int): The number of plain fields of each collection.
+        heterogeneity (float): From 0 to 1, how much the documents of a collection differ: the probability
+                               that a document misses a field is half of it, the probability that it has a
+                               value of another type a quarter of it, and the probability that it has a rare
+                               field of its own the whole of it. 0 gives uniform collections.
+        fk_density (float): The average number of foreign key fields of a collection.
+        subcollections (float): The fraction of collections whose first documents have an `items` subcollection.
+        seed (int): The seed of the random generator, so that the database can be generated again.
+
+    Returns:
+        tuple: The documents of each collection path, as expected by `FakeFirestore`, and the relationships
+               of each collection path pattern, as returned by `identify_relationships`.
+    """
+    rng = random.Random(seed)
+    names = [collection_name(index) for index in range(collections)]
+    ids = {name: ["".join(rng.choices(AUTO_ID_ALPHABET, k=20)) for _ in range(documents)] for name in names}
+
+    data = {}
+    relationships = {}
+    for name in names:
+        field_types = {f"field{field_index}": rng.choice(list(VALUE_TYPES)) for field_index in range(fields)}
+        # The number of foreign keys follows a Poisson distribution around the density
+        foreign_keys = {}
+        remaining = rng.expovariate(1.0)
+        while collections > 1 and remaining < fk_density:
+            target = names[rng.randrange(collections - 1)]
+            if target == name:
+                target = names[-1]
+            foreign_keys[f"{target[:-1]}Id"] = target
+            remaining += rng.expovariate(1.0)
+        relationships[name] = list(foreign_keys.items())
+
+        collection_documents = {}
+        for doc_id in ids[name]:
+            document = {}
+            for field, value_type in field_types.items():
+                if rng.random() < heterogeneity / 2:
+                    continue
+                if rng.random() < heterogeneity / 4:
+                    value_type = rng.choice(list(VALUE_TYPES))
+                document[field] = VALUE_TYPES[value_type](rng)
+            for field, target in foreign_keys.items():
+                document[field] = rng.choice(ids[target])
+            if rng.random() < heterogeneity:
+                document[f"rare{rng.randrange(100)}"] = VALUE_TYPES["string"](rng)
+            collection_documents[doc_id] = document
+        data[name] = collection_documents
+
+        if rng.random() < subcollections:
+            pattern = f"{name}/*/items"
+            relationships[pattern] = [(f"{name[:-1]}Id", name)]
+            for doc_id in ids[name][:3]:
+                data[f"{name}/{doc_id}/items"] = {
+                    "".join(rng.choices(AUTO_ID_ALPHABET, k=20)): {"quantity": rng.randint(1, 5), f"{name[:-1]}Id": doc_id}
+                    for _ in range(max(1, documents // 4))
+                }
+    return data, relationships
+
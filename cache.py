@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+
+def _read_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Permissions of the files created by open(), which tempfile does not apply to its files (created 0600)
+FILE_MODE = 0o666 & ~_read_umask()
+
+
+def set_default_permissions(path):
+    """
+    Gives a file written through a temporary file the permissions it would have had if created by open().
+    """
+    os.chmod(path, FILE_MODE)
+
+
+def content_key(*parts):
+    """
+    Returns a content-addressed cache key for JSON-serializable parts.
+
+    Args:
+        *parts: The values identifying the cached entry.
+
+    Returns:
+        str: The SHA-256 hex digest of the parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    On-disk cache of byte values keyed by content hashes, with size- and age-based eviction.
+
+    Each entry is a file named after its key. Entries are written to a temporary file and atomically
+    renamed into place, so concurrent processes never read a partially written entry, and readers
+    tolerate entries removed by a concurrent eviction. Hits refresh the modification time of an entry,
+    which makes the size-based eviction least recently used. Entries and the outputs copied from them get
+    the permissions of files created by open().
+
+    Args:
+        directory (str): The directory holding the cache entries.
+        max_bytes (int): The maximum total size of the entries, or 0 for no limit.
+        max_age (float): The maximum age of an entry since it was last used, in seconds, or 0 for no limit.
+    """
+
+    def __init__(self, directory, max_bytes=0, max_age=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def path(self, key):
+        """
+        Returns the path of the file holding an entry.
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Returns the bytes stored for a key, or None if the key is not cached.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                value = cache_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def set(self, key, value):
+        """
+        Stores bytes for a key.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as temp_file:
+            temp_file.write(value)
+        set_default_permissions(temp_file.name)
+        os.replace(temp_file.name, path)
+
+    def copy(self, key, destination):
+        """
+        Copies the entry of a key to a destination path. An existing destination file is replaced.
+
+        The destination is a copy rather than a link, so editing it never changes the cached entry.
+
+        Returns:
+            bool: Whether the key was cached.
+        """
+        path = self.path(key)
+        directory = os.path.dirname(os.path.abspath(destination))
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(destination)}.", suffix=".tmp")
+        os.close(handle)
+        try:
+            shutil.copyfile(path, temp_path)
+            set_default_permissions(temp_path)
+            os.replace(temp_path, destination)
+        except FileNotFoundError:
+            os.remove(temp_path)
+            return False
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def get_json(self, key):
+        """
+        Returns the JSON value stored for a key, or None if the key is not cached.
+        """
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, key, value):
+        """
+        Stores a JSON-serializable value for a key.
+        """
+        self.set(key, json.dumps(value).encode("utf-8"))
+
+    def evict(self):
+        """
+        Removes the entries older than `max_age`, then the least recently used entries until the
+        total size is at most `max_bytes`.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                # Temporary files left behind by interrupted writes are removed once they are old
+                expired = self.max_age and now - stat.st_mtime > self.max_age
+                if expired or (name.endswith(".tmp") and now - stat.st_mtime > 3600):
+                    entries.append((0, stat.st_size, path))
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime and (not self.max_bytes or total <= self.max_bytes):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
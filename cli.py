@@ -0,0 +1,171 @@
+"""
+Command-line interface running the stages of the schema pipeline independently.
+
+    python cli.py extract [-o firestore_schema.json]
+    python cli.py relate [firestore_schema.json] [-o firestore_relationships.json]
+    python cli.py render [firestore_schema.json] [firestore_relationships.json] [-o diagram.png]
+
+Each stage writes an artifact (JSON, or MessagePack for `.msgpack` paths) read by the next one, so a
+failed stage is run again on its own: a failed `relate` does not read Firestore again, and resumes from
+the relationships cached by the requests that completed. Backends (firebase_admin, openai, plantuml)
+are only imported by the stages using them, so `render` starts quickly.
+"""
+import sys
+import argparse
+from datetime import datetime
+import instrumentation
+from artifacts import load_artifact, save_artifact
+from config import (
+    PARTITION_MAX_SIZE, PLANTUML_BACKEND, SCHEMA_EXPORT_PATH, SCHEMA_SNAPSHOT_FILE, RELATIONSHIPS_BATCH_SIZE,
+    RELATIONSHIPS_CONCURRENCY, METRICS_JSON_FILE, METRICS_PROMETHEUS_FILE,
+)
+
+# Default paths of the artifacts of the stages
+SCHEMA_ARTIFACT = "firestore_schema.json"
+RELATIONSHIPS_ARTIFACT = "firestore_relationships.json"
+
+
+def _load_schema(path):
+    """
+    Loads a schema artifact.
+
+    Returns:
+        tuple: The schema and the CollectionProfile of each collection.
+    """
+    from profiler import CollectionProfile
+
+    data = load_artifact(path, "schema")
+    profiles = {collection: CollectionProfile.from_dict(profile) for collection, profile in data["profiles"].items()}
+    return data["schema"], profiles
+
+
+def _load_relationships(path):
+    data = load_artifact(path, "relationships")
+    return {
+        collection: [tuple(relationship) for relationship in collection_relationships]
+        for collection, collection_relationships in data["relationships"].items()
+    }
+
+
+def extract(args):
+    """
+    Extracts the schema, from a managed export or by sampling the live database, and saves it with its profiles.
+    """
+    profiles = {}
+    stats = {}
+    if args.export:
+        from export_reader import read_export
+
+        schema = read_export(args.export, stats=stats, profiles=profiles)
+    else:
+        from firebase_admin import credentials, firestore, initialize_app
+        from snapshots import SnapshotStore
+        from utils import get_schema
+
+        initialize_app(credentials.ApplicationDefault())
+        snapshots = SnapshotStore(args.snapshots) if args.snapshots else None
+        schema = get_schema(firestore.client(), stats=stats, profiles=profiles, snapshots=snapshots)
+
+    save_artifact(args.output, "schema", {
+        "schema": schema,
+        "profiles": {collection: profile.to_dict() for collection, profile in profiles.items()},
+        "stats": stats,
+    })
+    print(f"Schema of {len(schema)} collections saved as {args.output}")
+
+
+def relate(args):
+    """
+    Identifies the relationships of a saved schema and saves them.
+    """
+    from utils import identify_relationships
+
+    schema, profiles = _load_schema(args.schema)
+    relationships = identify_relationships(
+        schema, profiles=profiles, use_llm=not args.no_llm, batch_size=args.batch_size, concurrency=args.concurrency
+    )
+    save_artifact(args.output, "relationships", {"relationships": relationships})
+    print(f"{sum(len(rels) for rels in relationships.values())} relationships saved as {args.output}")
+
+
+def render(args):
+    """
+    Renders the diagram of a saved schema and its saved relationships.
+    """
+    schema, profiles = _load_schema(args.schema)
+    relationships = _load_relationships(args.relationships)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    # Large schemas are rendered as several diagrams, linked from an index page
+    if len(schema) > args.partition_size:
+        from partition import render_partitions
+
+        output_dir = args.output or f"firestore_schema_llm_{timestamp}"
+        render_partitions(schema, relationships, output_dir, profiles=profiles, max_size=args.partition_size,
+                          kind=args.kind, backend=args.backend)
+    elif args.kind == "dot":
+        from utils import create_schema_graph_llm
+
+        output_file = args.output or f"firestore_schema_llm_{timestamp}.png"
+        create_schema_graph_llm(schema, relationships, output_file=output_file, profiles=profiles)
+        print(f"Schema graph saved as {output_file}")
+    else:
+        from utils import generate_plantuml_diagram
+
+        output_file = args.output or f"firestore_schema_llm_{timestamp}.png"
+        generate_plantuml_diagram(schema, relationships, output_file, profiles=profiles, backend=args.backend)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Visualizes the schema of a Firestore database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = commands.add_parser("extract", help="Extract the schema of the database.")
+    extract_parser.add_argument("-o", "--output", default=SCHEMA_ARTIFACT, help="The schema artifact to write.")
+    extract_parser.add_argument("--export", default=SCHEMA_EXPORT_PATH,
+                                help="Read a managed export instead of the live database.")
+    extract_parser.add_argument("--snapshots", default=SCHEMA_SNAPSHOT_FILE,
+                                help="Refresh the schema incrementally from this snapshot file.")
+    extract_parser.set_defaults(function=extract, stage="extract")
+
+    relate_parser = commands.add_parser("relate", help="Identify the relationships between collections.")
+    relate_parser.add_argument("schema", nargs="?", default=SCHEMA_ARTIFACT, help="The schema artifact to read.")
+    relate_parser.add_argument("-o", "--output", default=RELATIONSHIPS_ARTIFACT,
+                               help="The relationships artifact to write.")
+    relate_parser.add_argument("--no-llm", action="store_true", help="Only detect relationships locally.")
+    relate_parser.add_argument("--batch-size", type=int, default=RELATIONSHIPS_BATCH_SIZE,
+                               help="Collections per LLM request (0 for one collection per request).")
+    relate_parser.add_argument("--concurrency", type=int, default=RELATIONSHIPS_CONCURRENCY,
+                               help="LLM requests in flight.")
+    relate_parser.set_defaults(function=relate, stage="relationships")
+
+    render_parser = commands.add_parser("render", help="Render the schema and its relationships as diagrams.")
+    render_parser.add_argument("schema", nargs="?", default=SCHEMA_ARTIFACT, help="The schema artifact to read.")
+    render_parser.add_argument("relationships", nargs="?", default=RELATIONSHIPS_ARTIFACT,
+                               help="The relationships artifact to read.")
+    render_parser.add_argument("-o", "--output",
+                               help="The diagram to write, or the directory of the diagrams of a large schema.")
+    render_parser.add_argument("--kind", choices=("plantuml", "dot"), default="plantuml",
+                               help="UML class diagram (PlantUML) or graph (Graphviz).")
+    render_parser.add_argument("--backend", choices=("web", "local"), default=PLANTUML_BACKEND,
+                               help="How PlantUML diagrams are rendered.")
+    render_parser.add_argument("--partition-size", type=int, default=PARTITION_MAX_SIZE,
+                               help="Schemas with more collections are rendered as one diagram per partition.")
+    render_parser.set_defaults(function=render, stage="render")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    with instrumentation.timer("stage_seconds", stage=args.stage):
+        args.function(args)
+
+    print(instrumentation.summary())
+    if METRICS_JSON_FILE:
+        instrumentation.write_json(METRICS_JSON_FILE)
+    if METRICS_PROMETHEUS_FILE:
+        instrumentation.write_prometheus(METRICS_PROMETHEUS_FILE)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
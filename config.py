@@ -1,3 +1,86 @@
 import os
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-api-key")
+
+# Alternative OpenAI-compatible endpoint, e.g. a local stub server (None uses the OpenAI API)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# Maximum number of collections sampled concurrently by get_schema
+SCHEMA_MAX_WORKERS = int(os.getenv("SCHEMA_MAX_WORKERS", "8"))
+
+# Depth of subcollections crawled by get_schema (0 only samples top-level collections)
+SCHEMA_MAX_DEPTH = int(os.getenv("SCHEMA_MAX_DEPTH", "0"))
+
+# Maximum number of documents, per collection path pattern, whose subcollections are listed
+SCHEMA_MAX_FANOUT = int(os.getenv("SCHEMA_MAX_FANOUT", "10"))
+
+# Adaptive sampling: read pages spread across the key space until no new field shows up
+SCHEMA_ADAPTIVE_SAMPLING = os.getenv("SCHEMA_ADAPTIVE_SAMPLING", "false").lower() in ("1", "true", "yes")
+SCHEMA_PAGE_SIZE = int(os.getenv("SCHEMA_PAGE_SIZE", "10"))
+SCHEMA_PATIENCE = int(os.getenv("SCHEMA_PATIENCE", "3"))
+SCHEMA_MAX_PAGES = int(os.getenv("SCHEMA_MAX_PAGES", "20"))
+
+# Incremental refresh: snapshot file of the previous runs ("" rescans every collection), field holding the last
+# update time of each document ("" only detects changes through document counts), and documents read per refresh
+SCHEMA_SNAPSHOT_FILE = os.getenv("SCHEMA_SNAPSHOT_FILE", "")
+SCHEMA_WATERMARK_FIELD = os.getenv("SCHEMA_WATERMARK_FIELD", "")
+SCHEMA_REFRESH_LIMIT = int(os.getenv("SCHEMA_REFRESH_LIMIT", "500"))
+
+# State of the previous run ("" identifies every relationship again): the schema is diffed against it, and only the
+# collections affected by the changes are sent back through relationship identification
+SCHEMA_STATE_FILE = os.getenv("SCHEMA_STATE_FILE", "")
+SCHEMA_DIFF_DIAGRAM = os.getenv("SCHEMA_DIFF_DIAGRAM", "false").lower() in ("1", "true", "yes")
+
+# Managed export (`gcloud firestore export`) read by main.py instead of sampling the live database, and the number
+# of processes reading its files
+SCHEMA_EXPORT_PATH = os.getenv("SCHEMA_EXPORT_PATH", "")
+EXPORT_MAX_WORKERS = int(os.getenv("EXPORT_MAX_WORKERS", str(os.cpu_count() or 1)))
+
+# Distinct keys after which a map is treated as keyed by dynamic values and folded into `map.{*}`
+SCHEMA_MAX_MAP_KEYS = int(os.getenv("SCHEMA_MAX_MAP_KEYS", "50"))
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+
+# Rate limits and retries of the concurrent relationship requests (0 disables a limit)
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "30000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+
+# Collections sent per structured-output request by identify_relationships_llm (0 asks about one collection at a time)
+RELATIONSHIPS_BATCH_SIZE = int(os.getenv("RELATIONSHIPS_BATCH_SIZE", "0"))
+
+# Relationship requests in flight at the same time (1 sends them one after another)
+RELATIONSHIPS_CONCURRENCY = int(os.getenv("RELATIONSHIPS_CONCURRENCY", "1"))
+
+# On-disk cache of relationship results ("" disables it), evicted by total size and by days since last use
+RELATIONSHIPS_CACHE_DIR = os.getenv("RELATIONSHIPS_CACHE_DIR", ".cache/relationships")
+RELATIONSHIPS_CACHE_MAX_BYTES = int(os.getenv("RELATIONSHIPS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RELATIONSHIPS_CACHE_MAX_AGE = float(os.getenv("RELATIONSHIPS_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600
+
+# Token budget of the schema context sent in each relationship prompt (0 always sends the full schema)
+RELATIONSHIPS_CONTEXT_BUDGET = int(os.getenv("RELATIONSHIPS_CONTEXT_BUDGET", "4000"))
+
+# Build HyperLogLog/MinHash sketches of sampled values and document IDs for foreign key inference
+SCHEMA_SKETCHES = os.getenv("SCHEMA_SKETCHES", "true").lower() in ("1", "true", "yes")
+
+# Diagram rendering: "web" (public PlantUML server) or "local" (a warm plantuml.jar process, nothing leaves the machine)
+PLANTUML_BACKEND = os.getenv("PLANTUML_BACKEND", "web")
+PLANTUML_SERVER_URL = os.getenv("PLANTUML_SERVER_URL", "http://www.plantuml.com/plantuml/img/")
+PLANTUML_JAR = os.getenv("PLANTUML_JAR", "plantuml.jar")
+PLANTUML_JAVA = os.getenv("PLANTUML_JAVA", "java")
+
+# Graphviz executable laying out the schema graphs of create_schema_graph_llm
+GRAPHVIZ_DOT = os.getenv("GRAPHVIZ_DOT", "dot")
+
+# On-disk cache of rendered diagrams ("" disables it), evicted least recently used first by total size
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", ".cache/renders")
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Schemas with more collections than this are rendered as one diagram per partition, by parallel processes
+PARTITION_MAX_SIZE = int(os.getenv("PARTITION_MAX_SIZE", "40"))
+RENDER_MAX_WORKERS = int(os.getenv("RENDER_MAX_WORKERS", "4"))
+
+# Metrics of each run (stage and collection timings, Firestore reads, LLM tokens, rendering), written as JSON and as a
+# Prometheus textfile, e.g. for the node_exporter textfile collector ("" skips the file)
+METRICS_JSON_FILE = os.getenv("METRICS_JSON_FILE", "")
+METRICS_PROMETHEUS_FILE = os.getenv("METRICS_PROMETHEUS_FILE", "")
@@ -0,0 +1,366 @@
+import os
+import mmap
+import struct
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+import instrumentation
+from profiler import CollectionProfile
+from config import EXPORT_MAX_WORKERS
+
+# LevelDB log format: 32 KiB blocks of records, each with a 7-byte header (CRC32C, length, type)
+BLOCK_SIZE = 32768
+HEADER_SIZE = 7
+ZERO, FULL, FIRST, MIDDLE, LAST = 0, 1, 2, 3, 4
+
+# Protocol buffer wire types
+VARINT, FIXED64, LENGTH_DELIMITED, START_GROUP, END_GROUP, FIXED32 = 0, 1, 2, 3, 4, 5
+
+# Meanings of EntityProto properties used by Firestore exports
+GD_WHEN = 7
+GEORSS_POINT = 9
+BLOB = 14
+BYTESTRING = 16
+ENTITY_PROTO = 19
+EMPTY_LIST = 24
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class DocumentReference:
+    """
+    Reference value read from an export, standing in for the client library class of the same name.
+    """
+
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+
+class GeoPoint:
+    """
+    Geographical point read from an export, standing in for the client library class of the same name.
+    """
+
+    __slots__ = ("latitude", "longitude")
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+def iter_records(path):
+    """
+    Reads the records of a LevelDB log file, such as the `output-N` files of a Firestore export.
+
+    The file is memory-mapped, and records stored in a single fragment are returned as views of the
+    mapping without being copied. Checksums are not verified.
+
+    Args:
+        path (str): The path of the log file.
+
+    Yields:
+        memoryview: The bytes of each record.
+    """
+    with open(path, "rb") as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return
+        # The mapping stays valid after the file is closed, and is released with the last view of it
+        data = memoryview(mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    size = len(data)
+    position = 0
+    fragments = None
+    while position + HEADER_SIZE <= size:
+        block_left = BLOCK_SIZE - position % BLOCK_SIZE
+        if block_left < HEADER_SIZE:
+            # Block trailers too small for a header are zero-filled
+            position += block_left
+            continue
+        length = data[position + 4] | data[position + 5] << 8
+        record_type = data[position + 6]
+        start = position + HEADER_SIZE
+        end = start + length
+        if record_type == ZERO:
+            position += block_left
+            continue
+        if end > size:
+            raise ValueError(f"Truncated record at offset {position} of {path}")
+        position = end
+
+        if record_type == FULL:
+            yield data[start:end]
+        elif record_type == FIRST:
+            fragments = [data[start:end]]
+        elif record_type == MIDDLE and fragments is not None:
+            fragments.append(data[start:end])
+        elif record_type == LAST and fragments is not None:
+            fragments.append(data[start:end])
+            yield memoryview(b"".join(fragments))
+            fragments = None
+
+
+def _varint(buffer, position):
+    result = shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def _iter_fields(buffer, position, end):
+    """
+    Yields the (field number, wire type, value) of the fields of a protocol buffer message.
+
+    Varints are returned as integers, fixed-size values as views of their bytes, and length-delimited
+    values and groups as views of their contents, so nested messages are only decoded when needed.
+    """
+    while position < end:
+        # Tags and lengths mostly fit in one byte
+        key = buffer[position]
+        if key < 0x80:
+            position += 1
+        else:
+            key, position = _varint(buffer, position)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == VARINT:
+            value, position = _varint(buffer, position)
+        elif wire_type == LENGTH_DELIMITED:
+            length = buffer[position]
+            if length < 0x80:
+                position += 1
+            else:
+                length, position = _varint(buffer, position)
+            value = buffer[position:position + length]
+            position += length
+        elif wire_type == FIXED64:
+            value = buffer[position:position + 8]
+            position += 8
+        elif wire_type == FIXED32:
+            value = buffer[position:position + 4]
+            position += 4
+        elif wire_type == START_GROUP:
+            start = position
+            position, group_end = _skip_group(buffer, position, end, field)
+            value = buffer[start:group_end]
+        elif wire_type == END_GROUP:
+            return
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        yield field, wire_type, value
+
+
+def _skip_group(buffer, position, end, group_field):
+    """
+    Returns the position after the end of a group, and the position of its end tag.
+    """
+    while position < end:
+        tag_position = position
+        key, position = _varint(buffer, position)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == END_GROUP and field == group_field:
+            return position, tag_position
+        if wire_type == VARINT:
+            _, position = _varint(buffer, position)
+        elif wire_type == LENGTH_DELIMITED:
+            length, position = _varint(buffer, position)
+            position += length
+        elif wire_type == FIXED64:
+            position += 8
+        elif wire_type == FIXED32:
+            position += 4
+        elif wire_type == START_GROUP:
+            position, _ = _skip_group(buffer, position, end, field)
+    raise ValueError("Unterminated group")
+
+
+def _text(value):
+    return str(value, "utf-8")
+
+
+def _path_elements(buffer, element_field, type_field, id_field, name_field):
+    """
+    Returns the (kind, ID or name) pairs of a key path, i.e. alternating collection and document IDs.
+    """
+    elements = []
+    for field, _, element in _iter_fields(buffer, 0, len(buffer)):
+        if field != element_field:
+            continue
+        kind = name = None
+        for element_field_number, _, value in _iter_fields(element, 0, len(element)):
+            if element_field_number == type_field:
+                kind = _text(value)
+            elif element_field_number == id_field:
+                name = str(value)
+            elif element_field_number == name_field:
+                name = _text(value)
+        elements.append((kind, name))
+    return elements
+
+
+def _document_path(elements):
+    return "/".join(f"{kind}/{name}" for kind, name in elements)
+
+
+def _property_value(buffer, meaning):
+    """
+    Decodes a PropertyValue message to the Python value the client library would return.
+    """
+    for field, _, value in _iter_fields(buffer, 0, len(buffer)):
+        if field == 1:
+            if value >= 1 << 63:
+                value -= 1 << 64
+            return EPOCH + timedelta(microseconds=value) if meaning == GD_WHEN else value
+        if field == 2:
+            return bool(value)
+        if field == 3:
+            if meaning == ENTITY_PROTO:
+                return decode_properties(value)
+            if meaning in (BLOB, BYTESTRING):
+                return bytes(value)
+            return _text(value)
+        if field == 4:
+            return struct.unpack("<d", value)[0]
+        if field == 5:
+            coordinates = {number: struct.unpack("<d", data)[0] for number, _, data in _iter_fields(value, 0, len(value))}
+            return GeoPoint(coordinates.get(6, 0.0), coordinates.get(7, 0.0))
+        if field == 12:
+            return DocumentReference(_document_path(_path_elements(value, 14, 15, 16, 17)))
+    return [] if meaning == EMPTY_LIST else None
+
+
+def decode_properties(buffer):
+    """
+    Decodes the properties of an EntityProto message into document data.
+
+    Args:
+        buffer: The bytes of the message.
+
+    Returns:
+        dict: The fields of the document, with maps as dictionaries and arrays as lists.
+    """
+    data = {}
+    for field, _, property_buffer in _iter_fields(buffer, 0, len(buffer)):
+        # Indexed (14) and unindexed (15) properties
+        if field not in (14, 15):
+            continue
+        meaning = 0
+        name = None
+        multiple = False
+        value_buffer = b""
+        for property_field, _, value in _iter_fields(property_buffer, 0, len(property_buffer)):
+            if property_field == 1:
+                meaning = value
+            elif property_field == 3:
+                name = _text(value)
+            elif property_field == 4:
+                multiple = bool(value)
+            elif property_field == 5:
+                value_buffer = value
+        value = _property_value(value_buffer, meaning)
+        if multiple:
+            data.setdefault(name, []).append(value)
+        else:
+            data[name] = value
+    return data
+
+
+def decode_entity(record):
+    """
+    Decodes a document of a Firestore export.
+
+    Args:
+        record: The bytes of an EntityProto record.
+
+    Returns:
+        tuple: The path of the document (e.g. `users/u1/orders/o1`), or None if the entity has no key,
+               and its data.
+    """
+    elements = None
+    for field, _, value in _iter_fields(record, 0, len(record)):
+        if field == 13:
+            for key_field, _, key_value in _iter_fields(value, 0, len(value)):
+                if key_field == 14:
+                    elements = _path_elements(key_value, 1, 2, 3, 4)
+            break
+    path = _document_path(elements) if elements else None
+    return path, decode_properties(record)
+
+
+def _profile_shard(path):
+    """
+    Profiles the documents of one export file; runs in a worker process.
+
+    Returns:
+        dict: The CollectionProfile of each collection path pattern, in order of first appearance.
+    """
+    profiles = {}
+    for record in iter_records(path):
+        document_path, data = decode_entity(record)
+        if document_path is None:
+            continue
+        segments = document_path.split("/")
+        pattern = "/*/".join(segments[0::2])
+        profile = profiles.get(pattern)
+        if profile is None:
+            profile = profiles[pattern] = CollectionProfile()
+        profile.add_document(data, segments[-1])
+    return profiles
+
+
+def find_shards(export_path):
+    """
+    Lists the data files of a Firestore export (`output-0`, `output-1`, ...), in a stable order.
+    """
+    if os.path.isfile(export_path):
+        return [export_path]
+    shards = []
+    for root, _, files in os.walk(export_path):
+        shards.extend(os.path.join(root, name) for name in files if name.startswith("output-"))
+    # Natural order: output-2 before output-10
+    return sorted(shards, key=lambda shard: (os.path.dirname(shard), len(shard), shard))
+
+
+def read_export(export_path, max_workers=EXPORT_MAX_WORKERS, stats=None, profiles=None):
+    """
+    Retrieves the schema of a Firestore database from a managed export (`gcloud firestore export`).
+
+    Every document of the export is profiled, so the schema has full coverage, without any billed read
+    or network access. The export files are memory-mapped and profiled in parallel by a pool of
+    processes, one file at a time, and their profiles are merged in file order.
+
+    Args:
+        export_path (str): The directory of the export (or of one of its `kind_*` subdirectories),
+                           or a single `output-N` file.
+        max_workers (int): The number of processes reading files. Defaults to EXPORT_MAX_WORKERS.
+        stats (dict): An optional dictionary filled like the one of `get_schema`.
+        profiles (dict): An optional dictionary filled with the CollectionProfile of each collection.
+
+    Returns:
+        dict: The schema of the database, in the same shape as the one returned by `get_schema`.
+    """
+    shards = find_shards(export_path)
+    print(f"Reading {len(shards)} export files...")
+    if max_workers > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(shards))) as executor:
+            shard_profiles = list(executor.map(_profile_shard, shards))
+    else:
+        shard_profiles = [_profile_shard(shard) for shard in shards]
+
+    merged_profiles = {}
+    for collection_profiles in shard_profiles:
+        for pattern, profile in collection_profiles.items():
+            instrumentation.count("documents_read_total", profile.documents, source="export")
+            merged_profiles.setdefault(pattern, CollectionProfile()).merge(profile)
+
+    schema = {}
+    for pattern, profile in merged_profiles.items():
+        schema[pattern] = profile.field_names()
+        if profiles is not None:
+            profiles[pattern] = profile
+        if stats is not None:
+            stats[pattern] = {"documents": profile.documents, "reads": 0, "coverage": profile.coverage()}
+    return schema
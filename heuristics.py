@@ -0,0 +1,196 @@
+from prompt_context import KEY_SUFFIXES, build_collection_index, name_words, singular
+
+# Value types that cannot hold the key of another document
+NON_KEY_TYPES = {"null", "boolean", "double", "timestamp", "geopoint", "map", "bytes", "vector"}
+
+# Locality-sensitive hashing of MinHash signatures: bands of 2 rows (32 bands of a 64-value signature)
+# make collections whose IDs have a Jaccard similarity above ~0.2 with the values of a field candidates
+LSH_ROWS = 2
+
+# Minimum estimated share of the values of a field found among the document IDs of a collection
+MIN_CONTAINMENT = 0.5
+
+# Minimum estimated number of distinct values of a field matched against document IDs
+MIN_DISTINCT_VALUES = 2
+
+
+def _resolve_name(collection, field, index):
+    """
+    Resolves a field named `<singular>Id` (or `_id`, `Ref`, `Ids`, ...) to the collection it names.
+
+    When several collections match (e.g. `users` and `teams/*/users`), other collections are preferred
+    over the collection itself, then siblings of the collection, then top-level collections. Ambiguous
+    names are left unresolved.
+    """
+    words = name_words(field.split(".")[-1])
+    if len(words) < 2 or words[-1] not in KEY_SUFFIXES:
+        return None
+    base = "".join(words[:-1])
+    candidates = index.get(base) or index.get(singular(base)) or []
+    if len(candidates) > 1:
+        candidates = [candidate for candidate in candidates if candidate != collection]
+    if len(candidates) > 1:
+        parent = collection.rsplit("/", 1)[0] + "/" if "/" in collection else ""
+        siblings = [candidate for candidate in candidates if parent and candidate.startswith(parent)]
+        top_level = [candidate for candidate in candidates if "/" not in candidate]
+        candidates = siblings or top_level
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def _resolve_reference(field_profile, schema):
+    """
+    Resolves a field holding DocumentReference values to the known collection it points to most often.
+    """
+    targets = [pattern for pattern in field_profile.references if pattern in schema]
+    if not targets:
+        return None
+    return max(targets, key=lambda pattern: field_profile.references[pattern])
+
+
+def _may_hold_key(field, field_profile):
+    """
+    Returns whether a field could hold the key of another document, judging by its name and observed types.
+    """
+    if name_words(field.split(".")[-1]) == ["id"]:
+        # The ID of the document itself
+        return False
+    if field_profile is None:
+        return True
+    return any(type_name not in NON_KEY_TYPES for type_name in field_profile.types)
+
+
+def _looks_like_key(field, field_profile, min_distinct=MIN_DISTINCT_VALUES):
+    """
+    Returns whether a field that no rule resolved still looks like a foreign key: it is named like one
+    (`ownerId`, `parent_ref`), or most of the documents containing it hold values shaped like document IDs,
+    with at least `min_distinct` distinct values.
+    """
+    words = name_words(field.split(".")[-1])
+    if words and words[-1] in KEY_SUFFIXES:
+        return True
+    if field_profile is None or field_profile.id_values * 2 < field_profile.count:
+        return False
+    distinct = field_profile.values.count() if field_profile.values is not None else field_profile.id_values
+    return distinct >= min_distinct
+
+
+def infer_foreign_keys(profiles, threshold=MIN_CONTAINMENT, min_distinct=MIN_DISTINCT_VALUES, collections=None,
+                       overlapping=None):
+    """
+    Infers foreign key relationships from the overlap between field values and document IDs.
+
+    Uses the sketches built by CollectionProfile: a field is related to the collection whose sampled
+    document IDs contain the largest estimated share of its sampled values, if that share reaches the
+    threshold. Candidate collections are found through locality-sensitive hashing of their document ID
+    signatures, so the fields are not compared against every collection. This finds relationships that
+    names do not tell (`owner`, `ref`), but it only sees the overlap between samples: it works best on
+    small collections, large samples or full exports.
+
+    Args:
+        profiles (dict): The CollectionProfile of each collection, built with sketches enabled.
+        threshold (float): The minimum estimated containment of the field values in the document IDs.
+        min_distinct (int): The minimum estimated number of distinct values of a field.
+        collections (list): The collections whose fields are matched. Defaults to every collection; the
+                            document IDs of every collection are candidates either way.
+        overlapping (set): Optional set filled with the (collection, field) pairs whose sampled values
+                           overlap the document IDs of another collection, related or not.
+
+    Returns:
+        dict: The relationships, in the same shape as `identify_relationships_llm`.
+    """
+    buckets = {}
+    for collection, profile in profiles.items():
+        if profile.ids is None or profile.ids.minhash.is_empty():
+            continue
+        for band in profile.ids.minhash.bands(LSH_ROWS):
+            buckets.setdefault(band, []).append(collection)
+
+    relationships = {}
+    for collection in (profiles if collections is None else collections):
+        profile = profiles.get(collection)
+        if profile is None:
+            continue
+        relationships[collection] = []
+        for field, field_profile in profile.fields.items():
+            sketch = field_profile.values
+            if sketch is None or not _may_hold_key(field, field_profile):
+                continue
+            candidates = set()
+            for band in sketch.minhash.bands(LSH_ROWS):
+                candidates.update(buckets.get(band, ()))
+            # Fields repeating the ID of their own document (e.g. `uid` in `users`) are not foreign keys
+            candidates.discard(collection)
+
+            best, best_score = None, threshold
+            for candidate in sorted(candidates):
+                score = sketch.containment(profiles[candidate].ids)
+                if score > 0 and overlapping is not None:
+                    overlapping.add((collection, field))
+                if score >= best_score and sketch.count() >= min_distinct:
+                    best, best_score = candidate, score
+            if best is not None:
+                relationships[collection].append((field, best))
+    return relationships
+
+
+def detect_relationships(schema, profiles=None, collections=None):
+    """
+    Detects foreign key relationships with deterministic rules, without calling an LLM.
+
+    A field is related to a collection when the DocumentReference values sampled from it point to that
+    collection, when it is named after it (`userId`, `user_ids`, `authorRef` -> `users`, `authors`),
+    or when its sampled values overlap the document IDs of the collection (see `infer_foreign_keys`).
+    Fields that no rule resolves but that look like keys (see `_looks_like_key`) are returned as unresolved,
+    so that only they need to be sent to `identify_relationships_llm`. When document IDs were sketched,
+    fields whose sampled values overlap the document IDs of no other collection are not returned either.
+
+    Args:
+        schema (dict): The schema of the database, as returned by `get_schema`.
+        profiles (dict): Optional CollectionProfile of each collection, as filled by `get_schema`. They
+                         provide the referenced collections and rule out fields whose values cannot be keys.
+        collections (list): The collections whose fields are resolved. Defaults to every collection of
+                            the schema; every collection remains a possible target either way.
+
+    Returns:
+        tuple: The relationships, in the same shape as `identify_relationships_llm`, and the unresolved
+               fields of each collection that has any.
+    """
+    index = build_collection_index(schema)
+    inferred = {}
+    overlapping = set()
+    sketched = any(profile.ids is not None for profile in (profiles or {}).values())
+    for collection, collection_relationships in infer_foreign_keys(profiles or {}, collections=collections,
+                                                                   overlapping=overlapping).items():
+        for field, related_collection in collection_relationships:
+            if related_collection in schema:
+                inferred[(collection, field)] = related_collection
+
+    relationships = {}
+    unresolved = {}
+    for collection in (schema if collections is None else collections):
+        fields = schema[collection]
+        profile = (profiles or {}).get(collection)
+        relationships[collection] = []
+        for field in fields:
+            field_profile = profile.fields.get(field) if profile is not None else None
+            if not _may_hold_key(field, field_profile):
+                continue
+            related_collection = None
+            if field_profile is not None:
+                related_collection = _resolve_reference(field_profile, schema)
+            if related_collection is None:
+                related_collection = _resolve_name(collection, field, index)
+            if related_collection is None:
+                related_collection = inferred.get((collection, field))
+
+            if related_collection is not None:
+                relationships[collection].append((field, related_collection))
+            elif not _looks_like_key(field, field_profile):
+                continue
+            elif sketched and field_profile is not None and field_profile.values is not None \
+                    and (collection, field) not in overlapping:
+                # The sampled values are not the IDs of any sampled document
+                continue
+            else:
+                unresolved.setdefault(collection, []).append(field)
+    return relationships, unresolved
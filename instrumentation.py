@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from cache import set_default_permissions
+
+# Version of the JSON export format
+METRICS_VERSION = 1
+
+# Prefix of the exported Prometheus metric names
+METRICS_PREFIX = "firestore_schema_"
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metrics:
+    """
+    Thread-safe counters and timers of a run, with hooks notified of every event.
+
+    Counters add up amounts (documents read, API calls, tokens, retries); timers record the number,
+    total and maximum of durations. Both are keyed by a name and labels, e.g. the timer
+    `collection_seconds` labelled with `collection="users"`.
+
+    Hooks are callables invoked as `hook(kind, name, value, labels)` after each event, where `kind` is
+    'count' or 'timing' and `value` the amount or the duration in seconds, e.g. to log slow collections
+    or forward the events to a tracing system. Hooks run on the thread recording the event.
+    """
+
+    def __init__(self, hooks=None):
+        self.counters = {}
+        self.timers = {}
+        self.hooks = list(hooks or [])
+        self._lock = threading.Lock()
+
+    def _notify(self, kind, name, value, labels):
+        for hook in self.hooks:
+            hook(kind, name, value, labels)
+
+    def count(self, name, amount=1, **labels):
+        """
+        Adds an amount to a counter.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self._notify("count", name, amount, labels)
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records a duration in a timer.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = {"count": 0, "sum": 0.0, "max": 0.0}
+            timer["count"] += 1
+            timer["sum"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+        self._notify("timing", name, seconds, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Times the enclosed block, including when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def export(self):
+        """
+        Returns the counters and timers as a JSON-serializable dictionary.
+        """
+        with self._lock:
+            return {
+                "version": METRICS_VERSION,
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "timers": [
+                    {"name": name, "labels": dict(labels), **timer}
+                    for (name, labels), timer in sorted(self.timers.items())
+                ],
+            }
+
+    def merge(self, exported):
+        """
+        Adds the counters and timers exported by another Metrics, e.g. of a worker process.
+
+        Hooks are not notified: the events were already seen by the hooks where they were recorded.
+        """
+        with self._lock:
+            for counter in exported["counters"]:
+                key = (counter["name"], _label_key(counter["labels"]))
+                self.counters[key] = self.counters.get(key, 0) + counter["value"]
+            for other in exported["timers"]:
+                key = (other["name"], _label_key(other["labels"]))
+                timer = self.timers.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0})
+                timer["count"] += other["count"]
+                timer["sum"] += other["sum"]
+                timer["max"] = max(timer["max"], other["max"])
+
+    def total(self, name, **labels):
+        """
+        Returns the sum of a counter over the label values not given.
+        """
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(value for (counter_name, key), value in self.counters.items()
+                       if counter_name == name and wanted <= set(key))
+
+    def prometheus_text(self, prefix=METRICS_PREFIX):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        Counters are exported as counters, and timers as summaries (`_count` and `_sum`) with a `_max` gauge.
+        """
+        exported = self.export()
+        lines = []
+        typed = set()
+
+        def declare(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for counter in exported["counters"]:
+            name = prefix + counter["name"]
+            declare(name, "counter")
+            lines.append(f"{name}{_prometheus_labels(counter['labels'])} {counter['value']}")
+        for timer in exported["timers"]:
+            name = prefix + timer["name"]
+            labels = _prometheus_labels(timer["labels"])
+            declare(name, "summary")
+            lines.append(f"{name}_count{labels} {timer['count']}")
+            lines.append(f"{name}_sum{labels} {timer['sum']:.6f}")
+        for timer in exported["timers"]:
+            name = f"{prefix}{timer['name']}_max"
+            declare(name, "gauge")
+            lines.append(f"{name}{_prometheus_labels(timer['labels'])} {timer['max']:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _write_atomic(path, text):
+    """
+    Writes a file through a temporary file renamed into place, so collectors never read a partial file.
+
+    The file gets the permissions of files created by open(): collectors usually run as another user.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False) as temp_file:
+        temp_file.write(text)
+    set_default_permissions(temp_file.name)
+    os.replace(temp_file.name, path)
+
+
+# Metrics of the current run, recorded by the functions below
+metrics = Metrics()
+
+
+def count(name, amount=1, **labels):
+    """
+    Adds an amount to a counter of the current run.
+    """
+    metrics.count(name, amount, **labels)
+
+
+def observe(name, seconds, **labels):
+    """
+    Records a duration in a timer of the current run.
+    """
+    metrics.observe(name, seconds, **labels)
+
+
+def timer(name, **labels):
+    """
+    Times the enclosed block in a timer of the current run.
+
+    Example:
+        with instrumentation.timer("stage_seconds", stage="extract"):
+            schema = get_schema(db)
+    """
+    return metrics.timer(name, **labels)
+
+
+def add_hook(hook):
+    """
+    Registers a hook notified of every event of the current run, see `Metrics`.
+    """
+    metrics.hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Unregisters a hook added by `add_hook`.
+    """
+    metrics.hooks.remove(hook)
+
+
+def reset():
+    """
+    Clears the counters and timers of the current run, keeping the hooks.
+    """
+    global metrics
+    metrics = Metrics(metrics.hooks)
+
+
+@contextmanager
+def capture():
+    """
+    Records the events of the enclosed block in a separate Metrics, to be exported and merged elsewhere.
+
+    Used by the tasks of process pools, whose events would otherwise stay in the worker process:
+    the task returns `captured.export()` and the parent merges it into its metrics.
+
+    Yields:
+        Metrics: The metrics of the block, notifying the same hooks as the current run.
+    """
+    global metrics
+    previous = metrics
+    metrics = Metrics(previous.hooks)
+    try:
+        yield metrics
+    finally:
+        metrics = previous
+
+
+def merge(exported):
+    """
+    Adds metrics exported by another process to the current run.
+    """
+    metrics.merge(exported)
+
+
+def write_json(path):
+    """
+    Writes the metrics of the current run as JSON.
+    """
+    _write_atomic(path, json.dumps(metrics.export(), indent=2) + "\n")
+
+
+def write_prometheus(path):
+    """
+    Writes the metrics of the current run as a Prometheus textfile, e.g. for the textfile collector of
+    node_exporter (which only reads files ending in `.prom`).
+    """
+    _write_atomic(path, metrics.prometheus_text())
+
+
+def summary():
+    """
+    Returns a short report of where the current run spent its time and money.
+
+    Returns:
+        str: The duration of each stage, the slowest collections, the Firestore reads and API calls,
+             the LLM requests, tokens and retries, and the rendering time.
+    """
+    exported = metrics.export()
+    timers = exported["timers"]
+    lines = []
+    for timer_metric in timers:
+        if timer_metric["name"] == "stage_seconds":
+            lines.append(f"Stage {timer_metric['labels']['stage']}: {timer_metric['sum']:.2f}s")
+
+    collections = sorted(
+        (timer_metric for timer_metric in timers if timer_metric["name"] == "collection_seconds"),
+        key=lambda timer_metric: -timer_metric["sum"],
+    )
+    if collections:
+        slowest = ", ".join(f"{timer_metric['labels']['collection']} ({timer_metric['sum']:.2f}s)"
+                            for timer_metric in collections[:5])
+        lines.append(f"Slowest collections: {slowest}")
+
+    lines.append(
+        f"Firestore: {metrics.total('documents_read_total', source='firestore')} documents read, "
+        f"{metrics.total('billed_reads_total')} billed reads, "
+        f"{metrics.total('api_calls_total', service='firestore')} API calls"
+    )
+    lines.append(
+        f"LLM: {metrics.total('api_calls_total', service='openai')} requests, "
+        f"{metrics.total('llm_tokens_total', kind='prompt')} prompt tokens, "
+        f"{metrics.total('llm_tokens_total', kind='completion')} completion tokens, "
+        f"{metrics.total('llm_retries_total')} retries"
+    )
+    renders = [timer_metric for timer_metric in timers if timer_metric["name"] == "render_seconds"]
+    if renders or metrics.total("render_cache_hits_total"):
+        lines.append(
+            f"Rendering: {sum(timer_metric['count'] for timer_metric in renders)} diagrams in "
+            f"{sum(timer_metric['sum'] for timer_metric in renders):.2f}s, "
+            f"{metrics.total('render_cache_hits_total')} reused from the cache"
+        )
+    return "\n".join(lines)
@@ -1,5 +1,18 @@
 from firebase_admin import credentials, firestore, initialize_app
-from utils import get_schema, identify_relationships_llm, create_schema_graph_llm, generate_plantuml_text
+import json
+import instrumentation
+from utils import get_schema, identify_relationships, create_schema_graph_llm, generate_plantuml_text, generate_uml_diagram
+from partition import partition_schema, render_partitions
+from snapshots import SnapshotStore
+from export_reader import read_export
+from schema_diff import (
+    diff_schemas, is_empty, iter_diff_plantuml_lines, load_state, save_state, typed_schema,
+    update_partitions, update_relationships,
+)
+from config import (
+    PARTITION_MAX_SIZE, SCHEMA_EXPORT_PATH, SCHEMA_SNAPSHOT_FILE, SCHEMA_STATE_FILE, SCHEMA_DIFF_DIAGRAM,
+    METRICS_JSON_FILE, METRICS_PROMETHEUS_FILE,
+)
 from datetime import datetime
 
 def main():
@@ -12,20 +25,47 @@ def main():
     Returns:
         None
     """
-    # Initialize Firestore
-    cred = credentials.ApplicationDefault()
-    initialize_app(cred)
-    db = firestore.client()
-
-    # Extract schema
+    # Extract schema, from a managed export if there is one, otherwise by sampling the live database
     print("Extracting schema...\n")
-    schema = get_schema(db)
+    profiles = {}
+    with instrumentation.timer("stage_seconds", stage="extract"):
+        if SCHEMA_EXPORT_PATH:
+            schema = read_export(SCHEMA_EXPORT_PATH, profiles=profiles)
+        else:
+            # Initialize Firestore
+            cred = credentials.ApplicationDefault()
+            initialize_app(cred)
+            db = firestore.client()
+
+            snapshots = SnapshotStore(SCHEMA_SNAPSHOT_FILE) if SCHEMA_SNAPSHOT_FILE else None
+            schema = get_schema(db, profiles=profiles, snapshots=snapshots)
     print("Schema extracted:")
     print(schema)
 
-    # Identify relationships
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    state = load_state(SCHEMA_STATE_FILE) if SCHEMA_STATE_FILE else None
+    typed = typed_schema(schema, profiles)
+    partitions = None
+
+    # Identify relationships, only for the collections affected by the changes since the last run if any
     print("Identifying relationships...\n")
-    relationships = identify_relationships_llm(schema)
+    with instrumentation.timer("stage_seconds", stage="relationships"):
+        if state is None:
+            relationships = identify_relationships(schema, profiles=profiles)
+        else:
+            changeset = diff_schemas(state["schema"], typed)
+            changes_file = f'firestore_schema_changes_{timestamp}.json'
+            with open(changes_file, "w", encoding="utf-8") as changes:
+                json.dump(changeset, changes, indent=2)
+            print(f"Schema changes since the last run saved as {changes_file}")
+            relationships = update_relationships(
+                schema, state["relationships"], changeset, identify_relationships, profiles=profiles
+            )
+            if state["partitions"]:
+                partitions = update_partitions(state["partitions"], schema, relationships, changeset, PARTITION_MAX_SIZE)
+            if SCHEMA_DIFF_DIAGRAM and not is_empty(changeset):
+                diff_text = "\n".join(iter_diff_plantuml_lines(state["schema"], typed, relationships, changeset))
+                generate_uml_diagram(diff_text, f'firestore_schema_diff_{timestamp}.png')
     print("Relationships identified:")
     print(relationships)
 
@@ -34,12 +74,31 @@ def main():
     # create_schema_graph_llm(schema, relationships)
     # print("Schema graph created.")
 
-    # Generate PlantUML text and diagram
-    print("Generating PlantUML text and diagram...\n")
-    output_file = f'firestore_schema_llm_{datetime.now().strftime("%Y%m%d%H%M%S")}.png'
-    plantuml_text = generate_plantuml_text(schema, relationships, generate_diagram=True, output_file=output_file)
-    print("PlantUML text generated:")
-    print(plantuml_text)
+    # Large schemas are rendered as several diagrams, linked from an index page
+    with instrumentation.timer("stage_seconds", stage="render"):
+        if len(schema) > PARTITION_MAX_SIZE or partitions:
+            print("Generating partitioned PlantUML diagrams...\n")
+            if partitions is None:
+                partitions = partition_schema(schema, relationships)
+            output_dir = f'firestore_schema_llm_{timestamp}'
+            render_partitions(schema, relationships, output_dir, profiles=profiles, partitions=partitions)
+        else:
+            # Generate PlantUML text and diagram
+            print("Generating PlantUML text and diagram...\n")
+            output_file = f'firestore_schema_llm_{timestamp}.png'
+            plantuml_text = generate_plantuml_text(schema, relationships, generate_diagram=True, output_file=output_file, profiles=profiles)
+            print("PlantUML text generated:")
+            print(plantuml_text)
+
+    if SCHEMA_STATE_FILE:
+        save_state(SCHEMA_STATE_FILE, typed, relationships, partitions)
+
+    # Report where the run spent its time and money
+    print(instrumentation.summary())
+    if METRICS_JSON_FILE:
+        instrumentation.write_json(METRICS_JSON_FILE)
+    if METRICS_PROMETHEUS_FILE:
+        instrumentation.write_prometheus(METRICS_PROMETHEUS_FILE)
 
 if __name__ == "__main__":
     main()
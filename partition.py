@@ -0,0 +1,305 @@
+import os
+import html
+import instrumentation
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from render import render_plantuml_cached
+from utils import create_schema_graph_llm, generate_plantuml_diagram, iter_plantuml_lines
+from config import PARTITION_MAX_SIZE, RENDER_MAX_WORKERS, PLANTUML_BACKEND
+
+
+class UnionFind:
+    """
+    Disjoint sets of collections, with path halving and union by size.
+    """
+
+    def __init__(self, items):
+        self.parent = {item: item for item in items}
+        self.size = {item: 1 for item in items}
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def _adjacency(schema, relationships):
+    """
+    Returns the neighbours of each collection in the undirected relationship graph.
+    """
+    neighbours = {collection: set() for collection in schema}
+    for collection, collection_relationships in relationships.items():
+        if collection not in neighbours:
+            continue
+        for _, related_collection in collection_relationships:
+            if related_collection in neighbours and related_collection != collection:
+                neighbours[collection].add(related_collection)
+                neighbours[related_collection].add(collection)
+    return neighbours
+
+
+def connected_components(schema, relationships):
+    """
+    Returns the connected components of the relationship graph, largest first, each sorted by name so that
+    they do not depend on the order of the collections in the schema.
+
+    Args:
+        schema (dict): The schema of the database.
+        relationships (dict): The relationships between collections.
+
+    Returns:
+        list: The collections of each component.
+    """
+    sets = UnionFind(schema)
+    for collection, neighbours in _adjacency(schema, relationships).items():
+        for neighbour in neighbours:
+            sets.union(collection, neighbour)
+    components = {}
+    for collection in sorted(schema):
+        components.setdefault(sets.find(collection), []).append(collection)
+    return sorted(components.values(), key=lambda component: (-len(component), component[0]))
+
+
+def _split_component(component, neighbours, max_size):
+    """
+    Splits a component into communities of at most `max_size` collections.
+
+    Communities are grown breadth-first from the most connected collection not assigned yet, so that
+    each community keeps a collection together with its closest neighbours and most relationships stay
+    within a community.
+    """
+    assigned = set()
+    communities = []
+    seeds = sorted(component, key=lambda collection: (-len(neighbours[collection]), collection))
+    for seed in seeds:
+        if seed in assigned:
+            continue
+        community = []
+        queue = deque([seed])
+        assigned.add(seed)
+        while queue and len(community) < max_size:
+            collection = queue.popleft()
+            community.append(collection)
+            for neighbour in sorted(neighbours[collection]):
+                if neighbour not in assigned and len(community) + len(queue) < max_size:
+                    assigned.add(neighbour)
+                    queue.append(neighbour)
+        communities.append(community)
+    return communities
+
+
+def partition_schema(schema, relationships, max_size=PARTITION_MAX_SIZE):
+    """
+    Partitions the collections of a schema into groups small enough to be laid out as one diagram.
+
+    The relationship graph is split into connected components (union-find), components larger than
+    `max_size` are split into size-capped communities of neighbouring collections, and small groups are
+    packed together up to `max_size`, so that isolated collections do not each get their own diagram.
+    Everything runs in time linear in the size of the graph (plus sorting).
+
+    Args:
+        schema (dict): The schema of the database.
+        relationships (dict): The relationships between collections.
+        max_size (int): The maximum number of collections of a partition.
+
+    Returns:
+        list: The collections of each partition.
+    """
+    neighbours = _adjacency(schema, relationships)
+    groups = []
+    for component in connected_components(schema, relationships):
+        if len(component) > max_size:
+            groups.extend(_split_component(component, neighbours, max_size))
+        else:
+            groups.append(component)
+
+    # Pack the groups, largest first, into as few partitions as a single pass allows
+    groups.sort(key=lambda group: (-len(group), group[0]))
+    partitions = []
+    current = []
+    for group in groups:
+        if current and len(current) + len(group) > max_size:
+            partitions.append(current)
+            current = []
+        current.extend(group)
+    if current:
+        partitions.append(current)
+    return partitions
+
+
+def partition_name(index):
+    """
+    Returns the name of a partition, used for its files and the stereotypes of its stubs elsewhere.
+    """
+    return f"part-{index + 1:03d}"
+
+
+def partition_subgraphs(schema, relationships, partitions):
+    """
+    Extracts the schema and relationships of each partition.
+
+    Relationships crossing partitions are kept on both sides: the collection of the other partition
+    is drawn as a stub, named after the partition that details it.
+
+    Args:
+        schema (dict): The schema of the database.
+        relationships (dict): The relationships between collections.
+        partitions (list): The collections of each partition, as returned by `partition_schema`.
+
+    Returns:
+        list: A (schema, relationships, stubs) tuple for each partition, where stubs maps the collections
+              drawn from other partitions to the names of those partitions.
+    """
+    owner = {}
+    for index, collections in enumerate(partitions):
+        for collection in collections:
+            owner[collection] = index
+
+    subgraphs = [({collection: schema[collection] for collection in collections}, {}, {}) for collections in partitions]
+    for collection, collection_relationships in relationships.items():
+        if collection not in owner:
+            continue
+        source = owner[collection]
+        for field, related_collection in collection_relationships:
+            target = owner.get(related_collection)
+            subgraphs[source][1].setdefault(collection, []).append((field, related_collection))
+            if target is None:
+                continue
+            if target != source:
+                subgraphs[source][2][related_collection] = partition_name(target)
+                subgraphs[target][1].setdefault(collection, []).append((field, related_collection))
+                subgraphs[target][2][collection] = partition_name(source)
+    return subgraphs
+
+
+def _render_partition(task):
+    """
+    Renders the diagram of one partition; runs in a worker process.
+
+    Returns:
+        dict: The metrics recorded while rendering, to be merged into the metrics of the parent process.
+    """
+    kind, schema, relationships, stubs, profiles, output_file, backend, cache = task
+    with instrumentation.capture() as captured:
+        if kind == "dot":
+            create_schema_graph_llm(schema, relationships, cache=cache, output_file=output_file, stubs=stubs,
+                                    profiles=profiles)
+        else:
+            generate_plantuml_diagram(schema, relationships, output_file, profiles=profiles, backend=backend,
+                                      cache=cache, stubs=stubs)
+    return captured.export()
+
+
+def write_index(output_dir, partitions, subgraphs, image_files, title="Firestore schema"):
+    """
+    Writes an HTML page linking the diagrams of the partitions.
+
+    Returns:
+        str: The path of the index page.
+    """
+    lines = [
+        "<!DOCTYPE html>",
+        f"<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head><body>",
+        f"<h1>{html.escape(title)}</h1>",
+        f"<p>{sum(len(collections) for collections in partitions)} collections in "
+        f"{sum(1 for collections in partitions if collections)} diagrams.</p>",
+    ]
+    for index, (collections, (_, _, stubs), image_file) in enumerate(zip(partitions, subgraphs, image_files)):
+        if image_file is None:
+            continue
+        name = partition_name(index)
+        lines.append(f"<h2 id=\"{name}\"><a href=\"{html.escape(os.path.basename(image_file))}\">{name}</a></h2>")
+        lines.append("<p>" + ", ".join(html.escape(collection) for collection in collections) + "</p>")
+        linked = sorted(set(stubs.values()))
+        if linked:
+            links = ", ".join(f"<a href=\"#{other}\">{other}</a>" for other in linked)
+            lines.append(f"<p>Related to: {links}</p>")
+    lines.append("</body></html>")
+
+    index_file = os.path.join(output_dir, "index.html")
+    with open(index_file, "w", encoding="utf-8") as index:
+        index.write("\n".join(lines) + "\n")
+    return index_file
+
+
+def render_partitions(schema, relationships, output_dir, profiles=None, max_size=PARTITION_MAX_SIZE,
+                      kind="plantuml", backend=PLANTUML_BACKEND, fmt="png", max_workers=RENDER_MAX_WORKERS,
+                      cache=None, partitions=None):
+    """
+    Renders a large schema as one diagram per partition, in parallel, with an HTML index page.
+
+    Laying out one diagram costs more than linear time in its number of classes, so laying out many
+    size-capped diagrams costs roughly linear time in the size of the schema, and the parts are laid
+    out concurrently by a pool of processes. With the local PlantUML backend, the diagrams are instead
+    rendered in a single batch by the warm PlantUML process of this process, since each worker would
+    start a JVM of its own.
+
+    Args:
+        schema (dict): The schema of the database.
+        relationships (dict): The relationships between collections.
+        output_dir (str): The directory of the diagrams and the index page, created if needed.
+        profiles (dict): Optional CollectionProfile of each collection, see `generate_plantuml_text`.
+        max_size (int): The maximum number of collections of a diagram. Defaults to PARTITION_MAX_SIZE.
+        kind (str): 'plantuml' for UML class diagrams, or 'dot' for Graphviz graphs (always PNG).
+        backend (str): The PlantUML backend, see `generate_uml_diagram`. Defaults to PLANTUML_BACKEND.
+        fmt (str): The image format of the PlantUML diagrams, 'png' or 'svg' (local backend only).
+        max_workers (int): The number of rendering processes. Defaults to RENDER_MAX_WORKERS.
+        cache (DiskCache): The cache of rendered diagrams, see `generate_uml_diagram`.
+        partitions (list): The collections of each partition, e.g. kept from a previous run by
+                           `schema_diff.update_partitions`. Defaults to `partition_schema`. Partitions that
+                           did not change are not rendered again, thanks to the render cache.
+
+    Returns:
+        str: The path of the index page.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if partitions is None:
+        partitions = partition_schema(schema, relationships, max_size)
+    subgraphs = partition_subgraphs(schema, relationships, partitions)
+    extension = "png" if kind == "dot" or backend != "local" else fmt
+
+    tasks = []
+    image_files = []
+    for index, (sub_schema, sub_relationships, stubs) in enumerate(subgraphs):
+        if not sub_schema:
+            # Partitions emptied by `schema_diff.update_partitions` keep their place, without a diagram
+            image_files.append(None)
+            continue
+        image_file = os.path.join(output_dir, f"{partition_name(index)}.{extension}")
+        sub_profiles = {collection: profiles[collection] for collection in sub_schema if collection in profiles} \
+            if profiles else None
+        tasks.append((kind, sub_schema, sub_relationships, stubs, sub_profiles, image_file, backend, cache))
+        image_files.append(image_file)
+
+    print(f"Rendering {len(schema)} collections as {len(tasks)} diagrams...")
+    if kind == "plantuml" and backend == "local":
+        diagrams = [
+            iter_plantuml_lines(sub_schema, sub_relationships, sub_profiles, stubs)
+            for _, sub_schema, sub_relationships, stubs, sub_profiles, _, _, _ in tasks
+        ]
+        output_files = [task[5] for task in tasks]
+        cached = render_plantuml_cached(diagrams, output_files, fmt=extension, cache=cache)
+        print(f"{len(tasks) - cached} diagrams rendered, {cached} reused from the render cache")
+        rendered = []
+    elif max_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+            rendered = list(executor.map(_render_partition, tasks))
+    else:
+        rendered = [_render_partition(task) for task in tasks]
+    for exported in rendered:
+        instrumentation.merge(exported)
+
+    index_file = write_index(output_dir, partitions, subgraphs, image_files)
+    print(f"Index of the diagrams saved as {index_file}")
+    return index_file
@@ -0,0 +1,444 @@
+import re
+from datetime import datetime
+from config import SCHEMA_MAX_MAP_KEYS, SCHEMA_SKETCHES
+from sketches import ValueSketch
+
+# Path segment standing for every key of a map keyed by dynamic values (e.g. `scores.{*}`)
+WILDCARD = "{*}"
+
+# Values that look like document IDs rather than text
+ID_PATTERNS = [
+    re.compile(r"^\d+$"),  # numeric IDs, epoch timestamps
+    re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"),  # UUIDs
+    re.compile(r"^[0-9a-fA-F]{16,}$"),  # hex digests
+    re.compile(r"^(?=.*\d)(?=.*[A-Za-z])[A-Za-z0-9_-]{20,}$"),  # auto-generated document IDs, auth UIDs
+    re.compile(r"^[A-Za-z]+[_-]?\d+$"),  # prefixed sequential IDs (`user0042`, `order_17`)
+]
+
+# Map keys that look like identifiers or timestamps rather than field names
+DYNAMIC_KEY_PATTERNS = ID_PATTERNS[:4] + [
+    re.compile(r"^\d{4}-?\d{2}-?\d{2}"),  # dates, ISO timestamps
+]
+
+# Number of distinct collections recorded as targets of a reference field
+MAX_REFERENCE_TARGETS = 8
+
+# Firestore value types, keyed by the Python type returned by the client library
+VALUE_TYPES = {
+    bool: "boolean",
+    int: "integer",
+    float: "double",
+    str: "string",
+    bytes: "bytes",
+    list: "array",
+    tuple: "array",
+    dict: "map",
+}
+
+# Firestore value types whose Python classes live in the google-cloud-firestore package
+CLASS_TYPES = {
+    "DocumentReference": "reference",
+    "AsyncDocumentReference": "reference",
+    "GeoPoint": "geopoint",
+    "Vector": "vector",
+}
+
+
+def value_type(value):
+    """
+    Returns the Firestore type name of a value read from a document.
+
+    Args:
+        value: A field value, as returned by `DocumentSnapshot.to_dict()`.
+
+    Returns:
+        str: The type name, e.g. 'string', 'integer', 'timestamp', 'reference', 'geopoint', 'array' or 'map'.
+    """
+    if value is None:
+        return "null"
+    if isinstance(value, datetime):
+        # Also covers DatetimeWithNanoseconds, used by the client for Timestamp values
+        return "timestamp"
+    value_class = type(value)
+    if value_class in VALUE_TYPES:
+        return VALUE_TYPES[value_class]
+    return CLASS_TYPES.get(value_class.__name__, value_class.__name__)
+
+
+def reference_pattern(path):
+    """
+    Returns the collection path pattern of a document path (`users/u1/orders/o1` -> `users/*/orders`).
+    """
+    segments = path.strip("/").split("/")
+    return "/*/".join(segments[:-1][0::2])
+
+
+def key_value(value):
+    """
+    Returns the document ID a string or DocumentReference value may stand for (`users/u1` -> `u1`).
+    """
+    path = value.path if value_type(value) == "reference" else value
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def looks_like_id(value):
+    """
+    Returns whether a string or DocumentReference value looks like the ID of a document rather than text.
+    """
+    return value_type(value) == "reference" or any(pattern.match(key_value(value)) for pattern in ID_PATTERNS)
+
+
+def is_dynamic_key(key):
+    """
+    Returns whether a map key looks like an ID or a timestamp rather than a field name.
+    """
+    return any(pattern.match(key) for pattern in DYNAMIC_KEY_PATTERNS)
+
+
+def estimate_coverage(fields, documents):
+    """
+    Estimates the share of field occurrences covered by a sample.
+
+    Uses the Chao-Jost sample coverage estimator for incidence data: fields seen in only one or two
+    sampled documents indicate how likely it is that more fields remain unseen.
+
+    Args:
+        fields (dict): The number of sampled documents containing each field.
+        documents (int): The number of sampled documents.
+
+    Returns:
+        float: The estimated coverage, between 0 and 1.
+    """
+    total = sum(fields.values())
+    singletons = sum(1 for count in fields.values() if count == 1)
+    if not total or not singletons:
+        return 1.0
+    doubletons = sum(1 for count in fields.values() if count == 2)
+    denominator = (documents - 1) * singletons + 2 * doubletons
+    correction = (documents - 1) * singletons / denominator if denominator else 1.0
+    return max(0.0, 1.0 - singletons / total * correction)
+
+
+class FieldProfile:
+    """
+    Counters for a single field path of a collection.
+
+    Attributes:
+        count (int): The number of profiled documents containing the field.
+        types (dict): The number of occurrences of each Firestore value type.
+        references (dict): The number of DocumentReference values pointing to each collection path pattern,
+                           including references inside arrays, for up to MAX_REFERENCE_TARGETS patterns.
+        values (ValueSketch): Sketch of the document IDs the string and reference values may stand for,
+                              or None if no such value was sketched.
+        id_values (int): The number of string and reference values, including inside arrays, that look
+                         like document IDs (see `looks_like_id`).
+    """
+
+    __slots__ = ("count", "types", "references", "values", "id_values")
+
+    def __init__(self):
+        self.count = 0
+        self.types = {}
+        self.references = {}
+        self.values = None
+        self.id_values = 0
+
+    def add(self, type_name, new_document=True):
+        if new_document:
+            self.count += 1
+        self.types[type_name] = self.types.get(type_name, 0) + 1
+
+    def add_reference(self, path):
+        pattern = reference_pattern(path)
+        if pattern in self.references or len(self.references) < MAX_REFERENCE_TARGETS:
+            self.references[pattern] = self.references.get(pattern, 0) + 1
+
+    def add_value(self, value):
+        if self.values is None:
+            self.values = ValueSketch()
+        self.values.add(key_value(value))
+
+    def merge(self, other, same_documents=False):
+        # Fields folded together were counted on the same documents, so their counts overlap
+        self.count = max(self.count, other.count) if same_documents else self.count + other.count
+        for type_name, count in other.types.items():
+            self.types[type_name] = self.types.get(type_name, 0) + count
+        for pattern, count in other.references.items():
+            if pattern in self.references or len(self.references) < MAX_REFERENCE_TARGETS:
+                self.references[pattern] = self.references.get(pattern, 0) + count
+        if other.values is not None:
+            if self.values is None:
+                self.values = ValueSketch()
+            self.values.merge(other.values)
+        self.id_values += other.id_values
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "types": self.types,
+            "references": self.references,
+            "values": None if self.values is None else self.values.to_dict(),
+            "id_values": self.id_values,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        field = cls()
+        field.count = data["count"]
+        field.types = dict(data["types"])
+        field.references = dict(data["references"])
+        field.values = None if data["values"] is None else ValueSketch.from_dict(data["values"])
+        # Profiles saved before ID-shaped values were counted
+        field.id_values = data.get("id_values", 0)
+        return field
+
+
+class CollectionProfile:
+    """
+    Streaming profile of the documents sampled from a collection.
+
+    Fields are kept in an insertion-ordered dictionary keyed by their path, where fields nested in maps
+    are flattened to dotted paths (e.g. `address.city`). Each document is profiled in time linear in
+    its number of fields, and the memory used per field is constant.
+
+    Maps keyed by dynamic values (user IDs, dates, ...) are folded into a single wildcard path such as
+    `scores.{*}`, once one of their keys looks like an ID or a timestamp or once they have more than
+    `max_map_keys` distinct keys. The distinct keys of each map are only tracked up to that threshold,
+    so the size of the profile stays bounded no matter how many documents are profiled.
+
+    Attributes:
+        fields (dict): The FieldProfile of each field path, in order of first appearance.
+        documents (int): The number of profiled documents.
+        reads (int): The number of billed reads spent sampling the collection.
+        complete (bool): Whether every document of the collection was profiled.
+        dynamic (set): The paths of the maps folded into a wildcard path.
+        ids (ValueSketch): Sketch of the IDs of the profiled documents, or None if sketches are disabled.
+
+    With `sketches` enabled, the string and reference values of each field are also summarized in a
+    ValueSketch (HyperLogLog and MinHash), which lets `heuristics.infer_foreign_keys` match fields
+    against the document IDs of other collections in constant memory per field.
+    """
+
+    def __init__(self, max_map_keys=SCHEMA_MAX_MAP_KEYS, sketches=SCHEMA_SKETCHES):
+        self.fields = {}
+        self.documents = 0
+        self.reads = 0
+        self.complete = True
+        self.dynamic = set()
+        self.max_map_keys = max_map_keys
+        self.sketches = sketches
+        self.ids = ValueSketch() if sketches else None
+        self._map_keys = {}
+
+    def add_document(self, data, doc_id=None, new_document=True):
+        """
+        Profiles the fields of a document.
+
+        Args:
+            data (dict): The document data, as returned by `DocumentSnapshot.to_dict()`.
+            doc_id (str): The ID of the document, added to the document ID sketch.
+            new_document (bool): Whether the document was not profiled before. The new version of a profiled
+                                 document only adds its types and values: neither the document nor the
+                                 presence of its fields are counted again, except for fields seen for the
+                                 first time.
+
+        Returns:
+            bool: Whether the document contained a field path that was not in the profile yet.
+        """
+        if new_document:
+            self.documents += 1
+            if self.ids is not None and doc_id is not None:
+                self.ids.add(doc_id)
+        return self._add_map(data, "", set(), new_document)
+
+    def _add_map(self, data, map_path, seen, new_document=True):
+        if map_path:
+            self._track_keys(map_path, data)
+            prefix = map_path + "."
+        else:
+            prefix = ""
+        dynamic = map_path in self.dynamic
+
+        new_field = False
+        for key, value in data.items():
+            path = prefix + (WILDCARD if dynamic else key)
+            field = self.fields.get(path)
+            if field is None:
+                field = self.fields[path] = FieldProfile()
+                new_field = True
+            type_name = value_type(value)
+            field.add(type_name, new_document=path not in seen and (new_document or not field.count))
+            seen.add(path)
+            if type_name == "map":
+                new_field = self._add_map(value, path, seen, new_document) or new_field
+            elif type_name in ("reference", "string"):
+                self._add_value(field, value, type_name)
+            elif type_name == "array":
+                for element in value:
+                    element_type = value_type(element)
+                    if element_type in ("reference", "string"):
+                        self._add_value(field, element, element_type)
+        return new_field
+
+    def _add_value(self, field, value, type_name):
+        if type_name == "reference":
+            field.add_reference(value.path)
+        if looks_like_id(value):
+            field.id_values += 1
+        if self.sketches:
+            field.add_value(value)
+
+    def _track_keys(self, map_path, data):
+        if map_path in self.dynamic:
+            return
+        keys = self._map_keys.setdefault(map_path, set())
+        for key in data:
+            if key in keys:
+                continue
+            if is_dynamic_key(key) or len(keys) >= self.max_map_keys:
+                self._collapse(map_path)
+                return
+            keys.add(key)
+
+    def _collapse(self, map_path):
+        """
+        Folds the keys of a map into a wildcard path, merging the profiles of the fields below it.
+        """
+        self.dynamic.add(map_path)
+        self._map_keys.pop(map_path, None)
+        prefix = map_path + "."
+
+        fields = {}
+        for path, field in self.fields.items():
+            path = self._fold(path, prefix)
+            if path in fields:
+                fields[path].merge(field, same_documents=True)
+            else:
+                fields[path] = field
+        self.fields = fields
+
+        map_keys = {}
+        for path, keys in self._map_keys.items():
+            path = self._fold(path, prefix)
+            merged = map_keys.setdefault(path, set())
+            merged.update(list(keys)[:max(0, self.max_map_keys - len(merged))])
+        self._map_keys = map_keys
+        self.dynamic = {self._fold(path, prefix) for path in self.dynamic}
+
+    @staticmethod
+    def _fold(path, prefix):
+        if not path.startswith(prefix):
+            return path
+        _, dot, rest = path[len(prefix):].partition(".")
+        return prefix + WILDCARD + dot + rest
+
+    def normalize(self, path):
+        """
+        Returns a field path with the keys of the maps folded by this profile replaced by the wildcard.
+        """
+        segments = path.split(".")
+        for index in range(1, len(segments)):
+            if ".".join(segments[:index]) in self.dynamic:
+                segments[index] = WILDCARD
+        return ".".join(segments)
+
+    def merge(self, other):
+        """
+        Merges the profile of another sample of the same collection path pattern into this one.
+
+        Args:
+            other (CollectionProfile): The profile to merge.
+
+        Returns:
+            None
+        """
+        for map_path in sorted(other.dynamic, key=len):
+            map_path = self.normalize(map_path)
+            if map_path not in self.dynamic:
+                self._collapse(map_path)
+
+        self.documents += other.documents
+        self.reads += other.reads
+        self.complete = self.complete and other.complete
+        if other.ids is not None:
+            if self.ids is None:
+                self.ids = ValueSketch()
+            self.ids.merge(other.ids)
+
+        # Paths of `other` folded together by this merge overlap in documents
+        merged = {}
+        for path, field in other.fields.items():
+            path = self.normalize(path)
+            if path in merged:
+                merged[path].merge(field, same_documents=True)
+            else:
+                merged[path] = FieldProfile()
+                merged[path].merge(field)
+        for path, field in merged.items():
+            if path not in self.fields:
+                self.fields[path] = FieldProfile()
+            self.fields[path].merge(field)
+
+        for map_path, keys in other._map_keys.items():
+            map_path = self.normalize(map_path)
+            if map_path not in self.dynamic:
+                self._track_keys(map_path, keys)
+
+    def to_dict(self):
+        """
+        Returns the profile as a JSON-serializable dictionary, which `from_dict` turns back into a profile.
+        """
+        return {
+            "fields": {path: field.to_dict() for path, field in self.fields.items()},
+            "documents": self.documents,
+            "reads": self.reads,
+            "complete": self.complete,
+            "dynamic": sorted(self.dynamic),
+            "max_map_keys": self.max_map_keys,
+            "sketches": self.sketches,
+            "ids": None if self.ids is None else self.ids.to_dict(),
+            "map_keys": {path: sorted(keys) for path, keys in self._map_keys.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns the profile serialized by `to_dict`.
+        """
+        profile = cls(max_map_keys=data["max_map_keys"], sketches=data["sketches"])
+        profile.fields = {path: FieldProfile.from_dict(field) for path, field in data["fields"].items()}
+        profile.documents = data["documents"]
+        profile.reads = data["reads"]
+        profile.complete = data["complete"]
+        profile.dynamic = set(data["dynamic"])
+        profile.ids = None if data["ids"] is None else ValueSketch.from_dict(data["ids"])
+        profile._map_keys = {path: set(keys) for path, keys in data["map_keys"].items()}
+        return profile
+
+    def field_names(self):
+        """
+        Returns the field paths of the collection, in order of first appearance.
+        """
+        return list(self.fields)
+
+    def field_types(self, path):
+        """
+        Returns the Firestore value types observed for a field, most frequent first.
+        """
+        types = self.fields[path].types
+        return sorted(types, key=lambda type_name: -types[type_name])
+
+    def is_optional(self, path):
+        """
+        Returns whether a field is missing from some of the profiled documents.
+        """
+        return self.fields[path].count < self.documents
+
+    def coverage(self):
+        """
+        Returns the estimated field coverage of the profile (see `estimate_coverage`).
+        """
+        if self.complete:
+            return 1.0
+        counts = {path: field.count for path, field in self.fields.items()}
+        return estimate_coverage(counts, self.documents)
@@ -0,0 +1,158 @@
+import re
+import json
+
+# Trailing words marking a field as holding the key of another document (`userId`, `author_ref`)
+KEY_SUFFIXES = {"id", "ids", "ref", "refs", "key", "keys", "uid"}
+
+# Weight of a candidate named by the key suffix of a field, and of any other word of a field
+KEY_MATCH_SCORE = 3
+WORD_MATCH_SCORE = 1
+
+# Number of fields sent for each candidate collection
+KEY_FIELDS = 5
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens of a text, at roughly 4 characters per token.
+    """
+    return len(text) // 4 + 1
+
+
+def name_words(name):
+    """
+    Splits a field or collection name into lowercase words (`orderItemId` -> ['order', 'item', 'id']).
+    """
+    name = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name)
+    return [word.lower() for word in re.split(r"[^A-Za-z0-9]+", name) if word]
+
+
+def singular(word):
+    """
+    Returns a naive singular form of an English word (`categories` -> `category`, `users` -> `user`).
+    """
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ses", "xes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def build_collection_index(schema):
+    """
+    Indexes the collections of a schema by the terms a field could use to refer to them.
+
+    Args:
+        schema (dict): The schema of the database.
+
+    Returns:
+        dict: The collections matching each term. For `users/*/order_items`, the terms are
+              'orderitems' and 'orderitem'.
+    """
+    index = {}
+    for collection in schema:
+        name = "".join(name_words(collection.split("/")[-1]))
+        for term in {name, singular(name)}:
+            index.setdefault(term, []).append(collection)
+    return index
+
+
+def rank_candidates(schema, collection, index):
+    """
+    Ranks the collections most likely related to the fields of a collection, using lexical matching.
+
+    Args:
+        schema (dict): The schema of the database.
+        collection (str): The collection whose fields are matched.
+        index (dict): The index returned by `build_collection_index`.
+
+    Returns:
+        list: The matching collections, best first, as (collection, score) tuples.
+    """
+    scores = {}
+    for field in schema[collection]:
+        words = name_words(field.split(".")[-1])
+        if not words:
+            continue
+        matches = {}
+        if len(words) > 1 and words[-1] in KEY_SUFFIXES:
+            base = "".join(words[:-1])
+            for term in (base, singular(base)):
+                for candidate in index.get(term, ()):
+                    matches[candidate] = KEY_MATCH_SCORE
+        for word in words + ["".join(words)]:
+            for term in (word, singular(word)):
+                for candidate in index.get(term, ()):
+                    matches.setdefault(candidate, WORD_MATCH_SCORE)
+        for candidate, score in matches.items():
+            if candidate != collection:
+                scores[candidate] = scores.get(candidate, 0) + score
+
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def key_fields(fields, count=KEY_FIELDS):
+    """
+    Returns the fields identifying a collection best: key-like fields first, then the first fields.
+    """
+    keys = [field for field in fields if name_words(field) and name_words(field)[-1] in KEY_SUFFIXES]
+    selected = keys[:count]
+    for field in fields:
+        if len(selected) >= count:
+            break
+        if field not in selected:
+            selected.append(field)
+    return selected
+
+
+def build_context(schema, collections, budget, index=None):
+    """
+    Builds a compact schema context for the prompt about some collections.
+
+    The context holds every field of the requested collections, then the key fields of the collections
+    ranked most likely related by lexical matching (`userId` -> `users`), then the names of the remaining
+    collections, for as long as the estimated number of tokens stays within the budget.
+
+    Args:
+        schema (dict): The schema of the database.
+        collections (list): The collections the prompt asks about.
+        budget (int): The maximum estimated number of tokens of the context.
+        index (dict): The index returned by `build_collection_index`, built if not given.
+
+    Returns:
+        str: The schema context, as JSON.
+    """
+    if index is None:
+        index = build_collection_index(schema)
+    context = {collection: schema[collection] for collection in collections}
+    tokens = estimate_tokens(json.dumps(context))
+
+    ranked = {}
+    for collection in collections:
+        for candidate, score in rank_candidates(schema, collection, index):
+            ranked[candidate] = max(ranked.get(candidate, 0), score)
+    candidates = sorted(ranked, key=lambda candidate: (-ranked[candidate], candidate))
+
+    for candidate in candidates:
+        if candidate in context:
+            continue
+        fields = key_fields(schema[candidate])
+        cost = estimate_tokens(json.dumps({candidate: fields}))
+        if tokens + cost > budget:
+            break
+        context[candidate] = fields
+        tokens += cost
+
+    # Collection names alone still let the LLM resolve fields with no lexical match (`owner` -> `users`)
+    for candidate in schema:
+        if candidate in context:
+            continue
+        cost = estimate_tokens(json.dumps(candidate)) + 2
+        if tokens + cost > budget:
+            break
+        context[candidate] = []
+        tokens += cost
+
+    return json.dumps(context, separators=(",", ":"))
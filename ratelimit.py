@@ -0,0 +1,73 @@
+import time
+import random
+import asyncio
+
+
+class TokenBucket:
+    """
+    Asynchronous token bucket refilled continuously at a rate per minute.
+
+    Args:
+        rate_per_minute (float): The number of tokens added per minute. A falsy rate disables the limit.
+        capacity (float): The maximum number of tokens in the bucket. Defaults to one minute of tokens.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = (rate_per_minute or 0) / 60.0
+        self.capacity = capacity or rate_per_minute or 0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        """
+        Waits until `amount` tokens are available and takes them from the bucket.
+
+        Requests larger than the capacity of the bucket wait for a full bucket instead of waiting forever.
+        """
+        if not self.rate:
+            return
+        amount = min(amount, self.capacity)
+        # The lock keeps waiters in FIFO order, so large requests are not starved by small ones
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Limits both the requests and the tokens sent per minute to an API.
+
+    Args:
+        requests_per_minute (float): The maximum number of requests per minute, or 0 for no limit.
+        tokens_per_minute (float): The maximum number of tokens per minute, or 0 for no limit.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """
+    Returns the delay before retrying a request, using exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of the retry, starting at 0.
+        base (float): The delay of the first retry, in seconds.
+        cap (float): The maximum delay, in seconds.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,354 @@
+import os
+import atexit
+import shutil
+import hashlib
+import time
+import tempfile
+import threading
+import subprocess
+import instrumentation
+from cache import DiskCache, content_key
+from config import GRAPHVIZ_DOT, PLANTUML_JAR, PLANTUML_JAVA, RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES
+
+# Formats supported by the local renderer, and the PlantUML option selecting them
+FORMATS = {"png": "-tpng", "svg": "-tsvg"}
+
+# Line printed by PlantUML after each diagram in pipe mode
+PIPE_DELIMITER = b"___FIRESTORE_SCHEMA_DIAGRAM_END___"
+
+
+class PlantUMLPipe:
+    """
+    Long-lived local PlantUML process rendering diagrams read from its standard input.
+
+    The JVM is started once (`java -jar plantuml.jar -pipe`) and renders every diagram written to it,
+    printing a delimiter line after each image, so diagrams after the first one do not pay the JVM
+    startup time. Diagrams are never sent over the network.
+
+    Args:
+        fmt (str): The output format, 'png' or 'svg'.
+        jar (str): The path to plantuml.jar. Defaults to PLANTUML_JAR.
+        java (str): The Java executable. Defaults to PLANTUML_JAVA.
+    """
+
+    def __init__(self, fmt="png", jar=PLANTUML_JAR, java=PLANTUML_JAVA):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported diagram format: {fmt}")
+        self.fmt = fmt
+        self.command = [
+            java, "-Djava.awt.headless=true", "-jar", jar, "-pipe", FORMATS[fmt],
+            "-charset", "UTF-8", "-pipedelimitor", PIPE_DELIMITER.decode("ascii"),
+        ]
+        self.process = None
+        self._buffer = b""
+        self._lock = threading.Lock()
+
+    def _start(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+            self._buffer = b""
+
+    def _read_diagram(self):
+        stdout = self.process.stdout
+        while True:
+            position = self._buffer.find(PIPE_DELIMITER)
+            if position != -1:
+                image = self._buffer[:position]
+                rest = self._buffer[position + len(PIPE_DELIMITER):]
+                self._buffer = rest[2:] if rest.startswith(b"\r\n") else rest[1:] if rest.startswith(b"\n") else rest
+                return image
+            chunk = stdout.read1(65536)
+            if not chunk:
+                raise RuntimeError(f"PlantUML exited with code {self.process.wait()}")
+            self._buffer += chunk
+
+    def _render_batch(self, count, write):
+        """
+        Renders `count` diagrams, whose texts are written to the standard input of PlantUML by `write`.
+        """
+        with self._lock:
+            self._start()
+            stdin = self.process.stdin
+
+            # Write from another thread, so that a large batch cannot fill both pipes and deadlock
+            def write_all():
+                try:
+                    write(stdin)
+                    stdin.flush()
+                except BrokenPipeError:
+                    pass
+
+            writer = threading.Thread(target=write_all, daemon=True)
+            writer.start()
+            try:
+                images = [self._read_diagram() for _ in range(count)]
+            except Exception:
+                self.close()
+                raise
+            finally:
+                writer.join()
+        return images
+
+    def render_many(self, plantuml_texts):
+        """
+        Renders several diagrams in a single batch.
+
+        Args:
+            plantuml_texts (list): The PlantUML texts, each from @startuml to @enduml.
+
+        Returns:
+            list: The rendered images, as bytes, in the order of the texts.
+        """
+        payload = b"".join(text.strip().encode("utf-8") + b"\n" for text in plantuml_texts)
+        return self._render_batch(len(plantuml_texts), lambda stdin: stdin.write(payload))
+
+    def render_files(self, paths):
+        """
+        Renders several diagrams in a single batch, streaming their texts from files to PlantUML.
+
+        Args:
+            paths (list): The paths of the PlantUML files, each from @startuml to @enduml and ending with a
+                          newline, e.g. as written by `spool_lines`.
+
+        Returns:
+            list: The rendered images, as bytes, in the order of the files.
+        """
+        def write(stdin):
+            for path in paths:
+                with open(path, "rb") as plantuml_file:
+                    shutil.copyfileobj(plantuml_file, stdin)
+
+        return self._render_batch(len(paths), write)
+
+    def render(self, plantuml_text):
+        """
+        Renders a single diagram.
+
+        Args:
+            plantuml_text (str): The PlantUML text.
+
+        Returns:
+            bytes: The rendered image.
+        """
+        return self.render_many([plantuml_text])[0]
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+
+_pipes = {}
+_pipes_lock = threading.Lock()
+
+
+def get_renderer(fmt="png"):
+    """
+    Returns the shared PlantUMLPipe for a format, kept warm for the lifetime of the process.
+    """
+    with _pipes_lock:
+        if fmt not in _pipes:
+            _pipes[fmt] = PlantUMLPipe(fmt)
+        return _pipes[fmt]
+
+
+def render_plantuml(plantuml_texts, fmt="png"):
+    """
+    Renders PlantUML diagrams locally.
+
+    Args:
+        plantuml_texts (list): The PlantUML texts.
+        fmt (str): The output format, 'png' or 'svg'. Default is 'png'.
+
+    Returns:
+        list: The rendered images, as bytes, in the order of the texts.
+    """
+    return get_renderer(fmt).render_many(plantuml_texts)
+
+
+def render_plantuml_files(paths, fmt="png"):
+    """
+    Renders PlantUML files locally, see `render_plantuml`.
+    """
+    return get_renderer(fmt).render_files(paths)
+
+
+def spool_lines(lines, directory, suffix):
+    """
+    Streams the lines of a text to a temporary file, hashing them on the way, so that the text is never
+    held in memory. The caller removes the file; it is removed here if the lines fail to generate.
+
+    Args:
+        lines (iterable): The lines of the text, without line endings.
+        directory (str): The directory of the temporary file.
+        suffix (str): The suffix of the temporary file, e.g. '.puml'.
+
+    Returns:
+        tuple: The path of the temporary file, and the SHA-256 hex digest of its content.
+    """
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile("wb", suffix=suffix, dir=directory, delete=False) as spool_file:
+        try:
+            for line in lines:
+                data = line.encode("utf-8") + b"\n"
+                spool_file.write(data)
+                digest.update(data)
+        except BaseException:
+            spool_file.close()
+            os.remove(spool_file.name)
+            raise
+    return spool_file.name, digest.hexdigest()
+
+
+def render_cache(cache=None):
+    """
+    Returns the cache of rendered diagrams to use: the given DiskCache, the default cache in
+    RENDER_CACHE_DIR if `cache` is None, or no cache if `cache` is False.
+    """
+    if cache is None and RENDER_CACHE_DIR:
+        return DiskCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES)
+    return cache or None
+
+
+def _diagram_key(source, backend, fmt, digest=None):
+    if digest is None:
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    return content_key("diagram", backend, fmt, digest)
+
+
+def _write_image(image, key, output_file, cache):
+    """
+    Stores a rendered image in the cache, and places it at the output file.
+    """
+    if cache is not None:
+        cache.set(key, image)
+        cache.evict()
+        if cache.copy(key, output_file):
+            return
+    with open(output_file, "wb") as diagram_file:
+        diagram_file.write(image)
+
+
+def render_cached(source, backend, fmt, output_file, render, cache=None, digest=None):
+    """
+    Writes the image of a diagram to a file, rendering it only if the same source was not rendered before.
+
+    Images are cached by a hash of the diagram source (PlantUML or DOT), the backend and the format, and
+    reused as copies of the cached file, so an unchanged schema is never rendered twice.
+    The cache is evicted least recently used first once it exceeds RENDER_CACHE_MAX_BYTES.
+
+    Args:
+        source (str): The diagram source.
+        backend (str): The renderer of the diagram, e.g. 'local', 'web' or 'graphviz'.
+        fmt (str): The image format, e.g. 'png' or 'svg'.
+        output_file (str): The path to the output file.
+        render (callable): Renders the diagram on a cache miss, returning the image as bytes.
+        cache (DiskCache): The cache of rendered diagrams, see `render_cache`.
+        digest (str): The SHA-256 hex digest of the source, when it was hashed while streamed (the source
+                      is then not needed).
+
+    Returns:
+        bool: Whether the image was found in the cache.
+    """
+    cache = render_cache(cache)
+    key = _diagram_key(source, backend, fmt, digest)
+    if cache is not None and cache.copy(key, output_file):
+        instrumentation.count("render_cache_hits_total", backend=backend)
+        return True
+
+    start = time.perf_counter()
+    image = render()
+    instrumentation.observe("render_seconds", time.perf_counter() - start, backend=backend)
+    _write_image(image, key, output_file, cache)
+    return False
+
+
+def render_plantuml_cached(diagrams, output_files, fmt="png", cache=None):
+    """
+    Writes the images of several PlantUML diagrams, rendering the diagrams missing from the render cache
+    locally in a single batch, so the JVM is started once for all of them (see `render_cached`).
+
+    The lines of each diagram are streamed to a temporary file next to its output and hashed on the way,
+    then the files of the cache misses are streamed to PlantUML, so no diagram text is held in memory.
+
+    Args:
+        diagrams (list): The lines of each PlantUML text, e.g. from `utils.iter_plantuml_lines`.
+        output_files (list): The path to the output file of each diagram.
+        fmt (str): The output format, 'png' or 'svg'. Default is 'png'.
+        cache (DiskCache): The cache of rendered diagrams, see `render_cache`.
+
+    Returns:
+        int: The number of images found in the cache.
+    """
+    cache = render_cache(cache)
+    missing = []
+    spooled = []
+    try:
+        for lines, output_file in zip(diagrams, output_files):
+            path, digest = spool_lines(lines, os.path.dirname(os.path.abspath(output_file)), ".puml")
+            spooled.append(path)
+            key = _diagram_key(None, "local", fmt, digest)
+            if cache is not None and cache.copy(key, output_file):
+                instrumentation.count("render_cache_hits_total", backend="local")
+            else:
+                missing.append((path, key, output_file))
+        if not missing:
+            return len(spooled)
+
+        start = time.perf_counter()
+        images = render_plantuml_files([path for path, _, _ in missing], fmt)
+        # The diagrams of a batch are rendered back to back: each one is recorded with its share of the batch
+        seconds = (time.perf_counter() - start) / len(missing)
+        for (_, key, output_file), image in zip(missing, images):
+            instrumentation.observe("render_seconds", seconds, backend="local")
+            _write_image(image, key, output_file, cache)
+        return len(spooled) - len(missing)
+    finally:
+        for path in spooled:
+            os.remove(path)
+
+
+def render_dot(lines, output_file, fmt="png", cache=None, dot=GRAPHVIZ_DOT):
+    """
+    Lays out a DOT graph given line by line with a single Graphviz invocation.
+
+    The lines are streamed to a temporary file and hashed on the way, so the DOT text is never held in
+    memory, and Graphviz only runs when the render cache has no image for the same source.
+
+    Args:
+        lines (iterable): The lines of the DOT text, e.g. from `utils.iter_dot_lines`.
+        output_file (str): The path to the output file.
+        fmt (str): The Graphviz output format. Default is 'png'.
+        cache (DiskCache): The cache of rendered diagrams, see `render_cache`.
+        dot (str): The Graphviz executable. Defaults to GRAPHVIZ_DOT.
+
+    Returns:
+        bool: Whether the image was found in the cache.
+    """
+    dot_path, digest = spool_lines(lines, os.path.dirname(os.path.abspath(output_file)), ".dot")
+
+    def render():
+        result = subprocess.run([dot, f"-T{fmt}", dot_path], capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Graphviz failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return result.stdout
+
+    try:
+        return render_cached(None, "graphviz", fmt, output_file, render, cache, digest)
+    finally:
+        os.remove(dot_path)
+
+
+@atexit.register
+def _close_pipes():
+    for pipe in _pipes.values():
+        pipe.close()
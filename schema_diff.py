@@ -0,0 +1,299 @@
+import os
+import json
+import tempfile
+from cache import set_default_permissions
+from prompt_context import build_collection_index, rank_candidates
+from utils import plantuml_name
+
+# Version of the changeset format
+CHANGESET_VERSION = 1
+
+
+def load_state(path):
+    """
+    Loads the state saved by `save_state`, or returns None if there is none.
+
+    Returns:
+        dict: The typed schema, relationships and partitions of the previous run.
+    """
+    try:
+        with open(path, encoding="utf-8") as state_file:
+            state = json.load(state_file)
+    except FileNotFoundError:
+        return None
+    if state.get("version") != CHANGESET_VERSION:
+        return None
+    state["relationships"] = {
+        collection: [tuple(relationship) for relationship in collection_relationships]
+        for collection, collection_relationships in state["relationships"].items()
+    }
+    return state
+
+
+def save_state(path, schema, relationships, partitions=None):
+    """
+    Saves the typed schema, relationships and partitions of a run, to be diffed against by the next run.
+
+    The state is written atomically, so an interrupted run leaves the state of the previous run in place.
+    """
+    state = {"version": CHANGESET_VERSION, "schema": schema, "relationships": relationships, "partitions": partitions}
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False) as state_file:
+        json.dump(state, state_file)
+    set_default_permissions(state_file.name)
+    os.replace(state_file.name, path)
+
+
+def typed_schema(schema, profiles=None):
+    """
+    Returns a schema with the observed value types of each field, as compared by `diff_schemas`.
+
+    Args:
+        schema (dict): The schema of the database, as returned by `get_schema`.
+        profiles (dict): Optional CollectionProfile of each collection. Without them, the types are empty
+                         and only added and removed fields are detected.
+
+    Returns:
+        dict: The sorted value types of each field of each collection, JSON-serializable.
+    """
+    typed = {}
+    for collection, fields in schema.items():
+        profile = (profiles or {}).get(collection)
+        typed[collection] = {
+            field: sorted(profile.fields[field].types) if profile is not None and field in profile.fields else []
+            for field in fields
+        }
+    return typed
+
+
+def _as_typed(schema):
+    return {
+        collection: fields if isinstance(fields, dict) else {field: [] for field in fields}
+        for collection, fields in schema.items()
+    }
+
+
+def diff_schemas(old_schema, new_schema):
+    """
+    Compares two schemas.
+
+    Args:
+        old_schema (dict): The previous schema, plain (as returned by `get_schema`) or typed (`typed_schema`).
+        new_schema (dict): The current schema, in either form.
+
+    Returns:
+        dict: The changeset, JSON-serializable:
+              - `added_collections` and `removed_collections`: lists of collections;
+              - `changed_collections`: for each collection present in both schemas whose fields changed,
+                its `added_fields` and `removed_fields`, and its `retyped_fields` with their `old` and
+                `new` types (only when both schemas are typed).
+    """
+    old_schema, new_schema = _as_typed(old_schema), _as_typed(new_schema)
+    changeset = {
+        "version": CHANGESET_VERSION,
+        "added_collections": [collection for collection in new_schema if collection not in old_schema],
+        "removed_collections": [collection for collection in old_schema if collection not in new_schema],
+        "changed_collections": {},
+    }
+    for collection, fields in new_schema.items():
+        old_fields = old_schema.get(collection)
+        if old_fields is None:
+            continue
+        added = [field for field in fields if field not in old_fields]
+        removed = [field for field in old_fields if field not in fields]
+        retyped = {
+            field: {"old": old_fields[field], "new": types}
+            for field, types in fields.items()
+            if field in old_fields and types and old_fields[field] and types != old_fields[field]
+        }
+        if added or removed or retyped:
+            changeset["changed_collections"][collection] = {
+                "added_fields": added,
+                "removed_fields": removed,
+                "retyped_fields": retyped,
+            }
+    return changeset
+
+
+def is_empty(changeset):
+    """
+    Returns whether a changeset holds no change.
+    """
+    return not (changeset["added_collections"] or changeset["removed_collections"] or changeset["changed_collections"])
+
+
+def affected_collections(schema, relationships, changeset):
+    """
+    Returns the collections of the current schema whose relationships may have changed.
+
+    These are the added and changed collections, the collections related to a removed collection, and
+    the collections with a field named after an added collection (e.g. `teamId` once `teams` exists).
+    Finding them only costs lexical matching, no LLM request.
+
+    Args:
+        schema (dict): The current schema.
+        relationships (dict): The relationships identified for the previous schema.
+        changeset (dict): The changeset returned by `diff_schemas`.
+
+    Returns:
+        list: The affected collections, in schema order.
+    """
+    affected = set(changeset["added_collections"]) | set(changeset["changed_collections"])
+    removed = set(changeset["removed_collections"])
+    for collection, collection_relationships in relationships.items():
+        if any(related_collection in removed for _, related_collection in collection_relationships):
+            affected.add(collection)
+
+    added_index = build_collection_index({collection: [] for collection in changeset["added_collections"]})
+    if added_index:
+        for collection in schema:
+            if collection not in affected and rank_candidates(schema, collection, added_index):
+                affected.add(collection)
+    return [collection for collection in schema if collection in affected]
+
+
+def update_relationships(schema, relationships, changeset, identify, **options):
+    """
+    Updates the relationships of the previous schema after a change, only identifying the affected ones.
+
+    Args:
+        schema (dict): The current schema.
+        relationships (dict): The relationships identified for the previous schema.
+        changeset (dict): The changeset returned by `diff_schemas`.
+        identify (callable): The function identifying relationships, called with the schema and the
+                             affected collections as `collections`, e.g. `utils.identify_relationships`.
+        **options: Keyword arguments passed to `identify`, e.g. `profiles`.
+
+    Returns:
+        dict: The relationships of the current schema.
+    """
+    affected = affected_collections(schema, relationships, changeset)
+    updated = {
+        collection: list(relationships.get(collection, []))
+        for collection in schema
+    }
+    if affected:
+        print(f"{len(affected)} of {len(schema)} collections affected by the schema change")
+        updated.update(identify(schema, collections=affected, **options))
+    return updated
+
+
+def update_partitions(partitions, schema, relationships, changeset, max_size):
+    """
+    Updates the partitions of the previous schema after a change, keeping unchanged partitions as they were.
+
+    Removed collections leave their partition, and each added collection joins the partition of a related
+    collection that has room for it, or else an empty partition, or else the last partition if it has room,
+    or else a new partition. A partition emptied by this change is kept, so that the names of the others,
+    and hence their diagrams, do not change; if it is still empty after the next change, it is dropped.
+    Empty partitions at the end are always dropped, since no name depends on them.
+
+    Args:
+        partitions (list): The collections of each partition of the previous schema.
+        schema (dict): The current schema.
+        relationships (dict): The relationships of the current schema.
+        changeset (dict): The changeset returned by `diff_schemas`.
+        max_size (int): The maximum number of collections of a partition.
+
+    Returns:
+        list: The collections of each partition of the current schema.
+    """
+    removed = set(changeset["removed_collections"])
+    emptied_before = [not collections for collections in partitions]
+    partitions = [[collection for collection in collections if collection not in removed] for collections in partitions]
+    owner = {collection: index for index, collections in enumerate(partitions) for collection in collections}
+    added = [collection for collection in schema if collection not in owner]
+
+    incoming = {}
+    if added:
+        for collection, collection_relationships in relationships.items():
+            for _, related_collection in collection_relationships:
+                incoming.setdefault(related_collection, []).append(collection)
+
+    for collection in added:
+        related = [related_collection for _, related_collection in relationships.get(collection, [])]
+        related += incoming.get(collection, [])
+        target = None
+        for related_collection in related:
+            index = owner.get(related_collection)
+            if index is not None and len(partitions[index]) < max_size:
+                target = index
+                break
+        if target is None:
+            target = next((index for index, collections in enumerate(partitions) if not collections), None)
+        if target is None:
+            if not partitions or len(partitions[-1]) >= max_size:
+                partitions.append([])
+            target = len(partitions) - 1
+        partitions[target].append(collection)
+        owner[collection] = target
+
+    # Partitions that stayed empty across a run are dropped, renaming the partitions after them once
+    partitions = [
+        collections for index, collections in enumerate(partitions)
+        if collections or index >= len(emptied_before) or not emptied_before[index]
+    ]
+    while partitions and not partitions[-1]:
+        partitions.pop()
+    return partitions
+
+
+def iter_diff_plantuml_lines(old_schema, new_schema, relationships, changeset):
+    """
+    Generates a PlantUML diagram of the current schema highlighting a changeset.
+
+    Added collections and fields are green, removed ones red and struck through, retyped fields orange
+    with their old and new types. Only the changed collections and the collections related to them are
+    drawn, so the diagram stays small for a small change.
+
+    Args:
+        old_schema (dict): The previous schema, plain or typed.
+        new_schema (dict): The current schema, plain or typed.
+        relationships (dict): The relationships of the current schema.
+        changeset (dict): The changeset returned by `diff_schemas`.
+
+    Yields:
+        str: The lines of the PlantUML text.
+    """
+    old_schema, new_schema = _as_typed(old_schema), _as_typed(new_schema)
+    added = set(changeset["added_collections"])
+    changed = changeset["changed_collections"]
+    shown = added | set(changed)
+    for collection, collection_relationships in relationships.items():
+        for _, related_collection in collection_relationships:
+            if collection in added or collection in changed or related_collection in added or related_collection in changed:
+                shown.update((collection, related_collection))
+
+    yield "@startuml"
+    for collection in new_schema:
+        if collection not in shown:
+            continue
+        color = " #palegreen" if collection in added else " #moccasin" if collection in changed else ""
+        yield f"class {plantuml_name(collection)}{color} {{"
+        changes = changed.get(collection, {})
+        for field, types in new_schema[collection].items():
+            type_text = f" : {' | '.join(types)}" if types else ""
+            if collection in added or field in changes.get("added_fields", ()):
+                yield f"  <color:green>+ {field}{type_text}</color>"
+            elif field in changes.get("retyped_fields", {}):
+                old_types = " | ".join(changes["retyped_fields"][field]["old"])
+                yield f"  <color:darkorange>~ {field} : {old_types} -> {' | '.join(types)}</color>"
+            else:
+                yield f"  {field}{type_text}"
+        for field in changes.get("removed_fields", ()):
+            yield f"  <color:red>- --{field}--</color>"
+        yield "}"
+    for collection in changeset["removed_collections"]:
+        yield f"class {plantuml_name(collection)} #mistyrose {{"
+        for field in old_schema[collection]:
+            yield f"  <color:red>- --{field}--</color>"
+        yield "}"
+
+    for collection, collection_relationships in relationships.items():
+        if collection not in shown:
+            continue
+        for field, related_collection in collection_relationships:
+            if related_collection in shown:
+                yield f"{plantuml_name(collection)} --> {plantuml_name(related_collection)} : {field}"
+    yield "@enduml"
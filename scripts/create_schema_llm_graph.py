@@ -1,3 +1,5 @@
+import sys
+import json
 from datetime import datetime
 import pydot
 
@@ -55,4 +57,10 @@ def create_schema_graph_llm(schema, relationships):
     # Append filename with timestamp
     graph.write_png(f'firestore_schema_llm_{datetime.now().strftime("%Y%m%d%H%M%S")}.png')
 
-create_schema_graph_llm(schema, relationships)
\ No newline at end of file
+if __name__ == "__main__":
+    # Usage: python create_schema_llm_graph.py schema.json relationships.json
+    with open(sys.argv[1]) as schema_file:
+        schema = json.load(schema_file)
+    with open(sys.argv[2]) as relationships_file:
+        relationships = json.load(relationships_file)
+    create_schema_graph_llm(schema, relationships)
@@ -1,5 +1,7 @@
 from datetime import datetime
 import os
+import sys
+import json
 import tempfile
 from plantuml import PlantUML
 
@@ -81,6 +83,13 @@ def generate_uml_diagram(plantuml_text, output_file):
 #     'users': [('posts', 'author')],
 #     'posts': [('author', 'users')]
 # }
-output_file = f'firestore_schema_llm_{datetime.now().strftime("%Y%m%d%H%M%S")}.png'
-plantuml_text = generate_plantuml_text(schema, relationships, generate_diagram=True, output_file=output_file)
-print(plantuml_text)
\ No newline at end of file
+
+if __name__ == "__main__":
+    # Usage: python create_schema_plantuml_text.py schema.json relationships.json
+    with open(sys.argv[1]) as schema_file:
+        schema = json.load(schema_file)
+    with open(sys.argv[2]) as relationships_file:
+        relationships = json.load(relationships_file)
+    output_file = f'firestore_schema_llm_{datetime.now().strftime("%Y%m%d%H%M%S")}.png'
+    plantuml_text = generate_plantuml_text(schema, relationships, generate_diagram=True, output_file=output_file)
+    print(plantuml_text)
@@ -1,8 +1,9 @@
 from openai import OpenAI
+import os
+import sys
 import json
 
-openai_api_key = ''
-client = OpenAI(api_key=openai_api_key)
+openai_api_key = os.getenv("OPENAI_API_KEY", "")
 
 # # OpenAI tool calling sample
 # tools = [{
@@ -40,6 +41,7 @@ def identify_relationships_llm(schema):
         dict: A dictionary where each key represents a collection name and the value is a list of tuples.
               Each tuple contains the field name and the related collection name for a foreign key relationship.
     """
+    client = OpenAI(api_key=openai_api_key)
     relationships = {}
     schema_context = json.dumps(schema, indent=2)
 
@@ -92,6 +94,9 @@ def identify_relationships_llm(schema):
     
     return relationships
 
-# Example usage with the schema extracted
-relationships = identify_relationships_llm(schema)
-print(relationships)
+if __name__ == "__main__":
+    # Usage: python relationship_identifier.py schema.json
+    with open(sys.argv[1]) as schema_file:
+        schema = json.load(schema_file)
+    relationships = identify_relationships_llm(schema)
+    print(json.dumps(relationships))
@@ -1,13 +1,7 @@
-import os
+import json
 import firebase_admin
 from firebase_admin import credentials, firestore
 
-# Initialize the app with the environment variable
-cred = credentials.ApplicationDefault()
-firebase_admin.initialize_app(cred)
-
-db = firestore.client()
-
 def get_schema(db):
     """
     Retrieves the schema of a Firestore database.
@@ -32,4 +26,11 @@ def get_schema(db):
                     schema[collection_name].append(field)
     return schema
 
-schema = get_schema(db)
\ No newline at end of file
+if __name__ == "__main__":
+    # Initialize the app with the environment variable
+    cred = credentials.ApplicationDefault()
+    firebase_admin.initialize_app(cred)
+
+    db = firestore.client()
+    schema = get_schema(db)
+    print(json.dumps(schema))
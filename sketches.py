@@ -0,0 +1,194 @@
+import math
+import hashlib
+
+
+def hash64(value):
+    """
+    Returns a stable 64-bit hash of a string (unlike `hash`, it does not change between processes).
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch estimating the number of distinct values added to it.
+
+    Args:
+        precision (int): The number of bits indexing the registers. The sketch uses 2 ** precision bytes,
+                         and its relative error is about 1.04 / sqrt(2 ** precision).
+    """
+
+    def __init__(self, precision=8):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._count = None
+
+    def add_hash(self, hashed):
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            self._count = None
+
+    def add(self, value):
+        self.add_hash(hash64(value))
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        self._count = None
+
+    def set_registers(self, registers):
+        """
+        Replaces the registers, e.g. with the registers of a serialized sketch.
+        """
+        self.registers = bytearray(registers)
+        self.precision = len(self.registers).bit_length() - 1
+        self._count = None
+
+    def count(self):
+        """
+        Returns the estimated number of distinct values, computed once until a value is added.
+        """
+        if self._count is not None:
+            return self._count
+        size = len(self.registers)
+        estimate = (0.7213 / (1 + 1.079 / size)) * size * size / sum(2.0 ** -register for register in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * size and empty:
+            # Linear counting is more accurate for small cardinalities, which is the common case for samples
+            estimate = size * math.log(size / empty)
+        self._count = estimate
+        return estimate
+
+
+class MinHash:
+    """
+    MinHash signature estimating the Jaccard similarity between value sets.
+
+    Uses one-permutation hashing: each value is hashed once, the hash picks one of `num_perm` bins and
+    each bin keeps its minimum, so adding a value costs O(1) instead of O(num_perm). Bins left empty
+    by small sets are filled by rotation densification when the signature is first compared, and the
+    densified signature is kept until a value is added.
+
+    Args:
+        num_perm (int): The number of bins, i.e. the size of the signature.
+    """
+
+    EMPTY = 1 << 64
+
+    def __init__(self, num_perm=64):
+        self.values = [MinHash.EMPTY] * num_perm
+        self._signature = None
+
+    def add_hash(self, hashed):
+        index = hashed % len(self.values)
+        value = hashed // len(self.values)
+        if value < self.values[index]:
+            self.values[index] = value
+            self._signature = None
+
+    def add(self, value):
+        self.add_hash(hash64(value))
+
+    def merge(self, other):
+        self.values = list(map(min, self.values, other.values))
+        self._signature = None
+
+    def set_values(self, values):
+        """
+        Replaces the bins, e.g. with the bins of a serialized signature.
+        """
+        self.values = list(values)
+        self._signature = None
+
+    def is_empty(self):
+        return all(value == MinHash.EMPTY for value in self.values)
+
+    def signature(self):
+        """
+        Returns the densified signature: each empty bin takes the value of the next non-empty bin,
+        offset by the distance to it, so that signatures of small sets remain comparable bin by bin.
+
+        The signature is computed once and shared by later calls until a value is added: do not modify it.
+        """
+        if self._signature is not None:
+            return self._signature
+        values = self.values
+        size = len(values)
+        signature = list(values)
+        filled = [index for index, value in enumerate(values) if value != MinHash.EMPTY]
+        if filled:
+            # Each run of empty bins takes the value of the non-empty bin after it, wrapping around
+            for previous, following in zip(filled, filled[1:] + [filled[0] + size]):
+                value = values[following % size]
+                for index in range(previous + 1, following):
+                    signature[index % size] = value + (following - index) * MinHash.EMPTY
+        self._signature = signature
+        return signature
+
+    def jaccard(self, other):
+        """
+        Returns the estimated Jaccard similarity with another signature.
+        """
+        mine, theirs = self.signature(), other.signature()
+        return sum(1 for a, b in zip(mine, theirs) if a == b) / len(mine)
+
+    def bands(self, rows):
+        """
+        Returns the locality-sensitive hashing buckets of the signature, one per band of `rows` values.
+        """
+        signature = self.signature()
+        return [(start, tuple(signature[start:start + rows])) for start in range(0, len(signature), rows)]
+
+
+class ValueSketch:
+    """
+    Compact summary of a set of values: a HyperLogLog for its cardinality and a MinHash for set overlaps.
+    """
+
+    __slots__ = ("hll", "minhash")
+
+    def __init__(self):
+        self.hll = HyperLogLog()
+        self.minhash = MinHash()
+
+    def add(self, value):
+        hashed = hash64(value)
+        self.hll.add_hash(hashed)
+        self.minhash.add_hash(hashed)
+
+    def merge(self, other):
+        self.hll.merge(other.hll)
+        self.minhash.merge(other.minhash)
+
+    def count(self):
+        return self.hll.count()
+
+    def to_dict(self):
+        # Empty bins are serialized as None: MinHash.EMPTY does not fit in the 64-bit integers of MessagePack
+        return {
+            "hll": self.hll.registers.hex(),
+            "minhash": [None if value == MinHash.EMPTY else value for value in self.minhash.values],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls()
+        sketch.hll.set_registers(bytes.fromhex(data["hll"]))
+        sketch.minhash.set_values(MinHash.EMPTY if value is None else value for value in data["minhash"])
+        return sketch
+
+    def containment(self, other):
+        """
+        Estimates the share of the values of this set that are also in another set.
+
+        The size of the intersection is derived from the Jaccard similarity J and the cardinalities:
+        |A ∩ B| = J / (1 + J) * (|A| + |B|).
+        """
+        size = self.count()
+        if not size:
+            return 0.0
+        similarity = self.minhash.jaccard(other.minhash)
+        intersection = similarity / (1 + similarity) * (size + other.count())
+        return min(1.0, intersection / size)
@@ -0,0 +1,84 @@
+import os
+import json
+import tempfile
+import threading
+from datetime import datetime
+from cache import set_default_permissions
+
+# Version of the snapshot file format: files of another version are ignored
+SNAPSHOT_VERSION = 1
+
+
+def encode_watermark(value):
+    """
+    Returns a watermark field value as JSON, keeping timestamps distinguishable from strings.
+    """
+    if isinstance(value, datetime):
+        return {"timestamp": value.isoformat()}
+    return value
+
+
+def decode_watermark(value):
+    """
+    Returns the field value of a watermark encoded by `encode_watermark`.
+    """
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value["timestamp"])
+    return value
+
+
+class SnapshotStore:
+    """
+    Snapshots of the sampled collections of a database, persisted to a JSON file between runs.
+
+    The snapshot of a collection holds its CollectionProfile (see `CollectionProfile.to_dict`), its
+    document count, the largest value of the watermark field seen in it, and the IDs of the profiled
+    documents, whose subcollections are crawled and which tell updated documents from new ones.
+    `get_schema` uses them to skip collections that did not change and to only read the documents
+    written since the watermark of the others.
+
+    Args:
+        path (str): The path of the snapshot file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.collections = {}
+        self.outcomes = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as snapshot_file:
+                data = json.load(snapshot_file)
+        except FileNotFoundError:
+            return
+        if data.get("version") == SNAPSHOT_VERSION:
+            self.collections = data["collections"]
+
+    def get(self, collection_path):
+        """
+        Returns the snapshot of a collection, or None if it was never sampled.
+        """
+        with self._lock:
+            return self.collections.get(collection_path)
+
+    def set(self, collection_path, snapshot, outcome):
+        """
+        Records the new snapshot of a collection, and how it was refreshed ('unchanged', 'updated' or 'sampled').
+        """
+        with self._lock:
+            self.collections[collection_path] = snapshot
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def save(self):
+        """
+        Writes the snapshots to the snapshot file, atomically.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = {"version": SNAPSHOT_VERSION, "collections": self.collections}
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp",
+                                             delete=False) as temp_file:
+                json.dump(data, temp_file, separators=(",", ":"))
+        set_default_permissions(temp_file.name)
+        os.replace(temp_file.name, self.path)
@@ -0,0 +1,224 @@
+"""
+Generates `export/output-0`, a small Firestore export file read by `tests/test_export_reader.py`.
+
+    python tests/fixtures/make_export.py
+
+The file is written with an encoder independent of `export_reader`, and covers every value type of
+Firestore, a numeric document ID, a zero-filled block trailer, and a record split in FIRST, MIDDLE and
+LAST fragments across three blocks.
+"""
+import os
+import struct
+
+BLOCK_SIZE = 32768
+HEADER_SIZE = 7
+FULL, FIRST, MIDDLE, LAST = 1, 2, 3, 4
+
+# Meanings of EntityProto properties
+GD_WHEN, GEORSS_POINT, BLOB, ENTITY_PROTO, EMPTY_LIST = 7, 9, 14, 19, 24
+
+# Length of the `bio` field of the document split across three blocks
+LONG_TEXT_LENGTH = 70000
+
+# Bytes left at the end of the first block, too few for a record header
+TRAILER_SIZE = 3
+
+
+def _crc32c_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = crc >> 1 ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC32C_TABLE = _crc32c_table()
+
+
+def masked_crc32c(data):
+    """
+    Returns the checksum of a LevelDB log record header: the CRC32C of the record type and the fragment,
+    masked as LevelDB does.
+    """
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ crc >> 8
+    crc ^= 0xFFFFFFFF
+    return ((crc >> 15 | crc << 17) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def varint(number):
+    if number < 0:
+        number += 1 << 64
+    encoded = b""
+    while True:
+        byte = number & 0x7F
+        number >>= 7
+        if not number:
+            return encoded + bytes([byte])
+        encoded += bytes([byte | 0x80])
+
+
+def tag(field, wire_type):
+    return varint(field << 3 | wire_type)
+
+
+def length_delimited(field, data):
+    return tag(field, 2) + varint(len(data)) + data
+
+
+def integer(field, number):
+    return tag(field, 0) + varint(number)
+
+
+def group(field, data):
+    return tag(field, 3) + data + tag(field, 4)
+
+
+def double(field, number):
+    return tag(field, 1) + struct.pack("<d", number)
+
+
+def property_value(value):
+    """
+    Encodes a PropertyValue message. Tuples stand for the types without a Python equivalent:
+    ("timestamp", microseconds), ("geopoint", latitude, longitude) and ("reference", path).
+    """
+    if value is None:
+        return b""
+    if isinstance(value, bool):
+        return integer(2, int(value))
+    if isinstance(value, int):
+        return integer(1, value)
+    if isinstance(value, float):
+        return double(4, value)
+    if isinstance(value, (str, bytes)):
+        return length_delimited(3, value.encode("utf-8") if isinstance(value, str) else value)
+    if isinstance(value, dict):
+        return length_delimited(3, entity(None, value))
+    if value[0] == "timestamp":
+        return integer(1, value[1])
+    if value[0] == "geopoint":
+        return group(5, double(6, value[1]) + double(7, value[2]))
+    segments = value[1].split("/")
+    elements = b"".join(
+        group(14, length_delimited(15, kind.encode("utf-8")) + length_delimited(17, name.encode("utf-8")))
+        for kind, name in zip(segments[0::2], segments[1::2])
+    )
+    return group(12, length_delimited(13, b"project") + elements)
+
+
+def meaning(value):
+    if isinstance(value, dict):
+        return ENTITY_PROTO
+    if isinstance(value, bytes):
+        return BLOB
+    if isinstance(value, tuple) and value[0] == "timestamp":
+        return GD_WHEN
+    if isinstance(value, tuple) and value[0] == "geopoint":
+        return GEORSS_POINT
+    return 0
+
+
+def encode_property(name, value, value_meaning=None, multiple=False):
+    value_meaning = meaning(value) if value_meaning is None else value_meaning
+    return (
+        (integer(1, value_meaning) if value_meaning else b"")
+        + length_delimited(3, name.encode("utf-8"))
+        + integer(4, int(multiple))
+        + length_delimited(5, property_value(value))
+    )
+
+
+def entity(path, data):
+    """
+    Encodes an EntityProto message. Numeric document IDs (`users/42`) are encoded as integer IDs.
+    """
+    encoded = b""
+    if path:
+        segments = path.split("/")
+        elements = b""
+        for kind, name in zip(segments[0::2], segments[1::2]):
+            identifier = integer(3, int(name)) if name.isdigit() else length_delimited(4, name.encode("utf-8"))
+            elements += group(1, length_delimited(2, kind.encode("utf-8")) + identifier)
+        encoded += length_delimited(13, length_delimited(13, b"project") + length_delimited(14, elements))
+    for name, value in data.items():
+        if isinstance(value, list):
+            if not value:
+                encoded += length_delimited(14, encode_property(name, None, EMPTY_LIST))
+            for element in value:
+                encoded += length_delimited(15, encode_property(name, element, multiple=True))
+        else:
+            encoded += length_delimited(14, encode_property(name, value))
+    return encoded
+
+
+def write_log(path, records):
+    """
+    Writes records in the LevelDB log format, splitting them across 32 KiB blocks.
+    """
+    log = bytearray()
+    for record in records:
+        first = True
+        while True:
+            block_left = BLOCK_SIZE - len(log) % BLOCK_SIZE
+            if block_left < HEADER_SIZE:
+                log += b"\0" * block_left
+                block_left = BLOCK_SIZE
+            fragment, record = record[:block_left - HEADER_SIZE], record[block_left - HEADER_SIZE:]
+            last = not record
+            record_type = (FULL if last else FIRST) if first else (LAST if last else MIDDLE)
+            checksum = masked_crc32c(bytes([record_type]) + fragment)
+            log += struct.pack("<IHB", checksum, len(fragment), record_type) + fragment
+            first = False
+            if last:
+                break
+    with open(path, "wb") as log_file:
+        log_file.write(log)
+
+
+def filler(path, size):
+    """
+    Returns a document record of exactly `size` bytes, padded with a text field.
+    """
+    length = size
+    while True:
+        record = entity(path, {"bio": "x" * length})
+        if len(record) == size:
+            return record
+        length -= len(record) - size
+
+
+def build_records():
+    records = [
+        entity("users/u1", {
+            "name": "Ada",
+            "age": 36,
+            "balance": -5,
+            "score": 1.5,
+            "active": True,
+            "avatar": b"\x89PNG",
+            "joined": ("timestamp", 1700000000123456),
+            "home": ("geopoint", 48.8566, 2.3522),
+            "tags": ["admin", "beta"],
+            "teams": [],
+            "address": {"city": "Paris", "geo": {"zip": "75001"}},
+            "nickname": None,
+        }),
+        entity("users/42", {"name": "Grace", "age": 45}),
+        entity("users/u1/orders/o1", {"total": 3, "user": ("reference", "users/u1")}),
+    ]
+    # Fills the first block, leaving a trailer too small for a header
+    used = sum(HEADER_SIZE + len(record) for record in records)
+    records.append(filler("users/u2", BLOCK_SIZE - used - TRAILER_SIZE - HEADER_SIZE))
+    records.append(entity("users/u3", {"name": "Linus", "bio": "y" * LONG_TEXT_LENGTH}))
+    records.append(entity("users/42/orders/o2", {"total": 7, "user": ("reference", "users/42")}))
+    return records
+
+
+if __name__ == "__main__":
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export")
+    os.makedirs(directory, exist_ok=True)
+    write_log(os.path.join(directory, "output-0"), build_records())
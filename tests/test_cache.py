@@ -0,0 +1,26 @@
+import os
+import stat
+from cache import FILE_MODE, DiskCache
+
+
+def test_copy_is_independent_of_the_entry(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"))
+    cache.set("ab12", b"image")
+    output = tmp_path / "diagram.png"
+    output.write_bytes(b"old")
+    assert cache.copy("ab12", str(output))
+    assert output.read_bytes() == b"image"
+    assert stat.S_IMODE(output.stat().st_mode) == FILE_MODE
+
+    # Editing the output in place leaves the cached entry intact
+    with open(output, "r+b") as output_file:
+        output_file.write(b"edited")
+    assert cache.get("ab12") == b"image"
+    assert os.stat(cache.path("ab12")).st_ino != output.stat().st_ino
+
+
+def test_copy_of_a_missing_key(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"))
+    output = tmp_path / "diagram.png"
+    assert not cache.copy("cd34", str(output))
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,56 @@
+import os
+from datetime import datetime, timezone
+from export_reader import DocumentReference, GeoPoint, decode_entity, iter_records, read_export
+
+# Export file generated by fixtures/make_export.py
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "export")
+EXPORT_FILE = os.path.join(EXPORT_DIR, "output-0")
+
+
+def test_iter_records_reassembles_fragments_and_skips_trailers():
+    paths = [decode_entity(record)[0] for record in iter_records(EXPORT_FILE)]
+    assert paths == ["users/u1", "users/42", "users/u1/orders/o1", "users/u2", "users/u3", "users/42/orders/o2"]
+
+    # users/u3 is split in FIRST, MIDDLE and LAST fragments across three blocks
+    _, data = decode_entity(list(iter_records(EXPORT_FILE))[4])
+    assert data == {"name": "Linus", "bio": "y" * 70000}
+
+
+def test_decode_entity_values():
+    path, data = decode_entity(next(iter_records(EXPORT_FILE)))
+    assert path == "users/u1"
+    home = data.pop("home")
+    assert isinstance(home, GeoPoint)
+    assert (home.latitude, home.longitude) == (48.8566, 2.3522)
+    assert data == {
+        "name": "Ada",
+        "age": 36,
+        "balance": -5,
+        "score": 1.5,
+        "active": True,
+        "avatar": b"\x89PNG",
+        "joined": datetime(2023, 11, 14, 22, 13, 20, 123456, tzinfo=timezone.utc),
+        "tags": ["admin", "beta"],
+        "teams": [],
+        "address": {"city": "Paris", "geo": {"zip": "75001"}},
+        "nickname": None,
+    }
+
+
+def test_decode_entity_references():
+    _, data = decode_entity(list(iter_records(EXPORT_FILE))[2])
+    assert isinstance(data["user"], DocumentReference)
+    assert data["user"].path == "users/u1"
+    assert data["total"] == 3
+
+
+def test_read_export():
+    stats = {}
+    profiles = {}
+    schema = read_export(EXPORT_DIR, max_workers=1, stats=stats, profiles=profiles)
+    assert set(schema) == {"users", "users/*/orders"}
+    assert set(schema["users/*/orders"]) == {"total", "user"}
+    assert {"name", "bio", "home", "address.city", "address.geo.zip"} <= set(schema["users"])
+    assert stats["users"]["documents"] == 4
+    assert stats["users/*/orders"] == {"documents": 2, "reads": 0, "coverage": 1.0}
+    assert profiles["users/*/orders"].fields["user"].references == {"users": 2}
@@ -0,0 +1,62 @@
+from heuristics import infer_foreign_keys
+from profiler import CollectionProfile
+
+
+def profile_of(documents):
+    profile = CollectionProfile(sketches=True)
+    for doc_id, data in documents.items():
+        profile.add_document(data, doc_id)
+    return profile
+
+
+def database():
+    users = {f"user{index:04d}": {"name": f"User {index}", "uid": f"user{index:04d}"} for index in range(200)}
+    teams = {f"team{index:03d}": {"name": f"Team {index}"} for index in range(20)}
+    posts = {
+        f"post{index:04d}": {
+            "owner": f"user{index % 150:04d}",
+            "team": f"team{index % 20:03d}",
+            "status": "published",
+            "title": f"Post number {index}",
+        }
+        for index in range(300)
+    }
+    return {
+        "users": profile_of(users),
+        "teams": profile_of(teams),
+        "posts": profile_of(posts),
+    }
+
+
+def test_infer_foreign_keys_from_value_overlap():
+    relationships = infer_foreign_keys(database())
+    assert sorted(relationships["posts"]) == [("owner", "users"), ("team", "teams")]
+    # A field repeating the ID of its own document is not a foreign key
+    assert relationships["users"] == []
+    assert relationships["teams"] == []
+
+
+def test_infer_foreign_keys_of_some_collections():
+    relationships = infer_foreign_keys(database(), collections=["posts"])
+    assert list(relationships) == ["posts"]
+
+
+def test_infer_foreign_keys_reports_overlapping_fields():
+    overlapping = set()
+    infer_foreign_keys(database(), overlapping=overlapping)
+    assert overlapping == {("posts", "owner"), ("posts", "team")}
+
+
+def test_infer_foreign_keys_thresholds():
+    profiles = database()
+    # Too few distinct values to be matched
+    assert infer_foreign_keys(profiles, min_distinct=1000)["posts"] == []
+    # Containment can never exceed 1
+    assert infer_foreign_keys(profiles, threshold=1.01)["posts"] == []
+
+
+def test_infer_foreign_keys_without_sketches():
+    profiles = {"users": CollectionProfile(sketches=False), "posts": CollectionProfile(sketches=False)}
+    profiles["users"].add_document({"name": "Ada"}, "u1")
+    profiles["posts"].add_document({"owner": "u1"}, "p1")
+    assert infer_foreign_keys(profiles) == {"users": [], "posts": []}
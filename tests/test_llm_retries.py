@@ -0,0 +1,135 @@
+import json
+import asyncio
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import utils
+from ratelimit import RateLimiter
+
+openai = pytest.importorskip("openai")
+
+COMPLETION = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "test",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "None"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 1, "total_tokens": 13},
+}
+
+REQUEST = {"model": "test", "messages": [{"role": "user", "content": "Which collections?"}], "max_tokens": 16}
+
+
+class StubServer:
+    """
+    Local OpenAI-compatible HTTP server answering chat completions with scripted responses.
+
+    Args:
+        responses (list): The (status, headers) of each response in turn; the last one is repeated.
+                          Status 200 answers with a completion.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, headers = server.responses[min(server.requests, len(server.responses) - 1)]
+                server.requests += 1
+                body = json.dumps(COMPLETION if status == 200 else {"error": {"message": "stub error"}}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def send(monkeypatch, server, max_retries=3, backoff=0.25):
+    """
+    Sends REQUEST through `_create_completion_async`, recording the retry delays instead of sleeping.
+
+    Returns:
+        tuple: The response, and the delays slept before each retry.
+    """
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    delays = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    monkeypatch.setattr(utils, "asyncio", SimpleNamespace(sleep=sleep))
+    monkeypatch.setattr(utils, "backoff_delay", lambda attempt: backoff * 2 ** attempt)
+
+    async def scenario():
+        client = openai.AsyncOpenAI(api_key="test", base_url=server.base_url, max_retries=0)
+        try:
+            return await utils._create_completion_async(
+                client, RateLimiter(0, 0), asyncio.Semaphore(1), max_retries, REQUEST
+            )
+        finally:
+            await client.close()
+
+    try:
+        return asyncio.run(scenario()), delays
+    except openai.APIStatusError as error:
+        error.delays = delays
+        raise
+
+
+def test_retries_rate_limits_and_server_errors(monkeypatch):
+    with StubServer([(429, {}), (500, {}), (503, {}), (200, {})]) as server:
+        response, delays = send(monkeypatch, server)
+    assert response.choices[0].message.content == "None"
+    assert server.requests == 4
+    # Exponential backoff between the attempts
+    assert delays == [0.25, 0.5, 1.0]
+
+
+def test_honours_retry_after(monkeypatch):
+    with StubServer([(429, {"retry-after": "7"}), (429, {"retry-after": "0.1"}), (200, {})]) as server:
+        _, delays = send(monkeypatch, server)
+    assert server.requests == 3
+    # retry-after is a lower bound of the backoff delay
+    assert delays == [7.0, 0.5]
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    with StubServer([(503, {})]) as server:
+        with pytest.raises(openai.APIStatusError) as raised:
+            send(monkeypatch, server, max_retries=2)
+    assert raised.value.status_code == 503
+    assert server.requests == 3
+    assert raised.value.delays == [0.25, 0.5]
+
+
+def test_does_not_retry_client_errors(monkeypatch):
+    with StubServer([(400, {}), (200, {})]) as server:
+        with pytest.raises(openai.APIStatusError) as raised:
+            send(monkeypatch, server)
+    assert raised.value.status_code == 400
+    assert server.requests == 1
+    assert raised.value.delays == []
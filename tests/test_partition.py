@@ -0,0 +1,71 @@
+import random
+import pytest
+from partition import UnionFind, _adjacency, _split_component, partition_schema, partition_subgraphs
+
+
+def random_graph(collections, edges, seed):
+    """
+    Returns the schema and relationships of a random database, with some isolated collections.
+    """
+    rng = random.Random(seed)
+    names = [f"c{index:04d}" for index in range(collections)]
+    schema = {name: {"name": "string"} for name in names}
+    relationships = {}
+    for index in range(edges):
+        source, target = rng.choice(names), rng.choice(names)
+        relationships.setdefault(source, []).append((f"ref{index}", target))
+    return schema, relationships
+
+
+def test_union_find():
+    sets = UnionFind("abcdef")
+    sets.union("a", "b")
+    sets.union("c", "d")
+    sets.union("b", "d")
+    assert sets.find("a") == sets.find("c") == sets.find("d")
+    assert sets.find("e") != sets.find("a")
+    assert sets.size[sets.find("a")] == 4
+
+
+@pytest.mark.parametrize("max_size", [1, 3, 10])
+def test_split_component_caps_communities(max_size):
+    schema, relationships = random_graph(60, 120, seed=max_size)
+    neighbours = _adjacency(schema, relationships)
+    communities = _split_component(list(schema), neighbours, max_size)
+    assert all(1 <= len(community) <= max_size for community in communities)
+    assert sorted(collection for community in communities for collection in community) == sorted(schema)
+
+
+@pytest.mark.parametrize("collections,edges,max_size", [(1, 0, 5), (50, 0, 7), (200, 150, 25), (300, 900, 40), (80, 200, 1)])
+def test_partition_schema(collections, edges, max_size):
+    schema, relationships = random_graph(collections, edges, seed=collections + edges)
+    partitions = partition_schema(schema, relationships, max_size)
+    assert all(1 <= len(partition) <= max_size for partition in partitions)
+    # Every collection is assigned to exactly one partition
+    assigned = [collection for partition in partitions for collection in partition]
+    assert sorted(assigned) == sorted(schema)
+    # The same schema is always partitioned the same way, whatever the order of its collections
+    shuffled = dict(sorted(schema.items(), reverse=True))
+    assert partition_schema(schema, relationships, max_size) == partitions
+    assert partition_schema(shuffled, relationships, max_size) == partitions
+
+
+def test_partition_schema_keeps_components_together():
+    schema = {name: {} for name in ["users", "posts", "comments", "logs", "settings"]}
+    relationships = {"posts": [("author", "users")], "comments": [("post", "posts")]}
+    partitions = partition_schema(schema, relationships, max_size=3)
+    assert sorted(partitions[0]) == ["comments", "posts", "users"]
+    assert sorted(partitions[1]) == ["logs", "settings"]
+
+
+def test_partition_subgraphs_draws_stubs():
+    schema = {"users": {}, "posts": {}}
+    relationships = {"posts": [("author", "users"), ("tag", "tags")]}
+    (users, users_relationships, users_stubs), (posts, posts_relationships, posts_stubs) = partition_subgraphs(
+        schema, relationships, [["users"], ["posts"]]
+    )
+    assert list(users) == ["users"] and list(posts) == ["posts"]
+    assert users_relationships == {"posts": [("author", "users")]}
+    assert users_stubs == {"posts": "part-002"}
+    assert posts_relationships == {"posts": [("author", "users"), ("tag", "tags")]}
+    assert posts_stubs == {"users": "part-001"}
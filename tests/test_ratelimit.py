@@ -0,0 +1,109 @@
+import asyncio
+import random
+from types import SimpleNamespace
+import ratelimit
+from ratelimit import RateLimiter, TokenBucket, backoff_delay
+
+
+class FakeClock:
+    """
+    Monotonic clock advanced by the sleeps of the bucket, so that tests do not wait.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def fake_clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(ratelimit, "asyncio", SimpleNamespace(sleep=clock.sleep, Lock=asyncio.Lock))
+    return clock
+
+
+def test_token_bucket_refill(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    # 60 tokens per minute: one token per second, and a capacity of 60 tokens
+    bucket = TokenBucket(60)
+
+    async def scenario():
+        await bucket.acquire(60)
+        assert clock.sleeps == []
+        assert bucket.tokens == 0
+
+        await bucket.acquire(30)
+        assert clock.sleeps == [30.0]
+        assert bucket.tokens == 0
+
+        clock.now += 10
+        await bucket.acquire(5)
+        assert clock.sleeps == [30.0]
+        assert bucket.tokens == 5
+
+        # The bucket never holds more than its capacity
+        clock.now += 1000
+        await bucket.acquire(1)
+        assert bucket.tokens == 59
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_caps_requests_at_capacity(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    bucket = TokenBucket(60, capacity=10)
+
+    async def scenario():
+        await bucket.acquire(10)
+        # A request larger than the capacity waits for a full bucket instead of forever
+        await bucket.acquire(100)
+        assert clock.sleeps == [10.0]
+        assert bucket.tokens == 0
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_without_rate_never_waits(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    bucket = TokenBucket(0)
+
+    async def scenario():
+        for _ in range(100):
+            await bucket.acquire(10 ** 6)
+
+    asyncio.run(scenario())
+    assert clock.sleeps == []
+
+
+def test_rate_limiter_paces_requests_and_tokens(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    limiter = RateLimiter(requests_per_minute=120, tokens_per_minute=600)
+
+    async def scenario():
+        # 2 requests per second and 10 tokens per second, each bucket starting full
+        for _ in range(120):
+            await limiter.acquire(5)
+        elapsed = clock.now - 1000.0
+        assert elapsed == 0
+        await limiter.acquire(5)
+        await limiter.acquire(20)
+
+    asyncio.run(scenario())
+    # The tokens are exhausted first (120 * 5 = 600), then each bucket waits for what is missing
+    assert clock.sleeps == [0.5, 0.5, 1.5]
+
+
+def test_backoff_delay_is_bounded_exponential():
+    random.seed(0)
+    for attempt in range(10):
+        delays = [backoff_delay(attempt, base=1.0, cap=20.0) for _ in range(200)]
+        assert all(0 <= delay <= min(20.0, 2 ** attempt) for delay in delays)
+        # Full jitter spreads the delays over the whole interval
+        assert max(delays) > 0.8 * min(20.0, 2 ** attempt)
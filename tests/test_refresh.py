@@ -0,0 +1,70 @@
+import pytest
+import utils
+from benchmarks.fake_firestore import FakeFirestore
+from profiler import CollectionProfile
+from snapshots import SnapshotStore
+
+
+def documents_since(collection, field, watermark, limit):
+    return list(collection.where(field, ">", watermark).order_by(field).limit(limit).stream())
+
+
+@pytest.fixture
+def refresh(tmp_path, monkeypatch):
+    """
+    Returns a function refreshing the `users` collection of a fake database against a snapshot store.
+    """
+    monkeypatch.setattr(utils, "_documents_since", documents_since)
+    snapshots = SnapshotStore(str(tmp_path / "snapshots.json"))
+
+    def refresh_users(users):
+        collection = FakeFirestore({"users": users}).collection("users")
+        profile, _ = utils._refresh_collection(collection, "users", snapshots, utils._sample_collection,
+                                               watermark_field="updatedAt")
+        return profile
+
+    return refresh_users
+
+
+def users():
+    users = {f"u{index}": {"name": f"User {index}", "updatedAt": index} for index in range(5)}
+    users["u0"]["nick"] = "zero"
+    return users
+
+
+def test_updates_of_profiled_documents_are_not_counted_again(refresh):
+    data = users()
+    profile = refresh(data)
+    assert (profile.documents, profile.complete) == (5, True)
+
+    for version in range(1, 4):
+        data["u3"] = {"name": "Renamed", "age": version, "updatedAt": 10 + version}
+        profile = refresh(data)
+        assert profile.documents == 5
+        assert profile.complete
+        assert profile.fields["name"].count == 5
+        assert profile.fields["nick"].count == 1
+        # A field first seen in an updated document is present in at least that document
+        assert profile.fields["age"].count == 1
+        assert profile.fields["age"].types == {"integer": version}
+
+
+def test_new_documents_are_counted(refresh):
+    data = users()
+    refresh(data)
+    data["u9"] = {"name": "New", "updatedAt": 20}
+    data["u1"] = {"name": "Updated", "updatedAt": 21}
+    profile = refresh(data)
+    assert profile.documents == 6
+    assert profile.complete
+    assert profile.fields["name"].count == 6
+
+
+def test_add_document_update():
+    profile = CollectionProfile(sketches=False)
+    profile.add_document({"name": "Ada", "address": {"city": "Paris"}}, "u1")
+    profile.add_document({"name": "Ada L.", "address": {"city": "London", "zip": "N1"}}, "u1", new_document=False)
+    assert profile.documents == 1
+    assert profile.fields["name"].count == 1
+    assert profile.fields["address.city"].count == 1
+    assert profile.fields["address.zip"].count == 1
@@ -0,0 +1,74 @@
+import sys
+import functools
+import pytest
+import render
+import utils
+from cache import DiskCache
+from render import render_dot, render_plantuml_cached
+
+
+def test_render_dot_removes_its_temporary_file_when_lines_fail(tmp_path):
+    def lines():
+        yield "digraph G {"
+        raise ValueError("broken schema")
+
+    with pytest.raises(ValueError):
+        render_dot(lines(), str(tmp_path / "schema.png"), dot="/nonexistent/dot")
+    assert list(tmp_path.iterdir()) == []
+
+
+FAKE_PLANTUML = '''#!{python}
+import sys
+delimiter = sys.argv[sys.argv.index("-pipedelimitor") + 1].encode()
+lines = []
+for line in sys.stdin.buffer:
+    lines.append(line)
+    if line.strip() == b"@enduml":
+        sys.stdout.buffer.write(b"IMAGE " + b"".join(lines) + delimiter + b"\\n")
+        sys.stdout.buffer.flush()
+        lines = []
+'''
+
+
+@pytest.fixture
+def fake_plantuml(tmp_path, monkeypatch):
+    """
+    Replaces the JVM of the local renderer by a script answering each diagram with its own text.
+    """
+    java = tmp_path / "java"
+    java.write_text(FAKE_PLANTUML.format(python=sys.executable))
+    java.chmod(0o755)
+    monkeypatch.setattr(render, "_pipes", {})
+    monkeypatch.setattr(render, "PlantUMLPipe", functools.partial(render.PlantUMLPipe, java=str(java)))
+    yield
+    render._close_pipes()
+
+
+def diagram(name):
+    yield "@startuml"
+    yield f"class {name}"
+    yield "@enduml"
+
+
+def test_render_plantuml_cached_streams_diagrams(tmp_path, fake_plantuml):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    cache = DiskCache(str(tmp_path / "cache"))
+    output_files = [str(output_dir / f"{name}.png") for name in ("users", "posts")]
+    assert render_plantuml_cached([diagram("users"), diagram("posts")], output_files, cache=cache) == 0
+    assert (output_dir / "users.png").read_bytes() == b"IMAGE @startuml\nclass users\n@enduml\n"
+    assert (output_dir / "posts.png").read_bytes() == b"IMAGE @startuml\nclass posts\n@enduml\n"
+
+    assert render_plantuml_cached([diagram("users"), diagram("tags")], output_files, cache=cache) == 1
+    assert (output_dir / "posts.png").read_bytes() == b"IMAGE @startuml\nclass tags\n@enduml\n"
+    # The temporary PlantUML files are removed
+    assert sorted(path.name for path in output_dir.iterdir()) == ["posts.png", "users.png"]
+
+
+def test_generate_uml_diagram_from_text_or_lines(tmp_path, fake_plantuml):
+    output_file = tmp_path / "schema.png"
+    utils.generate_uml_diagram(diagram("users"), str(output_file), backend="local", cache=False)
+    assert output_file.read_bytes() == b"IMAGE @startuml\nclass users\n@enduml\n"
+    utils.generate_uml_diagram("@startuml\nclass posts\n@enduml", str(output_file), backend="local", cache=False)
+    assert output_file.read_bytes() == b"IMAGE @startuml\nclass posts\n@enduml\n"
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == ".puml"] == []
@@ -0,0 +1,149 @@
+import pytest
+from partition import partition_schema
+from schema_diff import (
+    affected_collections, diff_schemas, is_empty, load_state, save_state, typed_schema, update_partitions,
+    update_relationships,
+)
+from profiler import CollectionProfile
+
+OLD_SCHEMA = {
+    "users": {"name": ["string"], "age": ["integer"]},
+    "posts": {"title": ["string"], "authorId": ["string"]},
+    "logs": {"message": ["string"]},
+}
+
+NEW_SCHEMA = {
+    "users": {"name": ["string"], "age": ["string"], "teamId": ["string"]},
+    "posts": {"title": ["string"], "authorId": ["string"]},
+    "teams": {"name": ["string"]},
+}
+
+RELATIONSHIPS = {"posts": [("authorId", "users")], "logs": [("userId", "users")], "users": []}
+
+
+def test_diff_schemas():
+    changeset = diff_schemas(OLD_SCHEMA, NEW_SCHEMA)
+    assert changeset["added_collections"] == ["teams"]
+    assert changeset["removed_collections"] == ["logs"]
+    assert changeset["changed_collections"] == {
+        "users": {
+            "added_fields": ["teamId"],
+            "removed_fields": [],
+            "retyped_fields": {"age": {"old": ["integer"], "new": ["string"]}},
+        }
+    }
+    assert not is_empty(changeset)
+    assert is_empty(diff_schemas(NEW_SCHEMA, NEW_SCHEMA))
+
+
+def test_diff_schemas_without_types():
+    old = {"users": ["name", "age"]}
+    new = {"users": {"name": ["string"], "email": ["string"]}}
+    changeset = diff_schemas(old, new)
+    # Fields are only retyped when both schemas are typed
+    assert changeset["changed_collections"] == {
+        "users": {"added_fields": ["email"], "removed_fields": ["age"], "retyped_fields": {}}
+    }
+
+
+def test_typed_schema():
+    profile = CollectionProfile(sketches=False)
+    profile.add_document({"name": "Ada", "age": 36}, "u1")
+    profile.add_document({"name": "Grace", "age": "45"}, "u2")
+    typed = typed_schema({"users": ["name", "age"], "posts": ["title"]}, {"users": profile})
+    assert typed == {"users": {"name": ["string"], "age": ["integer", "string"]}, "posts": {"title": []}}
+
+
+def test_state_round_trip(tmp_path):
+    path = str(tmp_path / "state" / "schema.json")
+    assert load_state(path) is None
+    save_state(path, NEW_SCHEMA, RELATIONSHIPS, [["users", "posts"]])
+    state = load_state(path)
+    assert state["schema"] == NEW_SCHEMA
+    assert state["relationships"] == RELATIONSHIPS
+    assert state["partitions"] == [["users", "posts"]]
+
+
+def test_affected_collections():
+    changeset = diff_schemas(OLD_SCHEMA, NEW_SCHEMA)
+    # teams is added, users changed, and users referenced the removed logs
+    assert affected_collections(NEW_SCHEMA, RELATIONSHIPS, changeset) == ["users", "teams"]
+
+    changeset = diff_schemas(OLD_SCHEMA, dict(OLD_SCHEMA, teams={"name": ["string"]}))
+    schema = dict(OLD_SCHEMA, posts={"title": ["string"], "teamId": ["string"]}, teams={"name": ["string"]})
+    # posts has a field named after the added teams collection
+    assert affected_collections(schema, RELATIONSHIPS, changeset) == ["posts", "teams"]
+
+
+def test_update_relationships():
+    calls = []
+
+    def identify(schema, collections, profiles=None):
+        calls.append((collections, profiles))
+        return {"users": [("teamId", "teams")], "teams": []}
+
+    changeset = diff_schemas(OLD_SCHEMA, NEW_SCHEMA)
+    relationships = update_relationships(NEW_SCHEMA, RELATIONSHIPS, changeset, identify, profiles="profiles")
+    assert calls == [(["users", "teams"], "profiles")]
+    assert relationships == {"users": [("teamId", "teams")], "posts": [("authorId", "users")], "teams": []}
+
+    # Nothing is identified again without a change
+    assert update_relationships(NEW_SCHEMA, relationships, diff_schemas(NEW_SCHEMA, NEW_SCHEMA), identify) == relationships
+    assert len(calls) == 1
+
+
+def changeset_of(added=(), removed=()):
+    return {"added_collections": list(added), "removed_collections": list(removed), "changed_collections": {}}
+
+
+def schema_of(*collections):
+    return {collection: {} for collection in collections}
+
+
+def test_update_partitions_places_added_collections():
+    partitions = [["a", "b"], ["c"]]
+    schema = schema_of("a", "b", "c", "d", "e", "f")
+    relationships = {"d": [("cId", "c")], "e": [("aId", "a")], "b": [("fId", "f")]}
+    updated = update_partitions(partitions, schema, relationships, changeset_of(added="def"), max_size=2)
+    # d joins the partition of c; the partitions of a and c are full, so e starts a new partition, which f joins
+    assert updated == [["a", "b"], ["c", "d"], ["e", "f"]]
+
+
+def test_update_partitions_keeps_unchanged_partitions():
+    schema = schema_of(*"abcdefgh")
+    relationships = {"b": [("aId", "a")], "d": [("cId", "c")]}
+    partitions = partition_schema(schema, relationships, max_size=3)
+    changeset = changeset_of()
+    assert update_partitions(partitions, schema, relationships, changeset, max_size=3) == partitions
+
+
+def test_update_partitions_drops_partitions_that_stay_empty():
+    partitions = [["a"], ["b"], ["c"]]
+    schema = schema_of("a", "c")
+    # The emptied partition keeps its place, so that c keeps its name
+    partitions = update_partitions(partitions, schema, {}, changeset_of(removed="b"), max_size=2)
+    assert partitions == [["a"], [], ["c"]]
+    # It is dropped if it is still empty after the next change
+    assert update_partitions(partitions, schema, {}, changeset_of(), max_size=2) == [["a"], ["c"]]
+
+
+def test_update_partitions_reuses_empty_partitions():
+    partitions = [["a"], [], ["c"]]
+    schema = schema_of("a", "c", "d")
+    assert update_partitions(partitions, schema, {}, changeset_of(added="d"), max_size=2) == [["a"], ["d"], ["c"]]
+
+
+def test_update_partitions_drops_empty_partitions_at_the_end():
+    partitions = [["a"], ["b", "c"]]
+    schema = schema_of("a")
+    assert update_partitions(partitions, schema, {}, changeset_of(removed="bc"), max_size=2) == [["a"]]
+
+
+@pytest.mark.parametrize("max_size", [1, 2, 5])
+def test_update_partitions_respects_max_size(max_size):
+    schema = schema_of(*[f"c{index}" for index in range(20)])
+    relationships = {f"c{index}": [("parentId", "c0")] for index in range(1, 20)}
+    partitions = [["c0"]]
+    updated = update_partitions(partitions, schema, relationships, changeset_of(added=list(schema)[1:]), max_size)
+    assert all(1 <= len(collections) <= max_size for collections in updated)
+    assert sorted(collection for collections in updated for collection in collections) == sorted(schema)
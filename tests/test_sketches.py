@@ -0,0 +1,129 @@
+import json
+import pytest
+from sketches import HyperLogLog, MinHash, ValueSketch
+
+
+def sketch_of(values):
+    sketch = ValueSketch()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def reference_signature(values):
+    """
+    Densifies a MinHash signature by scanning forward from every empty bin, as described by `MinHash.signature`.
+    """
+    size = len(values)
+    signature = list(values)
+    if all(value == MinHash.EMPTY for value in values):
+        return signature
+    for index in range(size):
+        if values[index] == MinHash.EMPTY:
+            distance = 1
+            while values[(index + distance) % size] == MinHash.EMPTY:
+                distance += 1
+            signature[index] = values[(index + distance) % size] + distance * MinHash.EMPTY
+    return signature
+
+
+@pytest.mark.parametrize("size", [1, 10, 100, 1000, 20000])
+def test_hyperloglog_count_accuracy(size):
+    hll = HyperLogLog()
+    for index in range(size):
+        hll.add(f"value-{index}")
+        # Duplicates are not counted
+        hll.add(f"value-{index}")
+    # 256 registers: a standard error of 1.04 / 16 = 6.5%, bounded here at 4 standard errors
+    assert abs(hll.count() - size) <= max(1.0, 0.26 * size)
+
+
+def test_hyperloglog_merge_is_union():
+    left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for index in range(3000):
+        (left if index < 2000 else right).add(str(index))
+        if index >= 1000:
+            right.add(str(index))
+        union.add(str(index))
+    left.merge(right)
+    assert left.registers == union.registers
+    assert left.count() == union.count()
+
+
+def test_hyperloglog_count_follows_added_values():
+    hll = HyperLogLog()
+    hll.add("a")
+    first = hll.count()
+    for index in range(100):
+        hll.add(str(index))
+    assert hll.count() > first
+
+
+@pytest.mark.parametrize("size", [0, 1, 3, 20, 64, 500])
+def test_minhash_densification(size):
+    minhash = MinHash()
+    for index in range(size):
+        minhash.add(f"id-{index}")
+    assert minhash.signature() == reference_signature(minhash.values)
+    # The cached signature is invalidated by new values
+    minhash.add("another")
+    assert minhash.signature() == reference_signature(minhash.values)
+
+
+@pytest.mark.parametrize("overlap", [0, 250, 500, 750, 1000])
+def test_minhash_jaccard_accuracy(overlap):
+    left = MinHash()
+    right = MinHash()
+    for index in range(1000):
+        left.add(f"id-{index}")
+        right.add(f"id-{index + 1000 - overlap}")
+    expected = overlap / (2000 - overlap)
+    # 64 bins: a standard error of at most 0.0625, bounded here at 4 standard errors
+    assert abs(left.jaccard(right) - expected) <= 0.25
+
+
+def test_minhash_small_sets():
+    assert sketch_of(["a", "b"]).minhash.jaccard(sketch_of(["b", "a"]).minhash) == 1.0
+    assert sketch_of(["a", "b"]).minhash.jaccard(sketch_of(["c", "d"]).minhash) < 0.2
+
+
+def test_containment():
+    ids = sketch_of(f"user-{index}" for index in range(1000))
+    keys = sketch_of(f"user-{index}" for index in range(0, 1000, 10))
+    others = sketch_of(f"team-{index}" for index in range(100))
+    assert keys.containment(ids) >= 0.75
+    assert others.containment(ids) <= 0.1
+    assert ValueSketch().containment(ids) == 0.0
+
+
+def test_value_sketch_round_trip():
+    for values in ([], ["only"], [f"id-{index}" for index in range(5)], [f"id-{index}" for index in range(500)]):
+        sketch = sketch_of(values)
+        data = json.loads(json.dumps(sketch.to_dict()))
+        loaded = ValueSketch.from_dict(data)
+        assert loaded.hll.registers == sketch.hll.registers
+        assert loaded.hll.precision == sketch.hll.precision
+        assert loaded.count() == sketch.count()
+        assert loaded.minhash.values == sketch.minhash.values
+        assert loaded.minhash.signature() == sketch.minhash.signature()
+
+
+def test_value_sketch_serializes_empty_bins_as_none():
+    data = sketch_of(["a", "b", "c"]).to_dict()
+    assert None in data["minhash"]
+    assert all(value is None or 0 <= value < 2 ** 64 for value in data["minhash"])
+
+
+def test_value_sketch_loads_empty_bins_saved_as_integers():
+    sketch = sketch_of(["a", "b", "c"])
+    data = sketch.to_dict()
+    data["minhash"] = [MinHash.EMPTY if value is None else value for value in data["minhash"]]
+    assert ValueSketch.from_dict(data).minhash.values == sketch.minhash.values
+
+
+def test_value_sketch_msgpack_round_trip():
+    msgpack = pytest.importorskip("msgpack")
+    sketch = sketch_of(f"id-{index}" for index in range(10))
+    loaded = ValueSketch.from_dict(msgpack.unpackb(msgpack.packb(sketch.to_dict()), raw=False))
+    assert loaded.minhash.values == sketch.minhash.values
+    assert loaded.count() == sketch.count()
@@ -1,100 +1,1022 @@
 import os
 import json
-import pydot
-import tempfile
-from openai import OpenAI
-from plantuml import PlantUML
+import asyncio
+import time
 from datetime import datetime
-from config import OPENAI_API_KEY
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import instrumentation
+from profiler import CollectionProfile
+from snapshots import decode_watermark, encode_watermark
+from ratelimit import RateLimiter, backoff_delay
+from cache import DiskCache, content_key
+from prompt_context import build_collection_index, build_context, estimate_tokens
+from heuristics import detect_relationships
+from render import render_cached, render_dot, render_plantuml_files, spool_lines
+from config import (
+    OPENAI_API_KEY, SCHEMA_MAX_WORKERS, SCHEMA_MAX_DEPTH, SCHEMA_MAX_FANOUT,
+    SCHEMA_ADAPTIVE_SAMPLING, SCHEMA_PAGE_SIZE, SCHEMA_PATIENCE, SCHEMA_MAX_PAGES,
+    OPENAI_BASE_URL, OPENAI_MODEL, OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE, OPENAI_MAX_RETRIES,
+    RELATIONSHIPS_BATCH_SIZE, RELATIONSHIPS_CONCURRENCY,
+    SCHEMA_WATERMARK_FIELD, SCHEMA_REFRESH_LIMIT,
+    RELATIONSHIPS_CACHE_DIR, RELATIONSHIPS_CACHE_MAX_BYTES, RELATIONSHIPS_CACHE_MAX_AGE, RELATIONSHIPS_CONTEXT_BUDGET,
+    PLANTUML_BACKEND, PLANTUML_SERVER_URL,
+)
 # from firebase_admin import credentials, firestore, initialize_app
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Synchronous OpenAI client, created on first use so that importing this module does not load the openai package
+client = None
 
-def get_schema(db):
+def _record_firestore_call(call, documents=0):
+    """
+    Records a Firestore API call and the number of documents it returned in the metrics of the run.
+    """
+    instrumentation.count("api_calls_total", service="firestore", call=call)
+    if documents:
+        instrumentation.count("documents_read_total", documents, source="firestore")
+
+def _sample_collection(collection, limit=50):
+    """
+    Samples the first documents of a collection and collects their field names.
+
+    Args:
+        collection: The Firestore collection reference.
+        limit (int): The maximum number of documents to read. Default is 50.
+
+    Returns:
+        tuple: The CollectionProfile of the sampled documents and their references.
+    """
+    profile = CollectionProfile()
+    references = []
+    docs = collection.limit(limit).stream()
+    for doc in docs:
+        references.append(doc.reference)
+        profile.add_document(doc.to_dict(), doc.id)
+    _record_firestore_call("query", profile.documents)
+    # Firestore bills a query that returns nothing as one read
+    profile.reads = max(1, profile.documents)
+    profile.complete = profile.documents < limit
+    return profile, references
+
+def _split_points(first_id, last_id, count):
+    """
+    Generates document IDs spread evenly across the key range between two document IDs.
+
+    The parts of the IDs after their common prefix are read as numbers whose digits are the characters
+    between the smallest and the largest character of these parts, so the points follow the actual key
+    range of the collection whatever the shape of its IDs (auto-generated, `user0042`, e-mails, ...).
+
+    Args:
+        first_id (str): The smallest document ID of the range.
+        last_id (str): The largest document ID of the range.
+        count (int): The maximum number of split points to generate.
+
+    Returns:
+        list: The distinct split points strictly between the two IDs, in key order.
+    """
+    prefix = os.path.commonprefix([first_id, last_id])
+    first, last = first_id[len(prefix):], last_id[len(prefix):]
+    if not first + last:
+        return []
+    low = min(map(ord, first + last))
+    base = max(map(ord, first + last)) - low + 1
+    length = max(len(first), len(last))
+
+    def to_number(suffix):
+        number = 0
+        for character in suffix.ljust(length, chr(low)):
+            number = number * base + ord(character) - low
+        return number
+
+    start, stop = to_number(first), to_number(last)
+    points = []
+    for index in range(1, count + 1):
+        number = start + (stop - start) * index // (count + 1)
+        characters = []
+        for _ in range(length):
+            number, digit = divmod(number, base)
+            characters.append(chr(low + digit))
+        point = prefix + "".join(reversed(characters))
+        # Document IDs cannot contain slashes
+        if first_id < point < last_id and "/" not in point and (not points or point > points[-1]):
+            points.append(point)
+    return points
+
+def _spread_order(count):
+    """
+    Returns the indices of `count` consecutive segments coarse to fine (first, middle, quarters, ...),
+    so that any prefix of the order is spread across the segments as evenly as possible.
+    """
+    order = []
+    seen = set()
+    index = 0
+    while len(order) < count:
+        # Van der Corput sequence in base 2
+        fraction, denominator, n = 0.0, 1, index
+        while n:
+            denominator *= 2
+            fraction += (n % 2) / denominator
+            n //= 2
+        segment = int(fraction * count)
+        if segment not in seen:
+            seen.add(segment)
+            order.append(segment)
+        index += 1
+    return order
+
+def _sample_collection_adaptive(collection, page_size=SCHEMA_PAGE_SIZE, patience=SCHEMA_PATIENCE, max_pages=SCHEMA_MAX_PAGES):
+    """
+    Samples a collection page by page until the set of fields converges.
+
+    The first page is read from the start of the collection, and holds the whole collection when it is not
+    full. Otherwise, the key range between its last document and the last document of the collection is cut
+    into segments at split points, and each following page reads the start of a segment, ending before the
+    next split point, so pages never read a document twice. Segments are read coarse to fine, so the sample
+    is spread across the collection instead of being the first documents in key order. Sampling stops once
+    `patience` consecutive pages did not contain any new field, after `max_pages` pages, or when every
+    segment was read to its end, in which case the profile is complete.
+
+    Args:
+        collection: The Firestore collection reference.
+        page_size (int): The number of documents read per page.
+        patience (int): The number of consecutive pages without new fields after which sampling stops.
+        max_pages (int): The maximum number of pages read.
+
+    Returns:
+        tuple: The CollectionProfile of the sampled documents and their references.
+    """
+    profile = CollectionProfile()
+    profile.complete = False
+    references = []
+
+    def read(query):
+        docs = list(query.stream())
+        _record_firestore_call("query", len(docs))
+        # Firestore bills a query that returns nothing as one read
+        profile.reads += max(1, len(docs))
+        new_field = False
+        for doc in docs:
+            references.append(doc.reference)
+            new_field = profile.add_document(doc.to_dict(), doc.id) or new_field
+        return docs, new_field
+
+    first_page, _ = read(collection.order_by("__name__").limit(page_size))
+    if len(first_page) < page_size:
+        # The whole collection fits in the first page
+        profile.complete = True
+        return profile, references
+    first_id = first_page[-1].id
+    last_page = list(collection.order_by("__name__", direction="DESCENDING").limit(1).stream())
+    _record_firestore_call("query", len(last_page))
+    profile.reads += 1
+    last_id = last_page[0].id if last_page else first_id
+    if last_id == first_id:
+        profile.complete = True
+        return profile, references
+    references.append(last_page[0].reference)
+    profile.add_document(last_page[0].to_dict(), last_id)
+
+    # Segment i holds the documents from boundaries[i] (excluded for the first one) to boundaries[i + 1]
+    # (excluded), so the segments cover the documents not read yet exactly once
+    boundaries = [first_id] + _split_points(first_id, last_id, max(0, max_pages - 2)) + [last_id]
+    segments = len(boundaries) - 1
+    exhausted = stale_pages = 0
+    for page, segment in enumerate(_spread_order(segments), start=1):
+        if page >= max_pages:
+            break
+        start = {"__name__": collection.document(boundaries[segment])}
+        query = collection.order_by("__name__")
+        query = query.start_after(start) if segment == 0 else query.start_at(start)
+        query = query.end_before({"__name__": collection.document(boundaries[segment + 1])})
+        docs, new_field = read(query.limit(page_size))
+        if len(docs) < page_size:
+            exhausted += 1
+        stale_pages = 0 if new_field else stale_pages + 1
+        if stale_pages >= patience:
+            break
+    profile.complete = exhausted == segments
+    return profile, references
+
+def _count_documents(collection):
+    """
+    Counts the documents of a collection with a count() aggregation query.
+
+    Returns:
+        tuple: The number of documents and the billed reads (one per batch of up to 1000 index entries).
+    """
+    results = collection.count(alias="count").get()
+    _record_firestore_call("count")
+    count = int(results[0][0].value)
+    return count, max(1, -(-count // 1000))
+
+def _latest_watermark(collection, field):
+    """
+    Returns the largest value of the watermark field in a collection, or None if no document has it.
+    """
+    docs = list(collection.order_by(field, direction="DESCENDING").limit(1).stream())
+    _record_firestore_call("query", len(docs))
+    return docs[0].to_dict().get(field) if docs else None
+
+def _documents_since(collection, field, watermark, limit):
+    """
+    Returns the documents whose watermark field is greater than a watermark, oldest first.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    query = collection.where(filter=FieldFilter(field, ">", watermark)).order_by(field)
+    docs = list(query.limit(limit).stream())
+    _record_firestore_call("query", len(docs))
+    return docs
+
+def _refresh_collection(collection, path, snapshots, sample_collection, watermark_field=SCHEMA_WATERMARK_FIELD,
+                        limit=SCHEMA_REFRESH_LIMIT):
+    """
+    Profiles a collection, reusing its snapshot when possible.
+
+    Firestore cannot filter queries on the update time of documents, so changes are detected with a
+    count() aggregation and, if configured, a watermark field maintained by the application (e.g. an
+    `updatedAt` timestamp). A collection whose count did not change and that has no document past its
+    watermark is not read at all. Documents past the watermark are read, at most `limit` per run, and
+    merged into the snapshot profile. Only the documents missing from the snapshot are counted as new
+    documents; the others are updates of profiled documents, which only add their types and values, so
+    the counts of the profile keep matching the documents it holds. Other collections are sampled again
+    with `sample_collection`.
+
+    Args:
+        collection: The Firestore collection reference.
+        path (str): The path of the collection, which keys its snapshot.
+        snapshots (SnapshotStore): The snapshots of the previous runs, updated with the new ones.
+        sample_collection (callable): The sampling function used for new or changed collections.
+        watermark_field (str): The field holding the last update time of each document, or "" for none.
+        limit (int): The maximum number of documents read past the watermark.
+
+    Returns:
+        tuple: The CollectionProfile of the collection and the references of its sampled documents.
+    """
+    count, reads = _count_documents(collection)
+    snapshot = snapshots.get(path)
+
+    if snapshot is not None:
+        watermark = decode_watermark(snapshot["watermark"])
+        docs = []
+        if watermark_field and watermark is not None:
+            docs = _documents_since(collection, watermark_field, watermark, limit)
+            reads += max(1, len(docs))
+        if docs or count == snapshot["count"]:
+            profile = CollectionProfile.from_dict(snapshot["profile"])
+            doc_ids = snapshot["documents"]
+            profiled = set(doc_ids)
+            new_ids = []
+            for doc in docs:
+                data = doc.to_dict()
+                if doc.id not in profiled:
+                    profiled.add(doc.id)
+                    new_ids.append(doc.id)
+                    profile.add_document(data, doc.id)
+                else:
+                    profile.add_document(data, doc.id, new_document=False)
+                value = data.get(watermark_field)
+                if value is not None and value > watermark:
+                    watermark = value
+            # The snapshot keeps the IDs of every profiled document, newest first
+            doc_ids = new_ids + doc_ids
+            profile.complete = profile.complete and profile.documents >= count
+            snapshots.set(path, {
+                "count": count,
+                "watermark": encode_watermark(watermark),
+                "documents": doc_ids,
+                "profile": profile.to_dict(),
+            }, "updated" if docs else "unchanged")
+            profile.reads = reads
+            return profile, [collection.document(doc_id) for doc_id in doc_ids]
+
+    profile, references = sample_collection(collection)
+    reads += profile.reads
+    watermark = None
+    if watermark_field:
+        watermark = _latest_watermark(collection, watermark_field)
+        reads += 1
+    profile.reads = reads
+    snapshots.set(path, {
+        "count": count,
+        "watermark": encode_watermark(watermark),
+        "documents": [reference.id for reference in references],
+        "profile": profile.to_dict(),
+    }, "sampled")
+    return profile, references
+
+def _list_subcollections(document):
+    """
+    Lists the subcollections of a document.
+
+    Args:
+        document: The Firestore document reference.
+
+    Returns:
+        list: The collection references nested under the document.
+    """
+    subcollections = list(document.collections())
+    _record_firestore_call("list_collections")
+    return subcollections
+
+def _timed_collection(pattern, function, *args):
+    """
+    Calls a sampling function of a collection, timing it in the metrics of the run.
+    """
+    with instrumentation.timer("collection_seconds", collection=pattern):
+        return function(*args)
+
+def get_schema(db, max_workers=SCHEMA_MAX_WORKERS, max_depth=SCHEMA_MAX_DEPTH, max_fanout=SCHEMA_MAX_FANOUT,
+               adaptive=SCHEMA_ADAPTIVE_SAMPLING, stats=None, profiles=None, snapshots=None):
     """
     Retrieves the schema of a Firestore database.
 
+    Collections are sampled concurrently on a bounded thread pool, so the extraction time is
+    bounded by the slowest collections rather than by the number of collections.
+
+    When `max_depth` is greater than 0, subcollections are discovered through the sampled documents
+    and crawled as well. Listing subcollections and sampling them are queued on the same pool, so no
+    per-document API call blocks the rest of the crawl. Subcollections are merged by their collection
+    path pattern, where document IDs are replaced by `*` (e.g. `users/*/orders`).
+
+    By default the first 50 documents of each collection are read. With `adaptive` sampling, pages are
+    read from cursors spread across the key space until no new field appears for SCHEMA_PATIENCE
+    consecutive pages, which saves reads on uniform collections and finds more fields on sparse ones.
+
     Args:
         db: The Firestore database object.
+        max_workers (int): The maximum number of API calls made at the same time. A value of 1
+                           samples the collections one after another. Defaults to SCHEMA_MAX_WORKERS.
+        max_depth (int): How many levels of subcollections to crawl. Defaults to SCHEMA_MAX_DEPTH.
+        max_fanout (int): The maximum number of documents whose subcollections are listed, and the
+                          maximum number of collections sampled, for each collection path pattern.
+                          Defaults to SCHEMA_MAX_FANOUT.
+        adaptive (bool): Whether to use adaptive sampling. Defaults to SCHEMA_ADAPTIVE_SAMPLING.
+        stats (dict): An optional dictionary that is filled with the sampling statistics of each
+                      collection: the number of documents sampled, the billed reads spent and the
+                      estimated field coverage.
+        profiles (dict): An optional dictionary that is filled with the CollectionProfile of each
+                         collection, holding the presence count and value types of every field.
+        snapshots (SnapshotStore): Optional snapshots of the previous runs. Unchanged collections are then
+                                   not read again, and only the documents written since the last run are
+                                   read from the others (see `_refresh_collection`). The store is saved
+                                   with the new snapshots.
 
     Returns:
-        A dictionary representing the schema of the database. The keys are the collection names,
-        and the values are lists of field names present in each collection.
+        A dictionary representing the schema of the database. The keys are the collection names
+        (or collection path patterns for subcollections), and the values are lists of field names
+        present in each collection. Fields nested in maps are listed as dotted paths after their map.
+        The collections are kept in the order returned by `db.collections()`, each followed by its
+        subcollections, regardless of which finishes first.
     """
+    # Every sampled collection gets an order key derived from its position in the crawl, so that
+    # the schema does not depend on the order in which the API calls complete
+    samples = []
+    sample_collection = _sample_collection_adaptive if adaptive else _sample_collection
+    expanded = {}
+    sampled = {}
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        def submit_sample(collection, pattern, key, depth, path):
+            sampled[pattern] = sampled.get(pattern, 0) + 1
+            if snapshots is None:
+                future = executor.submit(_timed_collection, pattern, sample_collection, collection)
+            else:
+                future = executor.submit(_timed_collection, pattern, _refresh_collection, collection, path,
+                                         snapshots, sample_collection)
+            pending[future] = ("sample", pattern, key, depth, None)
+
+        for index, collection in enumerate(db.collections()):
+            submit_sample(collection, collection.id, (index,), 0, collection.id)
+        _record_firestore_call("list_collections")
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, pattern, key, depth, reference = pending.pop(future)
+
+                if kind == "sample":
+                    profile, references = future.result()
+                    instrumentation.count("billed_reads_total", profile.reads)
+                    samples.append((key, pattern, profile))
+                    if depth >= max_depth:
+                        continue
+                    budget = max(0, max_fanout - expanded.get(pattern, 0))
+                    expanded[pattern] = expanded.get(pattern, 0) + min(budget, len(references))
+                    for doc_index, reference in enumerate(references[:budget]):
+                        listing = executor.submit(_list_subcollections, reference)
+                        pending[listing] = ("list", pattern, key + (doc_index,), depth, reference)
+                else:
+                    for sub_index, subcollection in enumerate(future.result()):
+                        sub_pattern = f"{pattern}/*/{subcollection.id}"
+                        if sampled.get(sub_pattern, 0) < max_fanout:
+                            sub_path = f"{reference.path}/{subcollection.id}"
+                            submit_sample(subcollection, sub_pattern, key + (sub_index,), depth + 1, sub_path)
+
+    if snapshots is not None:
+        snapshots.save()
+        summary = ", ".join(f"{count} {outcome}" for outcome, count in sorted(snapshots.outcomes.items()))
+        print(f"Refreshed collections from snapshots: {summary}")
+
+    merged_profiles = {}
+    for _, pattern, profile in sorted(samples, key=lambda sample: sample[0]):
+        merged_profiles.setdefault(pattern, CollectionProfile()).merge(profile)
+
     schema = {}
-    collections = db.collections()
-    for collection in collections:
-        collection_name = collection.id
-        schema[collection_name] = []
-        docs = collection.limit(50).stream()
-        for doc in docs:
-            doc_data = doc.to_dict()
-            for field in doc_data.keys():
-                if field not in schema[collection_name]:
-                    schema[collection_name].append(field)
+    for pattern, profile in merged_profiles.items():
+        schema[pattern] = profile.field_names()
+        if profiles is not None:
+            profiles[pattern] = profile
+        if stats is not None:
+            stats[pattern] = {"documents": profile.documents, "reads": profile.reads, "coverage": profile.coverage()}
     return schema
 
+# Version of the relationship prompt templates, part of the cache keys: bump it when a prompt changes
+RELATIONSHIPS_PROMPT_VERSION = 1
+
+# Structured output returned by the batched relationship requests
+RELATIONSHIPS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "relationships",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "relationships": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "collection": {"type": "string"},
+                            "field": {"type": "string"},
+                            "related_collection": {"type": "string"},
+                        },
+                        "required": ["collection", "field", "related_collection"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["relationships"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def _collection_prompt(schema_context, collection):
+    """
+    Returns the prompt asking for the foreign key relationships of a single collection.
+    """
+    return (
+        f"Given the following schema:\n\n{schema_context}\n\n"
+        f"Identify any foreign key relationships within the fields of the collection '{collection}'. "
+        f"Provide the field name and the related collection if possible. Do not share any relationships that are not present in the provided schema." 
+        f"If no relationships are found, respond with None and nothing else."
+    )
+
+def _format_prompt(related_collections_text):
+    """
+    Returns the prompt asking to format the relationships found for a collection as a dict.
+    """
+    return (
+        "Given the identified relationships, convert this into a Python dict format where each entry is a tuple with the fields and related collection. Do not share anything other than the dict as an output."
+        '{{"field_name": "related_collection"}}. Example: {{"userId": "users", "orderId": "orders"}}'
+        "RELATIONSHIPS:"
+        f"{related_collections_text}"
+        "DICT OUTPUT:"
+    )
+
+def _parse_formatted_relationships(format_output):
+    """
+    Parses the dict returned by the formatting request into (field name, related collection) tuples.
+    """
+    formatted_output = format_output.strip()[10:-4]
+    print(formatted_output)
+    formatted_relationships = json.loads(formatted_output)
+    return [(k, v) for k, v in formatted_relationships.items()]
+
+def _batch_prompt(schema_context, collections):
+    """
+    Returns the prompt asking for the foreign key relationships of several collections at once.
+    """
+    collection_list = "\n".join(f"- {collection}" for collection in collections)
+    return (
+        f"Given the following schema:\n\n{schema_context}\n\n"
+        f"Identify any foreign key relationships within the fields of each of these collections:\n{collection_list}\n\n"
+        "For each relationship, provide the collection, the field name and the related collection. "
+        "Do not share any relationships that are not present in the provided schema. "
+        "If no relationships are found, respond with an empty list."
+    )
+
+def _batch_request(schema_context, collections):
+    """
+    Returns the arguments of the structured-output request for a batch of collections.
+    """
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [{"role": "user", "content": _batch_prompt(schema_context, collections)}],
+        "response_format": RELATIONSHIPS_RESPONSE_FORMAT,
+        "max_tokens": min(16384, 256 + 128 * len(collections)),
+    }
+
+def _parse_batch_relationships(schema, collections, content):
+    """
+    Maps the structured output of a batch request to the relationships of each requested collection.
+
+    Relationships on unknown fields or to unknown collections are dropped.
+    """
+    relationships = {collection: [] for collection in collections}
+    for relationship in json.loads(content)["relationships"]:
+        collection = relationship["collection"]
+        field = relationship["field"].strip()
+        related_collection = relationship["related_collection"].strip()
+        if collection in relationships and field in schema[collection] and related_collection in schema:
+            relationships[collection].append((field, related_collection))
+    return relationships
+
+def _record_completion(response, seconds):
+    """
+    Records a chat completion, its duration and its token usage in the metrics of the run.
+    """
+    instrumentation.count("api_calls_total", service="openai", call="chat.completions")
+    instrumentation.observe("llm_request_seconds", seconds)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        instrumentation.count("llm_tokens_total", usage.prompt_tokens or 0, kind="prompt")
+        instrumentation.count("llm_tokens_total", usage.completion_tokens or 0, kind="completion")
+
+def _openai_client():
+    """
+    Returns the synchronous OpenAI client, creating it on first use.
+    """
+    global client
+    if client is None:
+        from openai import OpenAI
+
+        client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+    return client
+
+def _create_completion(**request):
+    """
+    Sends a chat completion request with the synchronous client, recording it in the metrics of the run.
+    """
+    start = time.perf_counter()
+    response = _openai_client().chat.completions.create(**request)
+    _record_completion(response, time.perf_counter() - start)
+    return response
+
+def _identify_collection_relationships(schema_context, collection):
+    """
+    Asks the LLM for the foreign key relationships of a single collection, then for a dict formatting them.
+
+    Args:
+        schema_context (str): The schema of the database, as JSON.
+        collection (str): The name of the collection.
+
+    Returns:
+        list: Tuples of the field name and the related collection name.
+    """
+    response = _create_completion(
+        model=OPENAI_MODEL,
+        messages=[{"role": "user", "content": _collection_prompt(schema_context, collection)}],
+        max_tokens=512
+    )
+    related_collections_text = response.choices[0].message.content.strip()
+    print(related_collections_text)
+
+    if not related_collections_text or ("None" in related_collections_text):
+        return []
+
+    # Use another OpenAI call to format the response appropriately
+    format_response = _create_completion(
+        model=OPENAI_MODEL,
+        messages=[{"role": "user", "content": _format_prompt(related_collections_text)}],
+        max_tokens=150
+    )
+    return _parse_formatted_relationships(format_response.choices[0].message.content)
+
+def _identify_batch_relationships(schema, schema_context, collections):
+    """
+    Asks the LLM for the foreign key relationships of several collections in a single structured-output request.
+
+    Args:
+        schema (dict): The schema of the database.
+        schema_context (str): The schema of the database, as JSON.
+        collections (list): The names of the collections to identify relationships for.
+
+    Returns:
+        dict: The relationships of each requested collection, as lists of (field name, related collection) tuples.
+    """
+    response = _create_completion(**_batch_request(schema_context, collections))
+    return _parse_batch_relationships(schema, collections, response.choices[0].message.content)
+
+def _relationship_cache(cache):
+    """
+    Returns the cache of relationship results to use: the given DiskCache, the default cache in
+    RELATIONSHIPS_CACHE_DIR if `cache` is None, or no cache if `cache` is False.
+    """
+    if cache is None and RELATIONSHIPS_CACHE_DIR:
+        return DiskCache(RELATIONSHIPS_CACHE_DIR, RELATIONSHIPS_CACHE_MAX_BYTES, RELATIONSHIPS_CACHE_MAX_AGE)
+    return cache or None
+
+def _relationship_cache_keys(schema, schema_contexts, batch_size):
+    """
+    Returns the cache key of the relationships of each collection.
+
+    A key covers everything the result of a collection depends on: the model, the version of the prompt
+    templates, the way it is requested, the fields of the collection and its schema context.
+    """
+    mode = "batch" if batch_size else "collection"
+    return {
+        collection: content_key(
+            OPENAI_MODEL, RELATIONSHIPS_PROMPT_VERSION, mode, collection, schema[collection], schema_context
+        )
+        for collection, schema_context in schema_contexts.items()
+    }
+
+def _load_cached_relationships(cache, keys):
+    """
+    Returns the cached relationships of the collections whose cache key is found in the cache.
+    """
+    relationships = {}
+    if cache is not None:
+        for collection, key in keys.items():
+            cached = cache.get_json(key)
+            if cached is not None:
+                relationships[collection] = [tuple(relationship) for relationship in cached]
+    return relationships
+
+def _store_relationships(cache, keys, relationships):
+    """
+    Stores the relationships of collections in the cache.
+
+    Results are stored as soon as each request completes, so that an interrupted run only sends the
+    requests that had not completed when it is started again. Stale entries are evicted by the caller
+    once every request completed.
+    """
+    if cache is None:
+        return
+    for collection, collection_relationships in relationships.items():
+        cache.set_json(keys[collection], collection_relationships)
+
+def _plan_relationship_requests(schema, collections, batch_size, context_budget, cache, stats):
+    """
+    Looks up the cached relationships and plans the requests for the other collections.
+
+    Each request gets a schema context pruned to the given token budget (see `prompt_context.build_context`),
+    unless the full schema fits in it.
+
+    Args:
+        schema (dict): The schema of the database.
+        collections (list): The collections to identify relationships for.
+        batch_size (int): The number of collections per request, or 0 for one collection per request.
+        context_budget (int): The token budget of the schema context of a prompt, or 0 for the full schema.
+        cache (DiskCache): The cache of relationship results, or None.
+        stats (dict): An optional dictionary filled with the number of requests and the estimated tokens
+                      of their schema contexts, compared to sending the full schema in every prompt.
+
+    Returns:
+        tuple: The cache keys of the collections, the cached relationships, and the planned requests
+               as (collections, schema context) tuples.
+    """
+    full_context = json.dumps(schema, indent=2)
+    prune = context_budget and estimate_tokens(full_context) > context_budget
+    index = build_collection_index(schema) if prune else None
+
+    def schema_context(collections):
+        return build_context(schema, collections, context_budget, index) if prune else full_context
+
+    collection_contexts = {collection: schema_context([collection]) for collection in collections}
+    keys = _relationship_cache_keys(schema, collection_contexts, batch_size)
+    relationships = _load_cached_relationships(cache, keys)
+    pending = [collection for collection in collections if collection not in relationships]
+
+    if batch_size:
+        batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        requests = [(batch, schema_context(batch)) for batch in batches]
+    else:
+        requests = [([collection], collection_contexts[collection]) for collection in pending]
+
+    context_tokens = sum(estimate_tokens(context) for _, context in requests)
+    full_context_tokens = estimate_tokens(full_context) * len(requests)
+    print(
+        f"{len(relationships)} collections found in the relationship cache, {len(requests)} requests to send "
+        f"with {context_tokens} tokens of schema context ({full_context_tokens - context_tokens} saved)\n"
+    )
+    if stats is not None:
+        stats.update({
+            "cached": len(relationships),
+            "requests": len(requests),
+            "context_tokens": context_tokens,
+            "full_context_tokens": full_context_tokens,
+            "tokens_saved": full_context_tokens - context_tokens,
+        })
+    return keys, relationships, requests
+
+async def _create_completion_async(async_client, limiter, semaphore, max_retries, request):
+    """
+    Sends a chat completion request through the rate limiter, retrying on rate limits and server errors.
+
+    Args:
+        async_client (AsyncOpenAI): The asynchronous OpenAI client.
+        limiter (RateLimiter): The limiter for requests and tokens per minute.
+        semaphore (asyncio.Semaphore): The semaphore bounding the number of requests in flight.
+        max_retries (int): The maximum number of retries of a failed request.
+        request (dict): The arguments of `chat.completions.create`.
+
+    Returns:
+        The chat completion.
+    """
+    from openai import APIConnectionError, APIStatusError
+
+    # Roughly 4 characters per token, plus the completion tokens the request may use
+    tokens = sum(estimate_tokens(message["content"]) for message in request["messages"]) + request["max_tokens"]
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(tokens)
+        try:
+            async with semaphore:
+                start = time.perf_counter()
+                response = await async_client.chat.completions.create(**request)
+            _record_completion(response, time.perf_counter() - start)
+            return response
+        except (APIStatusError, APIConnectionError) as error:
+            status_code = getattr(error, "status_code", None)
+            retryable = status_code is None or status_code == 429 or status_code >= 500
+            if not retryable or attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            retry_after = error.response.headers.get("retry-after") if status_code else None
+            if retry_after and retry_after.replace(".", "", 1).isdigit():
+                delay = max(delay, float(retry_after))
+            print(f"Request failed ({status_code or error.__class__.__name__}), retrying in {delay:.1f}s")
+            instrumentation.count("llm_retries_total", reason=str(status_code or error.__class__.__name__))
+            await asyncio.sleep(delay)
+
+async def _identify_collection_relationships_async(create, schema_context, collection):
+    """
+    Asynchronous version of `_identify_collection_relationships`, sending the same requests.
+    """
+    response = await create({
+        "model": OPENAI_MODEL,
+        "messages": [{"role": "user", "content": _collection_prompt(schema_context, collection)}],
+        "max_tokens": 512,
+    })
+    related_collections_text = response.choices[0].message.content.strip()
+    print(f"Collection: {collection}\n{related_collections_text}\n")
+
+    if not related_collections_text or ("None" in related_collections_text):
+        return []
+
+    format_response = await create({
+        "model": OPENAI_MODEL,
+        "messages": [{"role": "user", "content": _format_prompt(related_collections_text)}],
+        "max_tokens": 150,
+    })
+    return _parse_formatted_relationships(format_response.choices[0].message.content)
+
+async def identify_relationships_llm_async(schema, batch_size=RELATIONSHIPS_BATCH_SIZE,
+                                           concurrency=RELATIONSHIPS_CONCURRENCY,
+                                           requests_per_minute=OPENAI_REQUESTS_PER_MINUTE,
+                                           tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+                                           max_retries=OPENAI_MAX_RETRIES, async_client=None, cache=None,
+                                           context_budget=RELATIONSHIPS_CONTEXT_BUDGET, stats=None, collections=None):
+    """
+    Identifies foreign key relationships like `identify_relationships_llm`, sending the requests concurrently.
+
+    Requests go through a token-bucket limiter for both requests and tokens per minute, at most `concurrency`
+    requests are in flight, and requests failing with a rate limit (429), a server error (5xx) or a connection
+    error are retried with exponential backoff. The prompts, and therefore the result, are the same as in
+    the sequential version.
+
+    Args:
+        schema (dict): A dictionary representing the schema of a Firestore database.
+        batch_size (int): The number of collections per structured-output request, or 0 to ask about one
+                          collection at a time. Defaults to RELATIONSHIPS_BATCH_SIZE.
+        concurrency (int): The maximum number of requests in flight. Defaults to RELATIONSHIPS_CONCURRENCY.
+        requests_per_minute (int): The request rate limit, or 0 for no limit. Defaults to OPENAI_REQUESTS_PER_MINUTE.
+        tokens_per_minute (int): The token rate limit, or 0 for no limit. Defaults to OPENAI_TOKENS_PER_MINUTE.
+        max_retries (int): The maximum number of retries of a failed request. Defaults to OPENAI_MAX_RETRIES.
+        async_client (AsyncOpenAI): The client to send requests with. Defaults to a client for OPENAI_BASE_URL.
+        cache (DiskCache): The cache of relationship results. Defaults to the cache in RELATIONSHIPS_CACHE_DIR;
+                           False disables caching.
+        context_budget (int): The token budget of the schema context of a prompt, or 0 to always send the
+                              full schema. Defaults to RELATIONSHIPS_CONTEXT_BUDGET.
+        stats (dict): An optional dictionary filled with the number of requests and the estimated tokens
+                      of their schema contexts, including the tokens saved by pruning them.
+        collections (list): The collections to identify relationships for. Defaults to every collection.
+
+    Returns:
+        dict: A dictionary where each key represents a collection name and the value is a list of tuples.
+              Each tuple contains the field name and the related collection name for a foreign key relationship.
+    """
+    cache = _relationship_cache(cache)
+    collections = list(schema) if collections is None else collections
+    keys, relationships, requests = _plan_relationship_requests(
+        schema, collections, batch_size, context_budget, cache, stats
+    )
+
+    if requests:
+        if async_client is None:
+            from openai import AsyncOpenAI
+
+            # Retries are handled here, so that they go through the rate limiter
+            async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def create(request):
+            return await _create_completion_async(async_client, limiter, semaphore, max_retries, request)
+
+        identified = {}
+        if batch_size:
+            async def identify_batch(batch, schema_context):
+                response = await create(_batch_request(schema_context, batch))
+                batch_relationships = _parse_batch_relationships(schema, batch, response.choices[0].message.content)
+                _store_relationships(cache, keys, batch_relationships)
+                return batch_relationships
+
+            results = await asyncio.gather(*(identify_batch(batch, context) for batch, context in requests))
+            for batch_relationships in results:
+                identified.update(batch_relationships)
+        else:
+            async def identify_collection(collection, schema_context):
+                result = await _identify_collection_relationships_async(create, schema_context, collection)
+                _store_relationships(cache, keys, {collection: result})
+                return result
+
+            results = await asyncio.gather(*(identify_collection(batch[0], context) for batch, context in requests))
+            identified = {batch[0]: result for (batch, _), result in zip(requests, results)}
+
+        if cache is not None:
+            cache.evict()
+        relationships.update(identified)
+
+    # Keep the order of the collections in the schema, like the sequential version
+    return {collection: relationships[collection] for collection in collections}
+
 # Function to identify relationships using LLM with full document schema context
-def identify_relationships_llm(schema):
+def identify_relationships_llm(schema, batch_size=RELATIONSHIPS_BATCH_SIZE, concurrency=RELATIONSHIPS_CONCURRENCY, cache=None,
+                               context_budget=RELATIONSHIPS_CONTEXT_BUDGET, stats=None, collections=None):
     """
     Identifies foreign key relationships within the fields of each collection in the given schema.
 
+    By default every collection costs two sequential requests: one asking for its relationships and one
+    formatting the answer as a dict. With a `batch_size`, collections are sent in batches and the LLM
+    answers with structured output (JSON schema), so N collections cost N / batch_size requests.
+    With a `concurrency` greater than 1, the requests are sent concurrently by
+    `identify_relationships_llm_async`, which returns the same result.
+
+    Results are cached on disk per collection, keyed by a hash of the model, the prompt version, the fields
+    of the collection and the schema context, so only collections whose inputs changed are sent to the LLM.
+
+    When the schema is larger than `context_budget` tokens, each prompt only contains the fields of the collections
+    it asks about, the key fields of the collections ranked most likely related by lexical matching (`userId` ->
+    `users`) and the names of other collections, instead of the whole schema. This keeps the total number of tokens
+    linear in the number of collections.
+
     Args:
         schema (dict): A dictionary representing the schema of a Firestore database. Each key-value pair
                        represents a collection name and its corresponding fields.
+        batch_size (int): The number of collections per structured-output request, or 0 to ask about one
+                          collection at a time. Defaults to RELATIONSHIPS_BATCH_SIZE.
+        concurrency (int): The maximum number of requests in flight. Defaults to RELATIONSHIPS_CONCURRENCY.
+        cache (DiskCache): The cache of relationship results. Defaults to the cache in RELATIONSHIPS_CACHE_DIR;
+                           False disables caching.
+        context_budget (int): The token budget of the schema context of a prompt, or 0 to always send the
+                              full schema. Defaults to RELATIONSHIPS_CONTEXT_BUDGET.
+        stats (dict): An optional dictionary filled with the number of requests and the estimated tokens
+                      of their schema contexts, including the tokens saved by pruning them.
+        collections (list): The collections to identify relationships for. Defaults to every collection.
 
     Returns:
         dict: A dictionary where each key represents a collection name and the value is a list of tuples.
               Each tuple contains the field name and the related collection name for a foreign key relationship.
     """
-    relationships = {}
-    schema_context = json.dumps(schema, indent=2)
+    if concurrency > 1:
+        return asyncio.run(identify_relationships_llm_async(
+            schema, batch_size=batch_size, concurrency=concurrency, cache=cache,
+            context_budget=context_budget, stats=stats, collections=collections,
+        ))
 
-    for collection, fields in schema.items():
-        print(f"Collection: {collection}\n\n")
-        relationships[collection] = []
-        prompt = (
-            f"Given the following schema:\n\n{schema_context}\n\n"
-            f"Identify any foreign key relationships within the fields of the collection '{collection}'. "
-            f"Provide the field name and the related collection if possible. Do not share any relationships that are not present in the provided schema." 
-            f"If no relationships are found, respond with None and nothing else."
-        )
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=512
-        )
-        related_collections_text = response.choices[0].message.content.strip()
-        print(related_collections_text)
-        
-        if related_collections_text and ("None" not in related_collections_text):
-            # Use another OpenAI call to format the response appropriately
-            format_prompt = (
-                "Given the identified relationships, convert this into a Python dict format where each entry is a tuple with the fields and related collection. Do not share anything other than the dict as an output."
-                '{{"field_name": "related_collection"}}. Example: {{"userId": "users", "orderId": "orders"}}'
-                "RELATIONSHIPS:"
-                f"{related_collections_text}"
-                "DICT OUTPUT:"
-            )
-            format_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": format_prompt}],
-                max_tokens=150
-            )
-            formatted_output = format_response.choices[0].message.content.strip()[10:-4]
-            print(formatted_output)
-            formatted_relationships = json.loads(formatted_output)
-
-            formatted_relationships = [(k, v) for k, v in formatted_relationships.items()]
-            relationships[collection].extend(formatted_relationships)
-
-        i += 1
+    cache = _relationship_cache(cache)
+    collections = list(schema) if collections is None else collections
+    keys, relationships, requests = _plan_relationship_requests(
+        schema, collections, batch_size, context_budget, cache, stats
+    )
+
+    identified = {}
+    for batch, schema_context in requests:
+        if batch_size:
+            print(f"Collections: {', '.join(batch)}\n\n")
+            batch_relationships = _identify_batch_relationships(schema, schema_context, batch)
+            print(batch_relationships)
+        else:
+            print(f"Collection: {batch[0]}\n\n")
+            batch_relationships = {batch[0]: _identify_collection_relationships(schema_context, batch[0])}
+        identified.update(batch_relationships)
+        _store_relationships(cache, keys, batch_relationships)
         print("\n\n")
-    
+
+    if cache is not None and requests:
+        cache.evict()
+    relationships.update(identified)
+    return {collection: relationships[collection] for collection in collections}
+
+def identify_relationships(schema, profiles=None, use_llm=True, collections=None, **llm_options):
+    """
+    Identifies foreign key relationships with local rules first, escalating only unresolved fields to the LLM.
+
+    Relationships found by `heuristics.detect_relationships` (DocumentReference values and `<singular>Id`
+    field names) are kept as is. The LLM is only asked about the collections with unresolved fields, and
+    only sees those fields for them, while the rest of the schema is still available as context.
+
+    Args:
+        schema (dict): A dictionary representing the schema of a Firestore database.
+        profiles (dict): Optional CollectionProfile of each collection, as filled by `get_schema`.
+        use_llm (bool): Whether to send the unresolved fields to the LLM. Default is True.
+        collections (list): The collections whose relationships are identified. Defaults to every collection;
+                            the whole schema is still used to resolve them.
+        **llm_options: Keyword arguments passed to `identify_relationships_llm`.
+
+    Returns:
+        dict: A dictionary where each key represents a collection name and the value is a list of tuples.
+              Each tuple contains the field name and the related collection name for a foreign key relationship.
+    """
+    relationships, unresolved = detect_relationships(schema, profiles, collections)
+    print(
+        f"{sum(len(rels) for rels in relationships.values())} relationships detected locally, "
+        f"{sum(len(fields) for fields in unresolved.values())} fields left unresolved\n"
+    )
+    if not use_llm or not unresolved:
+        return relationships
+
+    llm_schema = {collection: unresolved.get(collection, fields) for collection, fields in schema.items()}
+    llm_relationships = identify_relationships_llm(llm_schema, collections=list(unresolved), **llm_options)
+    for collection, collection_relationships in llm_relationships.items():
+        for field, related_collection in collection_relationships:
+            if field in unresolved[collection]:
+                relationships[collection].append((field, related_collection))
     return relationships
 
 
-def create_schema_graph_llm(schema, relationships):
+def _dot_id(name):
+    """
+    Returns a name as a quoted DOT identifier.
+    """
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _dot_record_text(text):
+    """
+    Escapes the characters with a meaning in DOT record labels.
+    """
+    for character in '\\{}|<>"':
+        text = text.replace(character, "\\" + character)
+    return text
+
+def _field_label(field, profile):
+    """
+    Returns the label of a field, with its observed types and optionality when the profile knows it.
+    """
+    if profile is not None and field in profile.fields:
+        types = " | ".join(profile.field_types(field))
+        optional = " [0..1]" if profile.is_optional(field) else ""
+        return f"{field} : {types}{optional}"
+    return field
+
+def iter_dot_lines(schema, relationships, profiles=None, stubs=None):
+    """
+    Generates the DOT text of the schema graph line by line.
+
+    Each collection is a record node listing its fields, each relationship an edge labelled with its
+    field. Stubs are dashed nodes labelled with where they are detailed.
+
+    Args:
+        schema (dict): The schema of the database.
+        relationships (dict): The relationships between collections.
+        profiles (dict): Optional CollectionProfile of each collection, see `generate_plantuml_text`.
+        stubs (dict): Collections drawn outside of the schema, see `create_schema_graph_llm`.
+
+    Yields:
+        str: The lines of the DOT text.
+    """
+    yield "digraph G {"
+    yield "  node [shape=record];"
+    for collection, fields in schema.items():
+        profile = (profiles or {}).get(collection)
+        rows = "".join(_dot_record_text(_field_label(field, profile)) + "\\l" for field in fields) \
+            if isinstance(fields, list) else ""
+        yield f'  {_dot_id(collection)} [label="{{{_dot_record_text(collection)}|{rows}}}"];'
+    for collection, location in (stubs or {}).items():
+        label = _dot_id(f"{collection}\n({location})").replace("\n", "\\n")
+        yield f'  {_dot_id(collection)} [shape=box, style=dashed, label={label}];'
+    for collection, rels in relationships.items():
+        for field, related_collection in rels:
+            related_collection = related_collection.strip()
+            style = ", style=dashed" if collection in (stubs or {}) or related_collection in (stubs or {}) else ""
+            yield f'  {_dot_id(collection)} -> {_dot_id(related_collection)} [label={_dot_id(field.strip())}{style}];'
+    yield "}"
+
+def create_schema_graph_llm(schema, relationships, cache=None, output_file=None, stubs=None, profiles=None):
     """
     Creates a schema graph for Firestore collections and their relationships.
 
@@ -103,6 +1025,12 @@ def create_schema_graph_llm(schema, relationships):
             and the values are dictionaries representing the fields of each collection.
         relationships (dict): A dictionary representing the relationships between collections, where the keys are
             collection names and the values are lists of tuples representing the fields and related collections.
+        cache (DiskCache): The cache of rendered diagrams. Defaults to a cache in RENDER_CACHE_DIR;
+            False renders the graph every time.
+        output_file (str): The path to the PNG image. Defaults to a timestamped name in the current directory.
+        stubs (dict): Collections drawn outside of the schema, as dashed nodes labelled with where they are
+            detailed, e.g. the other partitions of a partitioned schema (see `partition.py`).
+        profiles (dict): Optional CollectionProfile of each collection, see `generate_plantuml_text`.
 
     Returns:
         None
@@ -129,26 +1057,58 @@ def create_schema_graph_llm(schema, relationships):
         }
         create_schema_graph_llm(schema, relationships)
 
-    This function creates a directed graph using the pydot library to visualize the schema and relationships
-    between Firestore collections. Each collection is represented as a node, and each relationship is represented
-    as an edge with a label indicating the field name.
+    This function creates a directed graph to visualize the schema and relationships between Firestore collections.
+    Each collection is represented as a record node listing its fields, and each relationship is represented
+    as an edge with a label indicating the field name. The DOT text is streamed by `iter_dot_lines` to a
+    temporary file and laid out by a single Graphviz invocation, so memory stays flat on large schemas.
 
     The resulting graph is saved as a PNG image named 'firestore_schema_llm.png' in the current directory.
+    An unchanged graph is not laid out again: the image cached for the same DOT source is reused.
+    """
+    if output_file is None:
+        # Append filename with timestamp
+        output_file = f'firestore_schema_llm_{datetime.now().strftime("%Y%m%d%H%M%S")}.png'
+    render_dot(iter_dot_lines(schema, relationships, profiles, stubs), output_file, "png", cache)
+
+def plantuml_name(collection):
+    """
+    Returns the name of a collection as a PlantUML class name, quoted when it is a path pattern.
+    """
+    return collection if collection.isidentifier() else f'"{collection}"'
+
+def iter_plantuml_lines(schema, relationships, profiles=None, stubs=None):
+    """
+    Generates the PlantUML text of the schema line by line, see `generate_plantuml_text`.
+
+    Yields:
+        str: The lines of the PlantUML text.
     """
-    graph = pydot.Dot(graph_type='digraph')
+    yield "@startuml"
 
+    # Create class definitions for each collection
     for collection, fields in schema.items():
-        node = pydot.Node(collection)
-        graph.add_node(node)
-        
-        for field, related_collection in relationships.get(collection, []):
-            edge = pydot.Edge(collection, related_collection.strip(), label=field.strip())
-            graph.add_edge(edge)
+        yield f"class {plantuml_name(collection)} {{"
+        profile = (profiles or {}).get(collection)
+        if isinstance(fields, list):
+            for field in fields:
+                yield f"  {_field_label(field, profile)}"
+        else:
+            yield "  // Invalid schema format"
+        yield "}"
 
-    # Append filename with timestamp
-    graph.write_png(f'firestore_schema_llm_{datetime.now().strftime("%Y%m%d%H%M%S")}.png')
+    # Create stub classes for the collections detailed elsewhere
+    for collection, location in (stubs or {}).items():
+        yield f"class {plantuml_name(collection)} <<{location}>>"
 
-def generate_plantuml_text(schema, relationships, generate_diagram=False, output_file=None):
+    # Create relationships
+    for collection, rels in relationships.items():
+        for field, related_collection in rels:
+            yield f"{plantuml_name(collection)} --> {plantuml_name(related_collection)} : {field}"
+
+    yield "@enduml"
+
+def generate_plantuml_text(schema, relationships, generate_diagram=False, output_file=None, profiles=None,
+                           backend=PLANTUML_BACKEND, cache=None, stubs=None):
     """
     Generates PlantUML text for Firestore collections and their relationships.
     
@@ -159,60 +1119,86 @@ def generate_plantuml_text(schema, relationships, generate_diagram=False, output
                               collection names and the values are lists of tuples representing the fields and related collections.
         generate_diagram (bool): Whether to generate a UML diagram. Default is False.
         output_file (str): The path to the output file for the UML diagram. Required if generate_diagram is True.
+        profiles (dict): Optional CollectionProfile of each collection, as filled by `get_schema`. When given,
+                         fields are rendered with their observed types, and optional fields are marked [0..1].
+        backend (str): How the UML diagram is rendered, see `generate_uml_diagram`. Defaults to PLANTUML_BACKEND.
+        cache (DiskCache): The cache of rendered diagrams, see `generate_uml_diagram`.
+        stubs (dict): Collections drawn outside of the schema, as empty classes stereotyped with where they
+                      are detailed, e.g. the other partitions of a partitioned schema (see `partition.py`).
     
     Returns:
         str: The PlantUML text representing the schema and relationships.
     """
-    uml_lines = ["@startuml"]
-
-    # Create class definitions for each collection
-    for collection, fields in schema.items():
-        uml_lines.append(f"class {collection} {{")
-        if isinstance(fields, list):
-            for field in fields:
-                uml_lines.append(f"  {field}")
-        else:
-            uml_lines.append("  // Invalid schema format")
-        uml_lines.append("}")
-
-    # Create relationships
-    for collection, rels in relationships.items():
-        for field, related_collection in rels:
-            uml_lines.append(f"{collection} --> {related_collection} : {field}")
-
-    uml_lines.append("@enduml")
-    plantuml_text = "\n".join(uml_lines)
+    plantuml_text = "\n".join(iter_plantuml_lines(schema, relationships, profiles, stubs))
 
     if generate_diagram:
         if output_file is None:
             raise ValueError("output_file must be specified if generate_diagram is True")
-        generate_uml_diagram(plantuml_text, output_file)
+        generate_uml_diagram(plantuml_text, output_file, backend=backend, cache=cache)
 
     return plantuml_text
 
-def generate_uml_diagram(plantuml_text, output_file):
+def _render_plantuml_web(plantuml_file):
+    """
+    Renders a PlantUML file to PNG bytes with the PlantUML server.
+    """
+    from plantuml import PlantUML
+
+    plantuml = PlantUML(url=PLANTUML_SERVER_URL)
+    plantuml.processes_file(plantuml_file, outfile=plantuml_file + ".png")
+
+    generated_file = plantuml_file + ".png"
+    with open(generated_file, "rb") as diagram_file:
+        image = diagram_file.read()
+    os.remove(generated_file)
+    return image
+
+def generate_uml_diagram(plantuml_text, output_file, backend=PLANTUML_BACKEND, cache=None):
     """
     Generates a UML diagram from PlantUML text.
+
+    The text is streamed to a temporary file next to the output and hashed on the way, and the renderer
+    reads it from there, so the lines of a large diagram are never joined in memory.
     
     Args:
-        plantuml_text (str): The PlantUML text.
-        output_file (str): The path to the output file.
+        plantuml_text (str or iterable): The PlantUML text, or its lines, e.g. from `iter_plantuml_lines`.
+        output_file (str): The path to the output file. With the local backend, a `.svg` extension renders SVG.
+        backend (str): 'web' to render with the public PlantUML server, or 'local' to render with a warm
+                       local plantuml.jar process (see `render.py`). Defaults to PLANTUML_BACKEND.
+        cache (DiskCache): The cache of rendered diagrams. Defaults to a cache in RENDER_CACHE_DIR;
+                           False renders the diagram every time.
     
     Returns:
         None
     """
-    plantuml = PlantUML(url='http://www.plantuml.com/plantuml/img/')
+    if backend == "local":
+        fmt = "svg" if output_file.lower().endswith(".svg") else "png"
+        render = lambda: render_plantuml_files([plantuml_file], fmt)[0]
+    elif backend == "web":
+        fmt = "png"
+        render = lambda: _render_plantuml_web(plantuml_file)
+    else:
+        raise ValueError(f"Unknown PlantUML backend: {backend}")
 
-    # Write the PlantUML text to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".puml") as temp_file:
-        temp_file.write(plantuml_text.encode('utf-8'))
-        temp_file_path = temp_file.name
+    lines = plantuml_text.strip().splitlines() if isinstance(plantuml_text, str) else plantuml_text
+    plantuml_file, digest = spool_lines(lines, os.path.dirname(os.path.abspath(output_file)), ".puml")
+    try:
+        cached = render_cached(None, backend, fmt, output_file, render, cache, digest)
+    finally:
+        os.remove(plantuml_file)
+    if cached:
+        print(f"UML diagram unchanged, reused the cached rendering for {output_file}")
+    else:
+        print(f"UML diagram saved as {output_file}")
 
-    # Generate the UML diagram from the temporary file
-    plantuml.processes_file(temp_file_path)
+def generate_plantuml_diagram(schema, relationships, output_file, profiles=None, backend=PLANTUML_BACKEND,
+                              cache=None, stubs=None):
+    """
+    Generates the UML diagram of a schema, streaming its PlantUML text to the renderer line by line instead
+    of building it, see `generate_plantuml_text` for the arguments.
 
-    # Move the generated diagram to the specified output file
-    generated_file = temp_file_path.replace(".puml", ".png")
-    os.rename(generated_file, output_file)
-    os.remove(temp_file_path)
-    print(f"UML diagram saved as {output_file}")
\ No newline at end of file
+    Returns:
+        None
+    """
+    generate_uml_diagram(iter_plantuml_lines(schema, relationships, profiles, stubs), output_file, backend=backend,
+                         cache=cache)